@@ -8,21 +8,50 @@
 @date: october 2021
 @usage: python autocalibration_sample_ble.py <module> <nodes_configuration_label> <n_samples>
 
-        # where <module> is the module id with DW1234 format
+        # where <module> is the module id with DW1234 format, or 'all' to calibrate
+                every anchor of the nodes configuration in a single run
                 <nodes_configuration_label> is a yaml file which includes nets, 
                 tag ids, anchor ids and anchor coords
                 <n_samples> samples to save when retrieving ranges
+        Optional flags:
+            --params-dir DIR        directory with nodes_cfg/ and operation mode yaml files (default params/ of
+                                    the enclosing dwm1001_drivers package, or ~/catkin_ws/src/dwm1001_drivers/params)
+            --output FILE           range matrix file when <module> is 'all' (default ranging_matrix.npz)
+            --samples-output FILE   append every range sample to this sample store
+                                    (default <module>_ranging_samples.bin)
+            --confidence-interval M stop sampling a network once every anchor's mean range is known
+                                    within +/- M meters, <n_samples> becomes a hard cap
+            --min-samples N         samples per network before stopping early (default 5)
+            --localize              estimate anchor coordinates from the range matrix when <module> is 'all'
+                                    and write them to a copy of the nodes configuration file
+            --localized-output FILE updated nodes configuration (default <nodes_configuration_label>.localized.yaml
+                                    next to the original, which is never modified)
+            --dim D                 2 to keep configured anchor heights when localizing, 3 to estimate them too
+            --push                  write the estimated coordinates to the anchors with PersistedPositionMsg
+            --stats-output FILE     export BLE latency stats as json (or csv if FILE ends with .csv)
+            --record FILE           record every BLE scan result, read, write and notification to a binary trace
+            --replay FILE           run against a trace recorded with --record instead of the devices
+            --realtime              replay at the recorded timing instead of as fast as possible
 """
 
-from pathlib import Path
-from dwm1001_apiBle import BleConnectionHandler
+from dwm1001_apiBle import BleConnectionHandler, BleOperationError
 from dwm1001_apiBle import OperationModeMsg, NetworkIdMsg
 from dwm1001_apiBle import LocationDataMsg, LocationDataModeMsg
+from dwm1001_bleCodec import LOCATION_DATA_DISTANCES, parseNetworkId
+from dwm1001_bleDiscovery import DeviceCache, GattCache
+from dwm1001_bleTrace import ReplayTransport
+from dwm1001_calibration import CalibrationScheduler, parseNetworks
+from dwm1001_configPlan import DEFAULT_PARAMS_DIR, paramsPaths
+from dwm1001_sampleStore import SampleStore, readSamples, moduleIdToInt
+from dwm1001_rangeStats import AdaptiveSampler
 import yaml
-import sys
-import bleak
+import time
+import argparse
 import numpy as np
 
+# seconds allowed per requested sample before giving up on a network
+SAMPLE_TIME_BUDGET = 1.0
+
 def readYaml(file):
     with open(file, 'r') as stream:
         try:
@@ -30,55 +59,160 @@ def readYaml(file):
         except yaml.YAMLError as exc:
             print(exc)
 
+def parseArgs():
+    parser = argparse.ArgumentParser(description = 'Retrieve ranges from a DWM1001 anchor configured as tag')
+    parser.add_argument('module', help = "module id with DW1234 format, 'all' to calibrate every anchor")
+    parser.add_argument('nodes_configuration_label', nargs = '?', default = 'default',
+                        help = 'label of the nodes_cfg yaml file')
+    parser.add_argument('n_samples', nargs = '?', type = int, default = 10,
+                        help = 'samples to save when retrieving ranges')
+    parser.add_argument('--params-dir', default = DEFAULT_PARAMS_DIR,
+                        help = 'directory with nodes_cfg/ and operation mode yaml files')
+    parser.add_argument('--output', default = 'ranging_matrix.npz',
+                        help = "range matrix file when module is 'all'")
+    parser.add_argument('--samples-output', default = None,
+                        help = 'append every range sample to this sample store (default <module>_ranging_samples.bin)')
+    parser.add_argument('--confidence-interval', type = float, default = None,
+                        help = "stop sampling once every anchor's mean range is known within +/- this many meters")
+    parser.add_argument('--min-samples', type = int, default = 5,
+                        help = 'samples per network before stopping early')
+    parser.add_argument('--localize', action = 'store_true',
+                        help = "estimate anchor coordinates and write them to a copy of the nodes configuration file when module is 'all'")
+    parser.add_argument('--localized-output', default = None,
+                        help = 'updated nodes configuration file, default <nodes_configuration_label>.localized.yaml')
+    parser.add_argument('--dim', type = int, choices = [2, 3], default = 3,
+                        help = '2 to keep configured anchor heights when localizing, 3 to estimate them too')
+    parser.add_argument('--push', action = 'store_true',
+                        help = 'write the estimated coordinates to the anchors')
+    parser.add_argument('--stats-output', default = None,
+                        help = 'export BLE latency stats as json (or csv if the file ends with .csv)')
+    parser.add_argument('--record', default = None,
+                        help = 'record every BLE scan result, read, write and notification to a binary trace')
+    parser.add_argument('--replay', default = None,
+                        help = 'run against a trace recorded with --record instead of the devices')
+    parser.add_argument('--realtime', action = 'store_true',
+                        help = 'replay at the recorded timing instead of as fast as possible')
+    return parser.parse_args()
+
+def bleHandler(args, **kwargs):
+    """ BLE connection handler recording to or replaying from a trace if requested """
+    if args.replay is not None:
+        # addresses and handles come from the trace, never from the caches of this machine
+        kwargs.update(transport = ReplayTransport(args.replay, args.realtime), device_cache = DeviceCache(None),
+                      gatt_cache = GattCache(None))
+    return BleConnectionHandler(collect_stats = args.stats_output is not None, record = args.record, **kwargs)
+
+def localizeAnchors(args, scheduler, nodes_cfg, nodes_cfg_path, ble_handler, addresses):
+    """ Estimate anchor coordinates from the collected range matrix, write
+    them to the nodes configuration and optionally to the anchors
+    """
+    # scipy is only needed here, imported once anchors are localized
+    from dwm1001_selfLocalization import localize, localizedPath, referenceCoordinates, updateNodesCfg, pushPositions
+    ranges, counts = scheduler.rangeMatrix()
+    anchor_ids = scheduler.anchor_ids
+    try:
+        positions, residuals = localize(ranges, counts, referenceCoordinates(nodes_cfg, anchor_ids), args.dim)
+    except ValueError as exc:
+        print(f'Anchors could not be localized: {exc}')
+        return False
+    for anchor_id, position in zip(anchor_ids, positions):
+        print(f'{anchor_id}: [X: {position[0]:.3f} Y: {position[1]:.3f} Z: {position[2]:.3f}]')
+    print(f'Range residuals RMS {np.sqrt(np.mean(residuals ** 2)):.3f} m, max {np.max(np.abs(residuals)):.3f} m')
+    # the hand maintained configuration (comments, hex ids, layout) is never overwritten
+    output = args.localized_output if args.localized_output is not None else localizedPath(nodes_cfg_path)
+    updateNodesCfg(nodes_cfg, anchor_ids, positions)
+    with open(output, 'w') as stream:
+        yaml.safe_dump(nodes_cfg, stream, sort_keys = False)
+    print(f'Anchor coordinates written to {output}')
+    if args.push:
+        failed = ble_handler.loop.run_until_complete(pushPositions(ble_handler.async_handler, addresses, anchor_ids, positions))
+        print(f'{len(addresses) - len(failed)}/{len(anchor_ids)} anchor positions pushed')
+    return True
+
+def calibrateFleet(args, nodes_cfg, nodes_cfg_path, tag_operation_mode):
+    """ Collect the range matrix of every anchor in nodes_cfg """
+    networks = parseNetworks(nodes_cfg)
+    ble_handler = bleHandler(args, max_connections = 8)
+    sample_store = SampleStore(args.samples_output)
+    scheduler = CalibrationScheduler(ble_handler.async_handler, networks, tag_operation_mode, n_samples = args.n_samples,
+                                     sample_time_budget = SAMPLE_TIME_BUDGET, on_sample = sample_store.append,
+                                     confidence_interval = args.confidence_interval, min_samples = args.min_samples)
+    try:
+        devices_found_id = ble_handler.findDevices(scheduler.anchor_ids)
+        for anchor_id in scheduler.anchor_ids:
+            if anchor_id not in devices_found_id:
+                print(f'Module {anchor_id} not found')
+
+        start = time.monotonic()
+        try:
+            failed = ble_handler.loop.run_until_complete(scheduler.run(devices_found_id))
+        finally:
+            sample_store.close()
+        scheduler.save(args.output)
+        print(f'{len(devices_found_id) - len(failed)} anchors calibrated in {time.monotonic() - start:.1f} s '
+              f'with {scheduler.n_writes} writes and {scheduler.n_frames} samples. Range matrix saved to {args.output}, '
+              f'{sample_store.n_records} samples appended to {args.samples_output}')
+        if args.localize:
+            # positions are pushed over the connections still open from calibration
+            localizeAnchors(args, scheduler, nodes_cfg, nodes_cfg_path, ble_handler, devices_found_id)
+    finally:
+        ble_handler.close()
+    if args.stats_output is not None:
+        ble_handler.exportStats(args.stats_output)
+    return len(failed) == 0
+
+def printRangeSummary(samples_path, target_id, anchor_id_list):
+    """ Mean range from target to every anchor over all samples in the store """
+    samples = readSamples(samples_path)
+    samples = samples[samples['target'] == moduleIdToInt(target_id)]
+    print(f'{len(samples)} range samples in {samples_path}')
+    for anchor_id in anchor_id_list:
+        distances = samples['distance'][samples['anchor'] == moduleIdToInt(anchor_id)]
+        if len(distances):
+            print(f'{anchor_id}: {np.mean(distances):.3f} m ({len(distances)} samples)')
+
 def main():
+    args = parseArgs()
     # target module from which retrieve ranges
-    target_dwm_module = sys.argv[1]
-    # load nodes configuration label
-    try: nodes_configuration_label = sys.argv[2]
-    except: nodes_configuration_label = 'default'
+    target_dwm_module = args.module
     # load nodes configuration label
-    try: n_samples = int(sys.argv[2])
-    except: n_samples = 10
-
-    # load anchors cfg
-    current_path = Path(__file__).parent.resolve()
-    dwm1001_drivers_path = str(current_path.parent.parent)
-    nodes_cfg = readYaml(dwm1001_drivers_path + "/params/nodes_cfg/" + nodes_configuration_label + ".yaml")
-    # load anchors operation mode
-    anchor_operation_mode = readYaml(dwm1001_drivers_path + "/params/anchor_operation_mode.yaml")
-    # load tag operation mode
-    tag_operation_mode = readYaml(dwm1001_drivers_path + "/params/tag_operation_mode.yaml")
+    nodes_configuration_label = args.nodes_configuration_label
+    # samples to save when retrieving ranges
+    n_samples = args.n_samples
+
+    # load anchors cfg and tag operation mode, anchors get their own operation mode back
+    nodes_cfg_path, _, tag_operation_mode_path = paramsPaths(args.params_dir, nodes_configuration_label)
+    nodes_cfg = readYaml(nodes_cfg_path)
+    tag_operation_mode = readYaml(tag_operation_mode_path)
+
+    # every range sample is appended to the sample store as soon as it is received
+    if args.samples_output is None:
+        args.samples_output = f'{target_dwm_module}_ranging_samples.bin'
+
+    if target_dwm_module == 'all':
+        return calibrateFleet(args, nodes_cfg, nodes_cfg_path, tag_operation_mode)
 
     # set some node variables
     n_networks = nodes_cfg['n_networks']
     network_id_list = []
     anchor_id_list = [] # single level list
-    anchor_id_list_by_network = [] # grouped by networks
     for i in range(n_networks):
         network_cfg = nodes_cfg['network' + str(i)]
         network_id_list.append(network_cfg['network_id'])
         n_anchors = network_cfg['n_anchors']
         anchors_in_network_list = [network_cfg['anchor' + str(i) + '_id'] for i in range(n_anchors)]
-        anchor_id_list_by_network.append(anchors_in_network_list)
         anchor_id_list += anchors_in_network_list
 
-    # matrix to save ranging samples
-    n_total_anchors = len(anchor_id_list)
-    ranging_data = -np.ones((n_samples, n_total_anchors), dtype = float)
-
     # BLE connection handler
-    ble_handler = BleConnectionHandler()
+    ble_handler = bleHandler(args)
     
-    # read BT devices
-    devices = ble_handler.getDevices()
-    devices_found_id = {}
-    for dev in devices:
-        devices_found_id[dev.name] = dev.address # e.g. {'DW2020' : '00:11:22:33:FF:EE'}
+    # find target module, its cached address is used if available
+    devices_found_id = ble_handler.findDevices([target_dwm_module]) # e.g. {'DW2020' : '00:11:22:33:FF:EE'}
 
     # msgs to send through BLE
     operation_mode_msg = OperationModeMsg()
     network_id_msg = NetworkIdMsg()
-    location_data_mode_msg = LocationDataModeMsg(1)
+    location_data_mode_msg = LocationDataModeMsg()
     location_data_msg = LocationDataMsg()
 
     try:
@@ -86,49 +220,81 @@ def main():
         print(f'{target_dwm_module} has been found')
     except KeyError:
         print(f'Module {target_dwm_module} not found')
+        ble_handler.close()
+        if args.stats_output is not None:
+            ble_handler.exportStats(args.stats_output)
         return False
 
-    # configure as tag
-    print(f'Anchor -> tag. Setting operation mode ...')
-    operation_mode_msg.setData(tag_operation_mode)
-    ble_handler.send(anchor_address, operation_mode_msg)
-    
-    print(f'Setting location data mode mode ...')
-    ble_handler.send(anchor_address, location_data_mode_msg)
-    
-    for network_id in network_id_list:
-        print(f'Setting tag {target_dwm_module} network id to {network_id}')
-        network_id_msg.setData(network_id)
-        ble_handler.send(anchor_address, network_id_msg)
+    # settings restored once ranges are retrieved, whatever happens meanwhile
+    original_operation_mode = ble_handler.read(anchor_address, operation_mode_msg, decode_msg = True)
+    original_location_data_mode = ble_handler.read(anchor_address, location_data_mode_msg, decode_msg = True)
+    original_network_id = ble_handler.read(anchor_address, network_id_msg, decode_msg = True)
+    current_network_id = original_network_id
+    switched = False
+    sample_store = None
+    try:
+        # configure as tag
+        print(f'Anchor -> tag. Setting operation mode ...')
+        switched = True
+        operation_mode_msg.setData(tag_operation_mode)
+        ble_handler.send(anchor_address, operation_mode_msg)
+
+        print(f'Setting location data mode mode ...')
+        location_data_mode_msg.setData(LOCATION_DATA_DISTANCES)
+        ble_handler.send(anchor_address, location_data_mode_msg)
+
+        sample_store = SampleStore(args.samples_output)
+        for network_id in network_id_list:
+            print(f'Setting tag {target_dwm_module} network id to {network_id}')
+            # set first, a failed write may still have been applied
+            current_network_id = parseNetworkId(network_id)
+            network_id_msg.setData(network_id)
+            ble_handler.send(anchor_address, network_id_msg)
 
-        # read ranges
-        for sample_idx in range(n_samples):
+            # stream ranges, the module notifies every new location data frame.
+            # Sampling stops early once every anchor's mean range is precise enough
+            sampler = AdaptiveSampler(args.confidence_interval, max_samples = n_samples,
+                                      min_samples = min(args.min_samples, n_samples))
+            stream_deadline = time.monotonic() + n_samples * SAMPLE_TIME_BUDGET
             print(f'Retrieving ranges')
-            try:
-                location_data = ble_handler.read(anchor_address, location_data_msg, verbose=False, decode_msg=True)
-                if location_data is not None:
-                    for anchor in location_data:
-                        row_idx = anchor_id_list.index('DW' + anchor)
-                        col_idx = sample_idx
-                        ranging_data[row_idx, col_idx] = location_data[anchor]
-            except bleak.exc.BleakDBusError:
-                print(f'Connection failed. Retrying ... ')
-    
-    np.savetxt(f'{target_dwm_module}_ranging_data.txt', ranging_data)
+            while not sampler.done() and time.monotonic() < stream_deadline:
+                try:
+                    for timestamp, location_data in ble_handler.stream(anchor_address, location_data_msg,
+                                                                       n_samples = sampler.remaining(),
+                                                                       duration = stream_deadline - time.monotonic(),
+                                                                       queue_size = None):
+                        ranges = {'DW' + anchor: distance for anchor, distance in location_data.ranges().items()}
+                        sampler.update(ranges)
+                        for anchor_id, distance in ranges.items():
+                            sample_store.append(timestamp, target_dwm_module, network_id, anchor_id, distance)
+                        if sampler.done():
+                            break
+                except BleOperationError as exc:
+                    print(f'{exc}. Retrying ... ')
+            if not sampler.done():
+                print(f'Only {sampler.n_frames}/{n_samples} samples received from network {network_id}')
+            for anchor_id, (mean, std, n, n_rejected) in sorted(sampler.summary().items()):
+                print(f'{anchor_id}: {mean:.3f} +/- {std:.3f} m ({n} samples, {n_rejected} outliers rejected)')
+    finally:
+        if sample_store is not None:
+            sample_store.close()
+        # back to anchor
+        if switched:
+            if current_network_id != original_network_id:
+                print(f'Setting anchor {target_dwm_module} network id back to {original_network_id:#06x}')
+                network_id_msg.setData(original_network_id)
+                ble_handler.send(anchor_address, network_id_msg)
+            print(f'Setting anchor {target_dwm_module} operation mode and location data mode back')
+            operation_mode_msg.setData(original_operation_mode)
+            ble_handler.send(anchor_address, operation_mode_msg)
+            location_data_mode_msg.setData(original_location_data_mode)
+            ble_handler.send(anchor_address, location_data_mode_msg)
+    printRangeSummary(args.samples_output, target_dwm_module, anchor_id_list)
 
-    # back to anchor
-    anchor_operation_mode['initiator_enable'] = 1
-    network_id = None
-    for i in range(n_networks):
-        if target_dwm_module in anchor_id_list_by_network[i]:
-            network_id = network_id_list[i]
-
-    print(f'Setting anchor {target_dwm_module} network id to {network_id}')
-    network_id_msg.setData(network_id)
-    ble_handler.send(anchor_address, network_id_msg)
-    print(f'Setting anchor {target_dwm_module} operation mode')
-    operation_mode_msg.setData(anchor_operation_mode)
-    ble_handler.send(anchor_address, operation_mode_msg)
+    ble_handler.close()
+    if args.stats_output is not None:
+        ble_handler.exportStats(args.stats_output)
+        print(f'BLE stats exported to {args.stats_output}')
 
     print('Autocalibration sample has been taken successfully')
 
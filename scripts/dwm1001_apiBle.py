@@ -9,9 +9,14 @@
 @more: For more info on the documentation go to https://www.decawave.com/sites/default/files/dwm1001-api-guide.pdf
 """
 import asyncio
-from bitstring import Bits
-from textwrap import wrap
-from bleak import discover, BleakClient
+import random
+import time
+from collections import OrderedDict
+import dwm1001_bleCodec as codec
+from dwm1001_bleDiscovery import DeviceCache, GattCache
+from dwm1001_bleStats import BleStats
+from dwm1001_bleTrace import TRACE_DEVICE, RecordingTransport, TraceRecorder
+from dwm1001_bleTransport import BleakTransport, HandleClient, adapterTransport, gattHandles, negotiateMtu
 
 class DWM1001_BLE_API_COMMANDS:
         # Network Node Characteristics
@@ -37,59 +42,981 @@ class DWM1001_BLE_API_COMMANDS:
         OPERATION_MODE          = '3f0afd88-7770-46b0-b5e7-9fc099598964' # RO
         UPDATE_RATE             = '7bd47f30-5602-4389-b069-8305731308b6' # RO
 
-class BleConnectionHandler(object):
-        def __init__(self):
-                self.loop = asyncio.get_event_loop()
+class BleOperationError(Exception):
+        def __init__(self, message, n_attempts = 0):
+                """ Raised when a BLE operation still fails after retrying
+                Parameters
+                ----------
+                message: string
+                n_attempts: int
+                        attempts made before giving up
+                """
+                Exception.__init__(self, message)
+                self.n_attempts = n_attempts
 
-        def getDevices(self):
-                async def asyncGetDevices():
-                        print('Searching BT devices ...\n')
-                        devices = await discover()
+class RetryState(object):
+        def __init__(self, policy, description, on_retry = None):
+                """ Retry bookkeeping of a single operation, see RetryPolicy.start """
+                self.policy = policy
+                self.description = description
+                self.on_retry = on_retry
+                self.n_failures = 0 # consecutive failures since last progress
+                self.n_retries = 0
+                self.deadline = None if policy.deadline is None else time.monotonic() + policy.deadline
+
+        def remaining(self):
+                """ Returns
+                -------
+                remaining: float
+                        seconds left before the deadline, None if there is no deadline
+                """
+                if self.deadline is None:
+                        return None
+                return max(0.0, self.deadline - time.monotonic())
+
+        def reset(self):
+                """ Operation made progress, restart the attempt budget """
+                self.n_failures = 0
+
+        async def failed(self, exc):
+                """ Register a failed attempt and wait before the next one
+                Raises
+                ------
+                exc: if exc is not transient (e.g. a programming error)
+                BleOperationError: if attempts or time are exhausted
+                """
+                if not self.policy.isTransient(exc):
+                        raise exc
+                self.n_failures += 1
+                if self.n_failures >= self.policy.max_attempts:
+                        raise BleOperationError(f'{self.description} failed after {self.n_failures} attempts: {exc!r}', self.n_retries + 1) from exc
+                delay = self.policy.delay(self.n_failures)
+                remaining = self.remaining()
+                if remaining is not None and remaining <= delay:
+                        raise BleOperationError(f'{self.description} timed out after {self.n_retries + 1} attempts: {exc!r}', self.n_retries + 1) from exc
+                self.n_retries += 1
+                if self.on_retry is not None:
+                        self.on_retry(exc)
+                print(f'{self.description} failed ({exc!r}). Retrying in {delay:.2f} s ...')
+                await asyncio.sleep(delay)
+
+# link and timeout errors only, permission or missing adapter errors (other OSErrors) fail straight away
+DEFAULT_TRANSIENT_EXCEPTIONS = (asyncio.TimeoutError, TimeoutError, ConnectionError, EOFError)
+
+class RetryPolicy(object):
+        def __init__(self, max_attempts = 10, base_delay = 0.1, max_delay = 2.0, multiplier = 2.0, jitter = True, deadline = 60.0,
+                     transient_exceptions = DEFAULT_TRANSIENT_EXCEPTIONS):
+                """ Retry policy shared by every BLE read, write and connect.
+                Transient errors are retried with exponential backoff and full
+                jitter, any other exception is raised straight away
+                Parameters
+                ----------
+                max_attempts: int
+                        consecutive failed attempts before giving up
+                base_delay: float
+                        delay in seconds after the first failure
+                max_delay: float
+                        maximum delay in seconds between attempts
+                multiplier: float
+                        delay growth factor between consecutive failures
+                jitter: bool
+                        wait a random time between 0 and the computed delay
+                deadline: float
+                        maximum seconds per operation including retries, None for no limit
+                transient_exceptions: tuple of exception classes
+                        exceptions worth retrying, link errors of the transport
+                        in use (e.g. BleakError) are added by BleConnectionHandler
+                        and callers can add more with addTransientExceptions
+                """
+                self.max_attempts = max_attempts
+                self.base_delay = base_delay
+                self.max_delay = max_delay
+                self.multiplier = multiplier
+                self.jitter = jitter
+                self.deadline = deadline
+                self.transient_exceptions = transient_exceptions
+
+        def addTransientExceptions(self, exceptions):
+                self.transient_exceptions = tuple(self.transient_exceptions) + tuple(
+                        exc for exc in exceptions if exc not in self.transient_exceptions)
+
+        def isTransient(self, exc):
+                return isinstance(exc, self.transient_exceptions)
+
+        def delay(self, n_failures):
+                delay = min(self.max_delay, self.base_delay * self.multiplier ** (n_failures - 1))
+                if self.jitter:
+                        delay = random.uniform(0, delay)
+                return delay
+
+        def start(self, description = 'BLE operation', on_retry = None):
+                return RetryState(self, description, on_retry)
+
+        async def run(self, operation, description = 'BLE operation', on_retry = None):
+                """ Run operation retrying transient failures
+                Parameters
+                ----------
+                operation: coroutine function without arguments, called once per attempt
+                description: string
+                        used in messages and errors
+                on_retry: callable
+                        called with the exception before each retry
+                Returns
+                -------
+                result: operation result
+                n_retries: int
+                """
+                state = self.start(description, on_retry)
+                while True:
+                        try:
+                                result = await asyncio.wait_for(operation(), state.remaining())
+                                return result, state.n_retries
+                        except Exception as exc:
+                                await state.failed(exc)
+
+class PooledConnection(object):
+        def __init__(self, address, transport, stats, gatt_cache = None):
+                """
+                Parameters
+                ----------
+                address: string
+                        BLE address
+                transport: BleakTransport or compatible transport
+                stats: BleStats
+                gatt_cache: GattCache
+                        handle tables of known devices, None to resolve
+                        characteristics by UUID on every operation
+                """
+                self.address = address
+                self.transport = transport
+                self.stats = stats
+                self.gatt_cache = gatt_cache
+                self.client = None
+                self.mtu = None
+                self.n_users = 0
+                self.last_used = time.monotonic()
+                self.lock = asyncio.Lock()
+
+        def isConnected(self):
+                return self.client is not None and self.client.is_connected
+
+        async def connect(self):
+                """ (Re)connect client, a fresh client is created
+                whenever the previous one has been dropped
+                """
+                if self.isConnected():
+                        self.stats.count('connection_reuses', self.address)
+                        return self.client
+                client = self.transport.createClient(self.address)
+                cached = self.gatt_cache is not None and self.gatt_cache.get(self.address) is not None
+                # bleak resolves GATT services while connecting, backends that
+                # support it (use_cached) reuse the services of the last session
+                with self.stats.timer('connect', self.address):
+                        await client.connect(use_cached = cached)
+                self.client = client
+                with self.stats.timer('mtu', self.address):
+                        self.mtu = await negotiateMtu(client)
+                if self.gatt_cache is not None:
+                        handles = await self._handles(client)
+                        if handles:
+                                self.client = HandleClient(client, handles, self._onStaleHandles)
+                return self.client
+
+        async def _handles(self, client):
+                """ Handle table of the connected device. A persisted table is
+                used as it is when the services discovered while connecting
+                agree with it, or when none were discovered; DEVICE_INFO is only
+                read to resolve a new table
+                """
+                entry = self.gatt_cache.get(self.address)
+                handles = gattHandles(client)
+                if entry is not None and (not handles or handles == entry['handles']):
+                        self.stats.count('gatt_cache_hits', self.address)
+                        return entry['handles']
+                if not handles:
+                        return {}
+                try:
+                        data = await client.read_gatt_char(DWM1001_BLE_API_COMMANDS.DEVICE_INFO)
+                        fw_version = codec.decodeDeviceInfo(data).fw1_version
+                except Exception as exc:
+                        # the link is up and the discovered handles are valid for this connection
+                        print(f'Handle table of {self.address} not cached: {exc!r}')
+                        return handles
+                self.gatt_cache.update(self.address, fw_version, handles, self.mtu)
+                self.stats.count('gatt_resolutions', self.address)
+                return handles
+
+        def _onStaleHandles(self):
+                # an operation failed by handle and succeeded by UUID, the table is resolved again on next connect
+                self.stats.count('gatt_stale', self.address)
+                self.gatt_cache.invalidate(self.address)
+
+        async def disconnect(self):
+                client, self.client = self.client, None
+                if client is not None and client.is_connected:
+                        try:
+                                await client.disconnect()
+                        except Exception as exc:
+                                print(f'Error disconnecting from {self.address}: {exc}')
+
+class ConnectionLease(object):
+        """ Async context manager returned by BleConnectionPool.lease """
+        def __init__(self, pool, address):
+                self.pool = pool
+                self.address = address
+
+        async def __aenter__(self):
+                return await self.pool.acquire(self.address)
+
+        async def __aexit__(self, exc_type, exc_val, exc_tb):
+                # a failed operation may leave the link in an unknown state,
+                # drop it so the next lease reconnects
+                discard = exc_type is not None and not issubclass(exc_type, GeneratorExit)
+                await self.pool.release(self.address, discard = discard)
+                return False
+
+class BleConnectionPool(object):
+        def __init__(self, max_connections = 4, idle_timeout = 30.0, stats = None, transport = None, gatt_cache = None,
+                     on_connect_error = None):
+                """ Pool of open BLE connections keyed by address. Connections
+                are reused between operations, closed after idle_timeout
+                seconds without use and evicted in LRU order when
+                max_connections is reached. Idle connections are pruned
+                whenever a new one is acquired or pruneIdle is called.
+                Parameters
+                ----------
+                max_connections: int
+                        maximum number of simultaneously open connections
+                idle_timeout: float
+                        seconds an unused connection is kept open, None to
+                        keep connections until evicted or closed
+                stats: BleStats
+                        instrumentation, disabled if not provided
+                transport: BleakTransport or compatible transport
+                        bleak is used if not provided
+                gatt_cache: GattCache
+                        handle tables reused between connections, disabled if
+                        not provided
+                on_connect_error: coroutine function
+                        awaited as on_connect_error(address, exc) when
+                        connecting fails, before exc is raised. It may set an
+                        alias of address or raise another exception
+                """
+                self.stats = stats if stats is not None else BleStats()
+                self.transport = transport if transport is not None else BleakTransport()
+                self.gatt_cache = gatt_cache
+                self.max_connections = max_connections
+                self.idle_timeout = idle_timeout
+                self.on_connect_error = on_connect_error
+                self.connections = OrderedDict() # {address: PooledConnection} in LRU order
+                self.aliases = {} # {requested address: address connected instead}
+                self._condition = None
+
+        def _getCondition(self):
+                # created lazily so it binds to the loop running the pool
+                if self._condition is None:
+                        self._condition = asyncio.Condition()
+                return self._condition
+
+        def lease(self, address):
+                """ Lease a connected client, usage:
+                async with pool.lease(address) as client: ...
+                """
+                return ConnectionLease(self, address)
+
+        async def acquire(self, address):
+                """ Get a connected client for address, reusing an open
+                connection if possible
+                Parameters
+                ----------
+                address: string
+                        BLE address
+                Returns
+                -------
+                client : BleakClient or transport client
+                """
+                requested_address, address = address, self.aliases.get(address, address)
+                condition = self._getCondition()
+                async with condition:
+                        while True:
+                                await self._pruneIdle()
+                                connection = self.connections.get(address)
+                                if connection is not None:
+                                        self.connections.move_to_end(address)
+                                        break
+                                if len(self.connections) < self.max_connections:
+                                        connection = PooledConnection(address, self.transport, self.stats, self.gatt_cache)
+                                        self.connections[address] = connection
+                                        break
+                                # evict least recently used connection not in use
+                                victim = next((c for c in self.connections.values() if c.n_users == 0), None)
+                                if victim is not None:
+                                        self.stats.count('evictions', victim.address)
+                                        del self.connections[victim.address]
+                                        await victim.disconnect()
+                                else:
+                                        await condition.wait()
+                        connection.n_users += 1
+                try:
+                        async with connection.lock:
+                                # reconnects if the link was dropped
+                                return await connection.connect()
+                except BaseException as exc:
+                        await self.release(address, discard = True)
+                        if self.on_connect_error is not None and isinstance(exc, Exception):
+                                await self.on_connect_error(requested_address, exc)
+                        raise
+
+        async def release(self, address, discard = False):
+                """ Give back a leased client
+                Parameters
+                ----------
+                address: string
+                        BLE address
+                discard: bool
+                        disconnect and forget the connection
+                """
+                address = self.aliases.get(address, address)
+                condition = self._getCondition()
+                async with condition:
+                        connection = self.connections.get(address)
+                        if connection is not None:
+                                connection.n_users -= 1
+                                connection.last_used = time.monotonic()
+                                if discard and connection.n_users == 0:
+                                        del self.connections[address]
+                                        await connection.disconnect()
+                        condition.notify_all()
+
+        async def pruneIdle(self):
+                async with self._getCondition():
+                        await self._pruneIdle()
+
+        async def _pruneIdle(self):
+                if self.idle_timeout is None:
+                        return
+                now = time.monotonic()
+                for connection in list(self.connections.values()):
+                        if connection.n_users == 0 and (now - connection.last_used > self.idle_timeout or not connection.isConnected()):
+                                del self.connections[connection.address]
+                                await connection.disconnect()
+
+        async def close(self):
+                """ Disconnect every pooled connection """
+                condition = self._getCondition()
+                async with condition:
+                        connections = list(self.connections.values())
+                        self.connections.clear()
+                        for connection in connections:
+                                await connection.disconnect()
+                        condition.notify_all()
+
+class AsyncBleConnectionHandler(object):
+        def __init__(self, max_connections = 4, idle_timeout = 30.0, device_cache = None, retry_policy = None, collect_stats = False,
+                     transport = None, adapters = None, gatt_cache = None, record = None):
+                """ Coroutine based BLE handler, usable from code that already
+                runs an event loop. Operations on different devices can be
+                composed with asyncio.gather and cancelled with timeouts
+                Parameters
+                ----------
+                max_connections: int
+                        maximum number of simultaneously open connections
+                idle_timeout: float
+                        seconds an unused connection is kept open
+                device_cache: DeviceCache
+                        name to address cache used by findDevices, a cache in
+                        the default location is used if not provided
+                retry_policy: RetryPolicy
+                        retry policy of every read, write and connect, default
+                        RetryPolicy() if not provided
+                collect_stats: bool
+                        collect latency and throughput stats, see stats()
+                transport: BleakTransport or compatible transport
+                        e.g. dwm1001_fakeBle.FakeBleTransport, bleak is used if
+                        not provided
+                adapters: list of strings
+                        HCI adapters used by bleak when transport is not
+                        provided, e.g. ['hci0', 'hci1']. Connections are spread
+                        over them, see ShardedTransport
+                gatt_cache: GattCache
+                        characteristic handle tables per device and firmware
+                        version, a cache in the default location is used if
+                        not provided
+                record: string
+                        path of a binary trace of every scan result, connect,
+                        read, write and notification, see dwm1001_bleTrace
+                """
+                if transport is None:
+                        transport = adapterTransport(adapters) if adapters else BleakTransport()
+                self.recorder = None
+                if record is not None:
+                        self.recorder = TraceRecorder(record)
+                        transport = RecordingTransport(transport, self.recorder)
+                self.transport = transport
+                # never open more connections than the adapters support
+                if transport.capacity() is not None:
+                        max_connections = min(max_connections, transport.capacity())
+                self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+                self.retry_policy.addTransientExceptions(self.transport.transientExceptions())
+                self.ble_stats = BleStats(collect_stats)
+                self.gatt_cache = gatt_cache if gatt_cache is not None else GattCache()
+                self.pool = BleConnectionPool(max_connections, idle_timeout, self.ble_stats, self.transport, self.gatt_cache,
+                                              self._onConnectError)
+                self.device_cache = device_cache if device_cache is not None else DeviceCache()
+                self.cache_sourced = {} # {address: name} of addresses findDevices took from the device cache
+                self.dropped_frames = {} # {address: frames dropped by stream because the consumer fell behind}
+                self.scan_timeout = 5.0
+
+        async def __aenter__(self):
+                return self
+
+        async def __aexit__(self, exc_type, exc_val, exc_tb):
+                await self.close()
+                return False
+
+        async def close(self):
+                """ Close every open connection and the trace being recorded """
+                await self.pool.close()
+                if self.recorder is not None:
+                        self.recorder.close()
+
+        def stats(self):
+                """ Latency and throughput stats, collect_stats must be enabled
+                Returns
+                -------
+                stats: dictionary with per phase latency summaries (count,
+                        mean, p50/p95/p99 and histogram), global counters and
+                        per device and per UUID counters
+                """
+                return self.ble_stats.snapshot()
+
+        def exportStats(self, path):
+                """ Export stats() as csv if path ends with .csv, json otherwise """
+                self.ble_stats.export(path)
+
+        def mtu(self, address):
+                """ Returns
+                -------
+                mtu : int, ATT MTU negotiated with address on the open or last
+                        cached connection, None if unknown
+                """
+                address = self.pool.aliases.get(address, address)
+                connection = self.pool.connections.get(address)
+                if connection is not None and connection.mtu is not None:
+                        return connection.mtu
+                entry = self.gatt_cache.get(address)
+                return None if entry is None else entry['mtu']
+
+        def droppedFrames(self, address = None):
+                """ Returns
+                -------
+                n_dropped : int, frames stream dropped from address, or from
+                        every device if address is None, because the consumer
+                        fell behind
+                """
+                if address is None:
+                        return sum(self.dropped_frames.values())
+                return self.dropped_frames.get(address, 0)
+
+        async def getDevices(self):
+                print('Searching BT devices ...\n')
+                return await self.transport.discover()
+
+        async def scan(self, expected_names = None, timeout = 5.0):
+                """ scan BT devices
+                Parameters
+                ----------
+                expected_names: iterable of strings
+                        scanning stops as soon as every name has been seen,
+                        None to scan for the whole timeout
+                timeout: float
+                        maximum scanning time in seconds
+                Returns
+                -------
+                devices: dictionary of {name: address}
+                """
+                expected_names = set(expected_names) if expected_names is not None else None
+                devices = {}
+                all_found = asyncio.Event()
+                def onDetection(device, advertisement_data):
+                        if device.name:
+                                devices[device.name] = device.address
+                        if expected_names is not None and expected_names.issubset(devices):
+                                all_found.set()
+
+                if expected_names is not None and len(expected_names) == 0:
                         return devices
+                scanner = self.transport.createScanner()
+                scanner.register_detection_callback(onDetection)
+                with self.ble_stats.timer('scan'):
+                        await self.retry_policy.run(scanner.start, 'Scan start', self._onRetry('scan'))
+                        try:
+                                await asyncio.wait_for(all_found.wait(), timeout)
+                        except asyncio.TimeoutError:
+                                pass
+                        finally:
+                                await scanner.stop()
+                self.ble_stats.count('devices_found', n = len(devices))
+                return devices
 
-                devices = self.loop.run_until_complete(asyncGetDevices())
+        async def findDevices(self, expected_names, timeout = 5.0, use_cache = True):
+                """ get the address of each expected device, cached addresses
+                are used directly and only missing devices are scanned for
+                Parameters
+                ----------
+                expected_names: iterable of strings
+                        e.g. ['DW2020', 'DW1A2B']
+                timeout: float
+                        maximum scanning time in seconds
+                use_cache: bool
+                        False to ignore cached addresses and scan every device
+                Returns
+                -------
+                devices: dictionary of {name: address} of found devices
+                """
+                expected_names = set(expected_names)
+                self.scan_timeout = timeout
+                if use_cache:
+                        devices, missing = self.device_cache.lookup(expected_names)
+                        # verified on first connect, see _onConnectError
+                        self.cache_sourced.update({address: name for name, address in devices.items()})
+                else:
+                        devices, missing = {}, expected_names
+                if missing:
+                        print(f'Searching {len(missing)} BT devices ...\n')
+                        scanned = await self.scan(missing, timeout)
+                        self.device_cache.update(scanned)
+                        devices.update({name: scanned[name] for name in missing if name in scanned})
+                if self.recorder is not None:
+                        # cached addresses never reach the transport, keep them for replays
+                        for name, address in devices.items():
+                                self.recorder.record(TRACE_DEVICE, address, name)
                 return devices
 
-        def readFromDevice(self, address, UUID):
-                async def asyncReadFromDevice(address, UUID):
-                        async with BleakClient(address) as client:
-                                data = await client.read_gatt_char(UUID)
-                        return data
+        async def _onConnectError(self, address, exc):
+                """ The module at a cached address may have been replaced or
+                have changed address: the first failed connect evicts the cache
+                entry and scans for the name again, later operations on address
+                connect to the scanned address
+                Raises
+                ------
+                BleOperationError: if the name is not found by the scan, so the
+                        device is skipped instead of retried
+                """
+                name = self.cache_sourced.pop(address, None)
+                if name is None:
+                        return
+                print(f'{name} not reachable at cached address {address} ({exc!r}), searching it ...')
+                self.device_cache.invalidate(name)
+                scanned = await self.scan([name], self.scan_timeout)
+                if name not in scanned:
+                        raise BleOperationError(f'{name} not found, cached address {address} is stale', 1) from exc
+                self.device_cache.update({name: scanned[name]})
+                self.ble_stats.count('stale_addresses', address)
+                if scanned[name] != address:
+                        self.pool.aliases[address] = scanned[name]
+                        if self.recorder is not None:
+                                self.recorder.record(TRACE_DEVICE, scanned[name], name)
 
-                data = self.loop.run_until_complete(asyncReadFromDevice(address, UUID))
+        def _onRetry(self, operation, address = None, UUID = None):
+                if not self.ble_stats.enabled:
+                        return None
+                def onRetry(exc):
+                        self.ble_stats.count(operation + '_retries', address, UUID)
+                return onRetry
+
+        async def readFromDevice(self, address, UUID):
+                """ Returns
+                -------
+                data: bytearray
+                """
+                async def readOnce():
+                        async with self.pool.lease(address) as client:
+                                with self.ble_stats.timer('read', address, UUID):
+                                        return await client.read_gatt_char(UUID)
+                data, _ = await self.retry_policy.run(readOnce, f'Read {UUID} from {address}', self._onRetry('read', address, UUID))
                 return data
 
-        def writeToDevice(self, address, UUID, data):
-                async def asyncWriteToDevice(address, UUID, data):
-                        async with BleakClient(address) as client:
-                                await client.write_gatt_char(UUID, data)
-                self.loop.run_until_complete(asyncWriteToDevice(address, UUID, data))
+        async def writeToDevice(self, address, UUID, data, response = False):
+                """ Parameters
+                ----------
+                response: bool
+                        write with response, i.e. wait for the device to
+                        acknowledge the write
+                Returns
+                -------
+                n_retries: int
+                """
+                async def writeOnce():
+                        async with self.pool.lease(address) as client:
+                                with self.ble_stats.timer('write', address, UUID):
+                                        await client.write_gatt_char(UUID, data, response)
+                _, n_retries = await self.retry_policy.run(writeOnce, f'Write {UUID} to {address}', self._onRetry('write', address, UUID))
+                return n_retries
 
-        def send(self, address, msg_object, verbose = False):
-                """ send message over BLE
+        async def read(self, address, msg_object, decode_msg = False):
+                """ read message over BLE
                 Parameters
                 ----------
+                address: string
+                        BLE address
                 msg_object : BleMsg
+                decode_msg: bool
+                        return msg_object.decodeBle(data) instead of raw data
+                """
+                data = await self.readFromDevice(address, msg_object.UUID)
+                return msg_object.decodeBle(data) if decode_msg else data
+
+        async def readBatch(self, address, msg_objects, decode_msg = False):
+                """ read several messages over a single BLE connection. If a
+                read fails the batch is resumed from the failed message on a
+                new connection
+                Parameters
+                ----------
                 address: string
                         BLE address
+                msg_objects : list of BleMsg
+                decode_msg: bool
+                        return msg_object.decodeBle(data) instead of raw data
                 Returns
                 -------
+                data: list with the data of each msg, in order
+                Raises
+                ------
+                BleOperationError: if retries are exhausted
+                """
+                results = []
+                retry_state = self.retry_policy.start(f'Read batch from {address}', self._onRetry('read', address))
+                while len(results) < len(msg_objects):
+                        try:
+                                async with self.pool.lease(address) as client:
+                                        while len(results) < len(msg_objects):
+                                                msg_object = msg_objects[len(results)]
+                                                with self.ble_stats.timer('read', address, msg_object.UUID):
+                                                        data = await asyncio.wait_for(client.read_gatt_char(msg_object.UUID), retry_state.remaining())
+                                                results.append(msg_object.decodeBle(data) if decode_msg else data)
+                                                retry_state.reset()
+                        except Exception as exc:
+                                retry_state.description = f'Read batch from {address} at msg {len(results) + 1}/{len(msg_objects)}'
+                                await retry_state.failed(exc)
+                return results
+
+        async def send(self, address, msg_object):
+                """ send message over BLE
+                Parameters
+                ----------
+                address: string
+                        BLE address
+                msg_object : BleMsg
+                Returns
+                -------
+                n_retries: int
+                        failed attempts before success
+                Raises
+                ------
+                BleOperationError: if retries are exhausted
                 """
                 if msg_object.is_data_ble_encoded == False:
                         msg_object.encodeBle()
+                return await self.writeToDevice(address, msg_object.UUID, msg_object.data)
+
+        async def sendBatch(self, address, msg_objects):
+                """ send several messages over a single BLE connection.
+                Messages are written in order, if a write fails the batch is
+                resumed from the failed message on a new connection
+                Parameters
+                ----------
+                address: string
+                        BLE address
+                msg_objects : list of BleMsg
+                Returns
+                -------
+                n_retries: int
+                        failed attempts over the whole batch
+                Raises
+                ------
+                BleOperationError: if retries are exhausted, msgs before the
+                        failed one have been written
+                """
+                for msg_object in msg_objects:
+                        if msg_object.is_data_ble_encoded == False:
+                                msg_object.encodeBle()
+                return await self.writeBatch(address, [(msg_object.UUID, msg_object.data) for msg_object in msg_objects])
+
+        async def writeBatch(self, address, writes):
+                """ write already encoded payloads over a single BLE
+                connection, see sendBatch
+                Parameters
+                ----------
+                address: string
+                        BLE address
+                writes : list of (UUID, data) tuples
+                Returns
+                -------
+                n_retries: int
+                        failed attempts over the whole batch
+                """
+                next_idx = 0
+                retry_state = self.retry_policy.start(f'Batch to {address}', self._onRetry('write', address))
+                while next_idx < len(writes):
+                        try:
+                                async with self.pool.lease(address) as client:
+                                        while next_idx < len(writes):
+                                                UUID, data = writes[next_idx]
+                                                with self.ble_stats.timer('write', address, UUID):
+                                                        await asyncio.wait_for(client.write_gatt_char(UUID, data), retry_state.remaining())
+                                                next_idx += 1
+                                                retry_state.reset()
+                        except Exception as exc:
+                                retry_state.description = f'Batch to {address} at msg {next_idx + 1}/{len(writes)}'
+                                await retry_state.failed(exc)
+                return retry_state.n_retries
+
+        async def stream(self, address, msg_object, n_samples = None, duration = None, queue_size = 64, decode_msg = True):
+                """ stream notifications of msg_object characteristic, frames
+                are timestamped on arrival and buffered in a bounded queue. If
+                the consumer falls behind, the oldest frames are dropped so the
+                yielded frames are always the most recent ones. Dropped frames
+                are reported once and counted, see droppedFrames
+                Parameters
+                ----------
+                address: string
+                        BLE address
+                msg_object : BleMsg
+                n_samples: int
+                        stop after n_samples frames, None for no limit
+                duration: float
+                        stop after duration seconds, None for no limit
+                queue_size: int
+                        maximum number of buffered frames, None to buffer every
+                        frame so none is dropped (e.g. when every sample counts)
+                decode_msg: bool
+                        yield msg_object.decodeBle(frame) instead of raw frames
+                Returns
+                -------
+                async generator of (timestamp, data) tuples
+                Raises
+                ------
+                BleOperationError: if subscribing fails after retrying or the
+                        connection drops while streaming
+                """
+                queue = asyncio.Queue(maxsize = 0 if queue_size is None else queue_size)
+                n_dropped = 0
+                def onNotification(sender, data):
+                        nonlocal n_dropped
+                        timestamp = time.time()
+                        if queue.full():
+                                queue.get_nowait()
+                                n_dropped += 1
+                                self.dropped_frames[address] = self.dropped_frames.get(address, 0) + 1
+                                if n_dropped == 1:
+                                        print(f'Frames from {address} are dropped, the consumer falls behind')
+                        queue.put_nowait((timestamp, data))
+
+                async def subscribe():
+                        client = await self.pool.acquire(address)
+                        try:
+                                with self.ble_stats.timer('subscribe', address, msg_object.UUID):
+                                        await client.start_notify(msg_object.UUID, onNotification)
+                        except BaseException:
+                                await self.pool.release(address, discard = True)
+                                raise
+                        return client
+
+                deadline = None if duration is None else time.monotonic() + duration
+                n_yielded = 0
+                client, _ = await self.retry_policy.run(subscribe, f'Subscribe to {msg_object.UUID} on {address}',
+                                                        self._onRetry('subscribe', address, msg_object.UUID))
+                discard = True
+                try:
+                        while n_samples is None or n_yielded < n_samples:
+                                # wake up periodically to notice dropped connections
+                                timeout = 1.0
+                                if deadline is not None:
+                                        remaining = deadline - time.monotonic()
+                                        if remaining <= 0:
+                                                break
+                                        timeout = min(timeout, remaining)
+                                try:
+                                        timestamp, data = await asyncio.wait_for(queue.get(), timeout)
+                                except asyncio.TimeoutError:
+                                        if not client.is_connected:
+                                                raise BleOperationError(f'Connection to {address} dropped while streaming')
+                                        continue
+                                if decode_msg:
+                                        try:
+                                                data = msg_object.decodeBle(data)
+                                        except ValueError as exc:
+                                                print(f'Invalid frame from {address} skipped: {exc}')
+                                                continue
+                                n_yielded += 1
+                                self.ble_stats.count('notifications', address, msg_object.UUID)
+                                yield timestamp, data
+                        discard = False
+                except GeneratorExit:
+                        discard = False
+                        raise
+                finally:
+                        if n_dropped > 0:
+                                self.ble_stats.count('dropped_notifications', address, msg_object.UUID, n_dropped)
+                                print(f'{n_dropped} frames from {address} were dropped')
+                        if client.is_connected:
+                                try:
+                                        await client.stop_notify(msg_object.UUID)
+                                except Exception as exc:
+                                        print(f'Error unsubscribing from {address}: {exc!r}')
+                                        discard = True
+                        await self.pool.release(address, discard = discard)
+
+class BleConnectionHandler(object):
+        def __init__(self, max_connections = 4, idle_timeout = 30.0, device_cache = None, retry_policy = None, collect_stats = False,
+                     transport = None, adapters = None, gatt_cache = None, record = None):
+                """ Blocking wrapper of AsyncBleConnectionHandler, every
+                operation runs to completion on the default event loop. The
+                wrapped handler is available as async_handler for coroutines
+                run with self.loop
+                Parameters
+                ----------
+                see AsyncBleConnectionHandler
+                """
+                self.loop = asyncio.get_event_loop()
+                self.async_handler = AsyncBleConnectionHandler(max_connections, idle_timeout, device_cache, retry_policy,
+                                                               collect_stats, transport, adapters, gatt_cache, record)
+
+        @property
+        def transport(self):
+                return self.async_handler.transport
+
+        @property
+        def retry_policy(self):
+                return self.async_handler.retry_policy
+
+        @property
+        def ble_stats(self):
+                return self.async_handler.ble_stats
+
+        @property
+        def pool(self):
+                return self.async_handler.pool
+
+        @property
+        def device_cache(self):
+                return self.async_handler.device_cache
+
+        @property
+        def gatt_cache(self):
+                return self.async_handler.gatt_cache
+
+        def mtu(self, address):
+                """ see AsyncBleConnectionHandler.mtu """
+                return self.async_handler.mtu(address)
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+                self.close()
+                return False
+
+        def close(self):
+                """ Close every open connection and the trace being recorded """
+                self.loop.run_until_complete(self.async_handler.close())
+
+        def stats(self):
+                """ see AsyncBleConnectionHandler.stats """
+                return self.async_handler.stats()
+
+        def exportStats(self, path):
+                """ Export stats() as csv if path ends with .csv, json otherwise """
+                self.async_handler.exportStats(path)
+
+        def droppedFrames(self, address = None):
+                """ see AsyncBleConnectionHandler.droppedFrames """
+                return self.async_handler.droppedFrames(address)
+
+        def getDevices(self):
+                return self.loop.run_until_complete(self.async_handler.getDevices())
+
+        def scan(self, expected_names = None, timeout = 5.0):
+                """ scan BT devices, see AsyncBleConnectionHandler.scan
+                Returns
+                -------
+                devices: dictionary of {name: address}
+                """
+                return self.loop.run_until_complete(self.async_handler.scan(expected_names, timeout))
+
+        def findDevices(self, expected_names, timeout = 5.0, use_cache = True):
+                """ get the address of each expected device, see
+                AsyncBleConnectionHandler.findDevices
+                Returns
+                -------
+                devices: dictionary of {name: address} of found devices
+                """
+                return self.loop.run_until_complete(self.async_handler.findDevices(expected_names, timeout, use_cache))
+
+        def readFromDevice(self, address, UUID):
+                return self.loop.run_until_complete(self.async_handler.readFromDevice(address, UUID))
+
+        def writeToDevice(self, address, UUID, data, response = False):
+                self.loop.run_until_complete(self.async_handler.writeToDevice(address, UUID, data, response))
+
+        def sendBatch(self, address, msg_objects):
+                """ send several messages over a single BLE connection
+                Parameters
+                ----------
+                address: string
+                        BLE address
+                msg_objects : list of BleMsg
+                Raises
+                ------
+                BleOperationError: if retries are exhausted
+                """
+                self.loop.run_until_complete(self.async_handler.sendBatch(address, msg_objects))
+
+        def readBatch(self, address, msg_objects, decode_msg = False):
+                """ read several messages over a single BLE connection, see
+                AsyncBleConnectionHandler.readBatch
+                Returns
+                -------
+                data: list with the data of each msg, in order
+                """
+                return self.loop.run_until_complete(self.async_handler.readBatch(address, msg_objects, decode_msg))
+
+        def send(self, address, msg_object, verbose = False):
+                """ send message over BLE
+                Parameters
+                ----------
+                msg_object : BleMsg
+                address: string
+                        BLE address
+                Raises
+                ------
+                BleOperationError: if retries are exhausted
+                """
                 if verbose:
+                        if msg_object.is_data_ble_encoded == False:
+                                msg_object.encodeBle()
                         print(msg_object.data)
                 else:
-                        success = False
-                        n_attempts = 0
-                        while success == False and n_attempts < 10:
-                                try:
-                                        self.writeToDevice(address, msg_object.UUID, msg_object.data)
-                                        success = True
-                                except:
-                                        print('Connection failed. Retrying ...')
-                                        n_attempts += 1
+                        self.loop.run_until_complete(self.async_handler.send(address, msg_object))
 
+        def stream(self, address, msg_object, n_samples = None, duration = None, queue_size = 64, decode_msg = True):
+                """ stream notifications of msg_object characteristic, see
+                AsyncBleConnectionHandler.stream. Notifications are only
+                processed while the generator is being iterated
+                Returns
+                -------
+                generator of (timestamp, data) tuples
+                """
+                frames = self.async_handler.stream(address, msg_object, n_samples, duration, queue_size, decode_msg)
+                try:
+                        while True:
+                                try:
+                                        yield self.loop.run_until_complete(frames.__anext__())
+                                except StopAsyncIteration:
+                                        return
+                finally:
+                        self.loop.run_until_complete(frames.aclose())
 
         def read(self, address, msg_object, verbose = False, decode_msg = False):
                 """ read message over BLE
@@ -98,18 +1025,20 @@ class BleConnectionHandler(object):
                 msg_object : BleMsg
                 address: string
                         BLE address
+                verbose: bool
+                        print the raw data
+                decode_msg: bool
+                        return msg_object.decodeBle(data) instead of raw data
                 Returns
                 -------
+                data : bytearray or decoded msg
                 """
                 data = self.readFromDevice(address, msg_object.UUID)
-                # read returns raw bytearray, TODO: decode read data
                 if verbose:
                         print(f'data with length: {len(data)}')
                         print(data.hex())
-                elif decode_msg:
-                        return msg_object.decodeBle(data)
-                else:
-                        return data
+                return msg_object.decodeBle(data) if decode_msg else data
+
 class BleMsg(object):
         def __init__(self, api_command, data = None):
                 self.UUID  = api_command
@@ -132,37 +1061,6 @@ class BleMsg(object):
                 """                
                 return
 
-        def codeLittleEndian(self, bits):
-                """ Encode/decode bits as little endian bytes
-                Parameters
-                ----------
-                bits : (N,) Bits in hexadecimal
-                Returns
-                -------
-                encoded_msg : (N/8) array of bytes
-                """
-                bits = str(bits)
-                # assert bits in hexadecimal
-                if bits[0:2] != '0x':
-                        raise ValueError
-                # slice msg in pieces of 1 byte
-                wrapped_bits = wrap(str(bits)[2:], 2)
-                wrapped_bits.reverse()
-                return wrapped_bits
-
-        def listToByteArray(self, list):
-                """ set
-                Parameters
-                ----------
-                bits : (2, N) list of bytes
-                Returns
-                -------
-                encoded_msg : bitearray
-                """
-                # flatten list
-                # list = [item for sublist in list for item in sublist]
-                return bytearray(bytes.fromhex(''.join(list)))
-
 class PersistedPositionMsg(BleMsg):
         def __init__(self, data = None):
                 """
@@ -181,15 +1079,8 @@ class PersistedPositionMsg(BleMsg):
                 Returns
                 -------
                 """
-                result = []
-                for coord in self.data:
-                        # 4 byte coord in mm
-                        coord = self.codeLittleEndian(Bits(int = int(float(coord) * 1000), length = 32))
-                        for element in coord:
-                                result.append(element)
-                # quality factor (1 byte, value 1 - 100 DEC)
-                result.append('64')
-                self.data = self.listToByteArray(result)
+                # 4 byte coords in mm and quality factor (1 byte, value 1 - 100 DEC)
+                self.data = codec.encodePosition(self.data, quality = 100)
                 self.is_data_ble_encoded = True
 
 class OperationModeMsg(BleMsg):
@@ -209,36 +1100,20 @@ class OperationModeMsg(BleMsg):
                 Returns
                 -------
                 """
-                result = []
-                first_byte = ''
-                first_byte += format(self.data['node_type'],'01b')
-                first_byte += format(self.data['UWB'],'02b')
-                first_byte += format(self.data['firmware'],'01b')
-                first_byte += format(self.data['accelerometer_enable'],'01b')
-                first_byte += format(self.data['LED_indication_enabled'],'01b')
-                first_byte += format(self.data['firmware_update_enable'],'01b')
-                first_byte += format(1,'01b')
-                # append just hex(byte) without '0x'
-                result.append(format(int(first_byte, 2), '02x'))
-
-                second_byte = ''
-                second_byte += format(self.data['initiator_enable'],'01b')
-                second_byte += format(self.data['low_power_mode_enable'],'01b')
-                second_byte += format(self.data['location_engine_enable'],'01b')
-                second_byte += format(0,'05b')
-                result.append(format(int(second_byte, 2), '02x'))
-
                 # 2 bytes non little endian, see API documentation
-                self.data = self.listToByteArray(result)
+                self.data = codec.encodeOperationMode(self.data)
                 self.is_data_ble_encoded = True
 
-        def decodeBle(self):
+        def decodeBle(self, encoded_data):
                 """ Decode BLE msg
                 Parameters
                 ----------
+                encoded_data: bytearray
                 Returns
                 -------
+                operation_mode: dictionary
                 """
+                return codec.decodeOperationMode(encoded_data)
 
 class NetworkIdMsg(BleMsg):
         def __init__(self, data = None):
@@ -258,17 +1133,19 @@ class NetworkIdMsg(BleMsg):
                 -------
                 """
                 # 2 bytes little endian, see API documentation
-                result = self.codeLittleEndian(self.data)
-                self.data = self.listToByteArray(result)
+                self.data = codec.encodeNetworkId(self.data)
                 self.is_data_ble_encoded = True
 
-        def decodeBle(self):
+        def decodeBle(self, encoded_data):
                 """ Decode BLE msg
                 Parameters
                 ----------
+                encoded_data: bytearray
                 Returns
                 -------
+                network_id: int
                 """
+                return codec.decodeNetworkId(encoded_data)
 
 class LocationDataModeMsg(BleMsg):
         def __init__(self, data = None):
@@ -286,17 +1163,19 @@ class LocationDataModeMsg(BleMsg):
                 Returns
                 -------
                 """
-                result = (format(self.data, '02x'))
-                self.data = self.listToByteArray(result)
+                self.data = codec.encodeLocationDataMode(self.data)
                 self.is_data_ble_encoded = True
 
-        def decodeBle(self):
+        def decodeBle(self, encoded_data):
                 """ Decode BLE msg
                 Parameters
                 ----------
+                encoded_data: bytearray
                 Returns
                 -------
+                mode: int
                 """
+                return codec.decodeLocationDataMode(encoded_data)
 
 class LocationDataMsg(BleMsg):
         def __init__(self, data = None):
@@ -307,6 +1186,23 @@ class LocationDataMsg(BleMsg):
                 """
                 BleMsg.__init__(self, DWM1001_BLE_API_COMMANDS.LOCATION_DATA, data)
 
+        def decodeBle(self, encoded_data):
+                """ Decode BLE msg in any location data mode
+                (0 = position, 1 = distances, 2 = position + distances)
+                Parameters
+                ----------
+                encoded_data: bytearray
+                Returns
+                -------
+                decoded_data: LocationData
+                        use decoded_data.ranges() for a dictionary of {anchor: distance}
+                """
+                return codec.decodeLocationData(encoded_data)
+
+class DeviceInfoMsg(BleMsg):
+        def __init__(self):
+                BleMsg.__init__(self, DWM1001_BLE_API_COMMANDS.DEVICE_INFO)
+
         def decodeBle(self, encoded_data):
                 """ Decode BLE msg
                 Parameters
@@ -314,19 +1210,84 @@ class LocationDataMsg(BleMsg):
                 encoded_data: bytearray
                 Returns
                 -------
-                decoded_data: dictionary of {anchor: distance}
+                device_info: DeviceInfo
+                        node id, hardware and firmware versions and checksums
                 """
-                # ensure distances mode (i.e. only anchors' ranges are received)
-                encoded_data = encoded_data.hex()
-                if encoded_data[:2] != '01':
-                        return None
-                else:
-                        decoded_data = {}
-                        n_anchors = int(encoded_data[3])
-                        for i in range(n_anchors):
-                                offset = i * 14 # each anchor data is 14 bytes long
-                                anchor_id =  encoded_data[6 + offset:8 + offset] + encoded_data[4 + offset:6 + offset]
-                                hex_distance = encoded_data[14 + offset:16 + offset] + encoded_data[12 + offset:14 + offset] + encoded_data[10 + offset:12 + offset] + encoded_data[8 + offset:10 + offset]
-                                distance = int('0x' + hex_distance, base=16)
-                                decoded_data[anchor_id.upper()] = distance / 1000.0 # to meters
-                        return decoded_data
\ No newline at end of file
+                return codec.decodeDeviceInfo(encoded_data)
+
+class StatisticsMsg(BleMsg):
+        def __init__(self):
+                BleMsg.__init__(self, DWM1001_BLE_API_COMMANDS.STATISTICS)
+
+        def decodeBle(self, encoded_data):
+                """ Decode BLE msg
+                Parameters
+                ----------
+                encoded_data: bytearray
+                Returns
+                -------
+                statistics: NodeStatistics
+                        uptime, free memory and UWB/BLE counters
+                """
+                return codec.decodeStatistics(encoded_data)
+
+class MacStatsMsg(BleMsg):
+        def __init__(self):
+                BleMsg.__init__(self, DWM1001_BLE_API_COMMANDS.MAC_STATS)
+
+        def decodeBle(self, encoded_data):
+                """ Decode BLE msg
+                Parameters
+                ----------
+                encoded_data: bytearray
+                Returns
+                -------
+                mac_stats: MacStats
+                """
+                return codec.decodeMacStats(encoded_data)
+
+class ClusterInfoMsg(BleMsg):
+        def __init__(self):
+                BleMsg.__init__(self, DWM1001_BLE_API_COMMANDS.CLUSTER_INFO)
+
+        def decodeBle(self, encoded_data):
+                """ Decode BLE msg
+                Parameters
+                ----------
+                encoded_data: bytearray
+                Returns
+                -------
+                cluster_info: ClusterInfo
+                """
+                return codec.decodeClusterInfo(encoded_data)
+
+class AnchorListMsg(BleMsg):
+        def __init__(self):
+                BleMsg.__init__(self, DWM1001_BLE_API_COMMANDS.ANCHOR_LIST)
+
+        def decodeBle(self, encoded_data):
+                """ Decode BLE msg
+                Parameters
+                ----------
+                encoded_data: bytearray
+                Returns
+                -------
+                anchors: tuple of AnchorListEntry
+                        anchors heard by the module with their rssi
+                """
+                return codec.decodeAnchorList(encoded_data)
+
+class ProxyPositionsMsg(BleMsg):
+        def __init__(self):
+                BleMsg.__init__(self, DWM1001_BLE_API_COMMANDS.PROXY_POSITIONS)
+
+        def decodeBle(self, encoded_data):
+                """ Decode BLE msg
+                Parameters
+                ----------
+                encoded_data: bytearray
+                Returns
+                -------
+                positions: tuple of ProxyPosition
+                """
+                return codec.decodeProxyPositions(encoded_data)
@@ -0,0 +1,181 @@
+#!/usr/bin python3.6
+
+""" 
+@file: dwm1001_benchmark.py
+@description: benchmark suite running BleConnectionHandler against the simulated
+              DWM1001 fleet of dwm1001_fakeBle. Measures end-to-end fleet
+              configuration time, autocalibration sample rate and codec
+              throughput, and stores results to compare between runs
+@author: Esau Ortiz
+@date: october 2026
+@usage: python dwm1001_benchmark.py [--label <label>] [--results <file>]
+
+        # where <label> names the run (e.g. a commit hash)
+                <file> json file where runs are appended (default benchmark_results.json)
+        See --help for fleet size and simulated latencies
+"""
+
+import json
+import time
+import argparse
+import platform
+from dwm1001_apiBle import BleConnectionHandler, RetryPolicy, LocationDataMsg
+from dwm1001_apiBle import PersistedPositionMsg, OperationModeMsg, NetworkIdMsg
+from dwm1001_bleDiscovery import DeviceCache, GattCache
+from dwm1001_fakeBle import FakeFleet, FakeBleTransport, ANCHOR_OPERATION_MODE
+from dwm1001_bleTransport import ShardedTransport
+from dwm1001_configPlan import compilePlan, executePlan
+import dwm1001_bleCodec as codec
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description = 'Benchmark BLE configuration and codecs on a simulated fleet')
+    parser.add_argument('--label', default = '', help = 'name of the run')
+    parser.add_argument('--results', default = 'benchmark_results.json',
+                        help = 'json file where runs are appended')
+    parser.add_argument('--anchors', type = int, default = 30, help = 'simulated anchors')
+    parser.add_argument('--concurrency', type = int, default = 8, help = 'anchors configured at once')
+    parser.add_argument('--connect-latency', type = float, default = 0.5, help = 'simulated connect time in seconds')
+    parser.add_argument('--discovery-latency', type = float, default = 0.0,
+                        help = 'simulated service discovery time in seconds, skipped for cached devices with --backend winrt')
+    parser.add_argument('--backend', choices = ['bluez', 'winrt'], default = 'bluez',
+                        help = 'simulated bleak backend, only winrt reuses the services of cached devices')
+    parser.add_argument('--gatt-latency', type = float, default = 0.03, help = 'simulated read/write time in seconds')
+    parser.add_argument('--failure-rate', type = float, default = 0.02, help = 'simulated failure probability per operation')
+    parser.add_argument('--update-rate', type = float, default = 10.0, help = 'simulated location data rate in Hz')
+    parser.add_argument('--stream-duration', type = float, default = 5.0, help = 'seconds streaming location data')
+    parser.add_argument('--codec-iterations', type = int, default = 20000, help = 'iterations per codec benchmark')
+    parser.add_argument('--adapters', type = int, default = 1, help = 'simulated adapters connections are spread over')
+    parser.add_argument('--adapter-connections', type = int, default = None,
+                        help = 'simultaneous connections each simulated adapter accepts')
+    parser.add_argument('--serial-connects', action = 'store_true',
+                        help = 'each simulated adapter establishes one connection at a time')
+    parser.add_argument('--seed', type = int, default = 0)
+    return parser.parse_args()
+
+def createHandler(args, fleet, **kwargs):
+    transports = [FakeBleTransport(fleet, connect_latency = args.connect_latency, read_latency = args.gatt_latency,
+                                   write_latency = args.gatt_latency, failure_rate = args.failure_rate, seed = args.seed + i,
+                                   adapter = f'hci{i}', max_connections = args.adapter_connections,
+                                   serial_connects = args.serial_connects, discovery_latency = args.discovery_latency,
+                                   backend = args.backend)
+                  for i in range(args.adapters)]
+    transport = transports[0] if len(transports) == 1 else ShardedTransport(transports, args.adapter_connections)
+    # no disk caches and short backoff so runs are comparable
+    return BleConnectionHandler(transport = transport, device_cache = DeviceCache(None, ttl = 0), gatt_cache = GattCache(None),
+                                retry_policy = RetryPolicy(base_delay = 0.01, max_delay = 0.1), **kwargs)
+
+def benchFleetConfiguration(args):
+    fleet = FakeFleet.grid(n_anchors = args.anchors, n_tags = 0, seed = args.seed, update_rate = args.update_rate)
+    ble_handler = createHandler(args, fleet, max_connections = args.concurrency)
+    start = time.perf_counter()
+    devices = ble_handler.findDevices([device.name for device in fleet.devices.values()], timeout = 5.0)
+    scan_time = time.perf_counter() - start
+    nodes_cfg = {'network_id': '0x5678', 'n_anchors': len(fleet.devices)}
+    for i, device in enumerate(fleet.devices.values()):
+        nodes_cfg[f'anchor{i}_id'] = device.name
+        nodes_cfg[f'anchor{i}_coordinates'] = list(device.true_position)
+    start = time.perf_counter()
+    plan = compilePlan(nodes_cfg, ANCHOR_OPERATION_MODE, None)
+    compile_time = time.perf_counter() - start
+    start = time.perf_counter()
+    results = ble_handler.loop.run_until_complete(executePlan(ble_handler.async_handler, plan, devices, args.concurrency))
+    elapsed = time.perf_counter() - start
+    ble_handler.close()
+    return {'fleet_scan_s': scan_time,
+            'fleet_plan_compile_s': compile_time,
+            'fleet_configuration_s': elapsed,
+            'fleet_anchors_per_s': len(results) / elapsed,
+            'fleet_retries': sum(result['retries'] for result in results),
+            'fleet_failures': sum(not result['success'] for result in results)}
+
+def benchSampleRate(args):
+    fleet = FakeFleet.grid(n_anchors = 4, n_tags = 1, seed = args.seed, update_rate = args.update_rate)
+    ble_handler = createHandler(args, fleet)
+    tag = fleet.byName('DW8000')
+    timestamps = []
+    start = time.perf_counter()
+    for timestamp, location_data in ble_handler.stream(tag.address, LocationDataMsg(), duration = args.stream_duration):
+        timestamps.append(timestamp)
+    elapsed = time.perf_counter() - start
+    ble_handler.close()
+    # rate once subscribed, connection setup is excluded
+    sample_rate = (len(timestamps) - 1) / (timestamps[-1] - timestamps[0]) if len(timestamps) > 1 else 0.0
+    return {'stream_samples': len(timestamps),
+            'stream_samples_per_s': sample_rate,
+            'stream_efficiency': sample_rate / args.update_rate,
+            'stream_total_s': elapsed}
+
+def timeLoop(function, n_iterations):
+    start = time.perf_counter()
+    for _ in range(n_iterations):
+        function()
+    return n_iterations / (time.perf_counter() - start)
+
+def benchCodec(args):
+    n = args.codec_iterations
+    position_msg = PersistedPositionMsg()
+    operation_mode_msg = OperationModeMsg()
+    network_id_msg = NetworkIdMsg()
+    location_data_msg = LocationDataMsg()
+    def encodePosition():
+        position_msg.setData([1.5, -2.25, 0.3])
+        position_msg.encodeBle()
+    def encodeOperationMode():
+        operation_mode_msg.setData(ANCHOR_OPERATION_MODE)
+        operation_mode_msg.encodeBle()
+    def encodeNetworkId():
+        network_id_msg.setData('0x1234')
+        network_id_msg.encodeBle()
+    frame = bytes([codec.LOCATION_DATA_POSITION_DISTANCES]) + codec.encodePosition([1.0, 2.0, 1.0]) + bytes([4])
+    frame += b''.join(codec.ANCHOR_DISTANCE_STRUCT.pack(0x1000 + i, 1000 * (i + 1), 100) for i in range(4))
+    results = {'codec_encode_position_per_s': timeLoop(encodePosition, n),
+               'codec_encode_operation_mode_per_s': timeLoop(encodeOperationMode, n),
+               'codec_encode_network_id_per_s': timeLoop(encodeNetworkId, n),
+               'codec_decode_location_data_per_s': timeLoop(lambda: location_data_msg.decodeBle(frame), n)}
+    try:
+        frames = [frame] * (10 * n)
+        start = time.perf_counter()
+        codec.decodeLocationDataFrames(frames, codec.LOCATION_DATA_POSITION_DISTANCES)
+        results['codec_bulk_decode_frames_per_s'] = len(frames) / (time.perf_counter() - start)
+    except ImportError:
+        print('numpy not available, bulk decoding is not benchmarked')
+    return results
+
+def storeResults(path, run):
+    """ Append run to path and return the previous run if any """
+    try:
+        with open(path, 'r') as stream:
+            runs = json.load(stream)
+    except (OSError, ValueError):
+        runs = []
+    previous = runs[-1] if runs else None
+    runs.append(run)
+    with open(path, 'w') as stream:
+        json.dump(runs, stream, indent = 1)
+    return previous
+
+def printResults(run, previous):
+    print(f'{"metric":<40}{"current":>14}{"previous":>14}{"change":>10}')
+    for metric, value in run['metrics'].items():
+        line = f'{metric:<40}{value:>14.3f}'
+        if previous is not None and metric in previous['metrics']:
+            previous_value = previous['metrics'][metric]
+            change = (value - previous_value) / previous_value * 100.0 if previous_value else float('nan')
+            line += f'{previous_value:>14.3f}{change:>9.1f}%'
+        print(line)
+
+if __name__ == "__main__":
+    args = parseArgs()
+    metrics = {}
+    print('Benchmarking fleet configuration ...')
+    metrics.update(benchFleetConfiguration(args))
+    print('Benchmarking location data streaming ...')
+    metrics.update(benchSampleRate(args))
+    print('Benchmarking codecs ...')
+    metrics.update(benchCodec(args))
+    run = {'label': args.label, 'timestamp': time.time(), 'python': platform.python_version(),
+           'parameters': {key: value for key, value in vars(args).items() if key not in ('label', 'results')},
+           'metrics': metrics}
+    previous = storeResults(args.results, run)
+    printResults(run, previous)
+    print(f'\nResults appended to {args.results}')
@@ -0,0 +1,434 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_bleCodec.py
+@description: binary codec for DWM1001 BLE API payloads based on precompiled
+              struct formats. Frames are parsed straight from memoryviews and
+              archived LOCATION_DATA frames can be decoded in bulk with NumPy
+@author: Esau Ortiz
+@date: october 2026
+@more: Payload layouts are described in https://www.decawave.com/sites/default/files/dwm1001-api-guide.pdf
+"""
+import struct
+from collections import namedtuple
+
+# all multi-byte fields are little endian, see BLE API documentation
+POSITION_STRUCT           = struct.Struct('<iiiB') # x, y, z [mm], quality factor
+NETWORK_ID_STRUCT         = struct.Struct('<H')
+OPERATION_MODE_STRUCT     = struct.Struct('BB')
+LOCATION_DATA_MODE_STRUCT = struct.Struct('B')
+ANCHOR_DISTANCE_STRUCT    = struct.Struct('<HIB') # anchor id, distance [mm], quality factor
+UINT8_STRUCT              = struct.Struct('B')
+FW_OFFER_STRUCT           = struct.Struct('<BIIII') # type, hw version, fw version, fw checksum, fw size
+FW_CHUNK_HEADER_STRUCT    = struct.Struct('<BI') # type, offset, followed by up to FW_CHUNK_SIZE data bytes
+FW_POLL_STRUCT            = struct.Struct('<BII') # type, offset, size
+DEVICE_INFO_STRUCT        = struct.Struct('<QIIIIIB') # node id, hw version, fw1 version, fw2 version, fw1 checksum, fw2 checksum, flags
+STATISTICS_STRUCT         = struct.Struct('<IIIIIIIII') # uptime [s], free memory [bytes], uwb interrupts, uwb resets, rx ok, rx errors, tx ok, tx errors, ble connections
+MAC_STATS_STRUCT          = struct.Struct('<IIII') # beacons sent, beacons received, missed beacons, retransmissions
+CLUSTER_INFO_STRUCT       = struct.Struct('<BHH') # seat, cluster map, cluster neighbor map
+ANCHOR_LIST_ENTRY_STRUCT  = struct.Struct('<HiiibB') # anchor id, x, y, z [mm], rssi [dBm], seat (bits 0-4) and neighbor network flag (bit 5)
+PROXY_POSITION_STRUCT     = struct.Struct('<HiiiB') # node id, x, y, z [mm], quality factor
+
+# location data types (first byte of LOCATION_DATA frames)
+LOCATION_DATA_POSITION = 0
+LOCATION_DATA_DISTANCES = 1
+LOCATION_DATA_POSITION_DISTANCES = 2
+
+# FW_UPDATE_PUSH message types
+FW_PUSH_OFFER = 0
+FW_PUSH_CHUNK = 1
+FW_CHUNK_SIZE = 32
+
+# FW_UPDATE_POLL notification types
+FW_POLL_BUFFER_REQUEST = 0
+FW_POLL_SUCCESS = 1
+FW_POLL_SAVE_FAILED = 14
+FW_POLL_ERROR = 15
+
+# decoded records, x, y, z and distances in meters
+Position = namedtuple('Position', ['x', 'y', 'z', 'quality'])
+AnchorDistance = namedtuple('AnchorDistance', ['anchor_id', 'distance', 'quality'])
+FirmwarePoll = namedtuple('FirmwarePoll', ['type', 'offset', 'size'])
+DeviceInfo = namedtuple('DeviceInfo', ['node_id', 'hw_version', 'fw1_version', 'fw2_version', 'fw1_checksum',
+                                       'fw2_checksum', 'bridge'])
+NodeStatistics = namedtuple('NodeStatistics', ['uptime', 'free_memory', 'uwb_interrupts', 'uwb_resets', 'rx_ok',
+                                               'rx_errors', 'tx_ok', 'tx_errors', 'ble_connections'])
+MacStats = namedtuple('MacStats', ['beacons_sent', 'beacons_received', 'missed_beacons', 'retransmissions'])
+ClusterInfo = namedtuple('ClusterInfo', ['seat', 'cluster_map', 'neighbor_map'])
+AnchorListEntry = namedtuple('AnchorListEntry', ['anchor_id', 'x', 'y', 'z', 'rssi', 'seat', 'neighbor_network'])
+ProxyPosition = namedtuple('ProxyPosition', ['node_id', 'position'])
+
+class LocationData(namedtuple('LocationData', ['mode', 'position', 'distances'])):
+        """ Decoded LOCATION_DATA frame
+        mode : int
+                location data type
+        position : Position or None
+                None in distances mode
+        distances : tuple of AnchorDistance
+                empty in position mode
+        """
+        __slots__ = ()
+
+        def ranges(self):
+                """ Returns
+                -------
+                ranges : dictionary of {anchor_id: distance} with anchor_id
+                        as 4 digits hexadecimal string (e.g. 'C3B2')
+                """
+                return {format(d.anchor_id, '04X'): d.distance for d in self.distances}
+
+def encodePosition(coords, quality = 100):
+        """ Encode position
+        Parameters
+        ----------
+        coords : (3,) array
+                x, y, z in meters
+        quality : int
+                quality factor (1 - 100)
+        Returns
+        -------
+        encoded_data : bytes
+        """
+        x, y, z = (int(float(coord) * 1000) for coord in coords)
+        return POSITION_STRUCT.pack(x, y, z, quality)
+
+def checkLength(buffer, expected, name):
+        if len(buffer) < expected:
+                raise ValueError(f'{name} has invalid length {len(buffer)}, expected {expected}')
+
+def decodePosition(buffer, offset = 0):
+        """ Decode position
+        Parameters
+        ----------
+        buffer : bytes-like
+        offset : int
+        Returns
+        -------
+        position : Position
+        """
+        x, y, z, quality = POSITION_STRUCT.unpack_from(buffer, offset)
+        return Position(x / 1000.0, y / 1000.0, z / 1000.0, quality)
+
+def parseNetworkId(network_id):
+        """ Parameters
+        ----------
+        network_id : int or string
+                hexadecimal strings such as '0x1234' are accepted
+        Returns
+        -------
+        network_id : int
+        """
+        if isinstance(network_id, str):
+                return int(network_id, 16)
+        return int(network_id)
+
+def encodeNetworkId(network_id):
+        """ Encode network id
+        Parameters
+        ----------
+        network_id : int or string
+                hexadecimal strings such as '0x1234' are accepted
+        Returns
+        -------
+        encoded_data : bytes
+        """
+        return NETWORK_ID_STRUCT.pack(parseNetworkId(network_id))
+
+def decodeNetworkId(buffer):
+        """ Returns
+        -------
+        network_id : int
+        """
+        checkLength(buffer, NETWORK_ID_STRUCT.size, 'Network id')
+        network_id, = NETWORK_ID_STRUCT.unpack_from(buffer)
+        return network_id
+
+def encodeOperationMode(operation_mode):
+        """ Encode operation mode, 2 bytes non little endian,
+        see API documentation
+        Parameters
+        ----------
+        operation_mode : dictionary
+        Returns
+        -------
+        encoded_data : bytes
+        """
+        first_byte = (operation_mode['node_type'] << 7
+                        | operation_mode['UWB'] << 5
+                        | operation_mode['firmware'] << 4
+                        | operation_mode['accelerometer_enable'] << 3
+                        | operation_mode['LED_indication_enabled'] << 2
+                        | operation_mode['firmware_update_enable'] << 1
+                        | 1)
+        second_byte = (operation_mode['initiator_enable'] << 7
+                        | operation_mode['low_power_mode_enable'] << 6
+                        | operation_mode['location_engine_enable'] << 5)
+        return OPERATION_MODE_STRUCT.pack(first_byte, second_byte)
+
+def decodeOperationMode(buffer):
+        """ Decode operation mode, inverse of encodeOperationMode
+        Parameters
+        ----------
+        buffer : bytes-like
+        Returns
+        -------
+        operation_mode : dictionary
+        """
+        checkLength(buffer, OPERATION_MODE_STRUCT.size, 'Operation mode')
+        first_byte, second_byte = OPERATION_MODE_STRUCT.unpack_from(buffer)
+        return {'node_type': first_byte >> 7 & 1,
+                'UWB': first_byte >> 5 & 3,
+                'firmware': first_byte >> 4 & 1,
+                'accelerometer_enable': first_byte >> 3 & 1,
+                'LED_indication_enabled': first_byte >> 2 & 1,
+                'firmware_update_enable': first_byte >> 1 & 1,
+                'initiator_enable': second_byte >> 7 & 1,
+                'low_power_mode_enable': second_byte >> 6 & 1,
+                'location_engine_enable': second_byte >> 5 & 1}
+
+def encodeLocationDataMode(mode):
+        return LOCATION_DATA_MODE_STRUCT.pack(mode)
+
+def decodeLocationDataMode(buffer):
+        checkLength(buffer, LOCATION_DATA_MODE_STRUCT.size, 'Location data mode')
+        mode, = LOCATION_DATA_MODE_STRUCT.unpack_from(buffer)
+        return mode
+
+def encodeFirmwareOffer(hw_version, fw_version, checksum, size):
+        return FW_OFFER_STRUCT.pack(FW_PUSH_OFFER, hw_version, fw_version, checksum, size)
+
+def decodeFirmwareOffer(buffer):
+        """ Returns
+        -------
+        hw_version, fw_version, checksum, size : ints
+        """
+        checkLength(buffer, FW_OFFER_STRUCT.size, 'Firmware offer')
+        _, hw_version, fw_version, checksum, size = FW_OFFER_STRUCT.unpack_from(buffer)
+        return hw_version, fw_version, checksum, size
+
+def encodeFirmwareChunk(offset, data):
+        """ Parameters
+        ----------
+        offset : int
+                position of data in the firmware image
+        data : bytes-like of at most FW_CHUNK_SIZE bytes
+        """
+        if len(data) > FW_CHUNK_SIZE:
+                raise ValueError(f'Firmware chunks carry at most {FW_CHUNK_SIZE} bytes, got {len(data)}')
+        return FW_CHUNK_HEADER_STRUCT.pack(FW_PUSH_CHUNK, offset) + bytes(data)
+
+def decodeFirmwareChunk(buffer):
+        """ Returns
+        -------
+        offset : int
+        data : bytes
+        """
+        checkLength(buffer, FW_CHUNK_HEADER_STRUCT.size, 'Firmware chunk')
+        _, offset = FW_CHUNK_HEADER_STRUCT.unpack_from(buffer)
+        return offset, bytes(buffer[FW_CHUNK_HEADER_STRUCT.size:])
+
+def encodeFirmwarePoll(poll_type, offset = 0, size = 0):
+        return FW_POLL_STRUCT.pack(poll_type, offset, size)
+
+def decodeFirmwarePoll(buffer):
+        """ Decode a FW_UPDATE_POLL notification, offset and size are only
+        meaningful in buffer requests
+        Returns
+        -------
+        poll : FirmwarePoll
+        """
+        if len(buffer) < 1:
+                raise ValueError('Empty firmware update poll notification')
+        if len(buffer) < FW_POLL_STRUCT.size:
+                return FirmwarePoll(buffer[0], 0, 0)
+        return FirmwarePoll(*FW_POLL_STRUCT.unpack_from(buffer))
+
+def decodeDeviceInfo(buffer):
+        """ Returns
+        -------
+        device_info : DeviceInfo
+        """
+        checkLength(buffer, DEVICE_INFO_STRUCT.size, 'Device info')
+        node_id, hw_version, fw1_version, fw2_version, fw1_checksum, fw2_checksum, flags = DEVICE_INFO_STRUCT.unpack_from(buffer)
+        return DeviceInfo(node_id, hw_version, fw1_version, fw2_version, fw1_checksum, fw2_checksum, flags & 1)
+
+def decodeStatistics(buffer):
+        """ Returns
+        -------
+        statistics : NodeStatistics
+        """
+        checkLength(buffer, STATISTICS_STRUCT.size, 'Statistics')
+        return NodeStatistics(*STATISTICS_STRUCT.unpack_from(buffer))
+
+def decodeMacStats(buffer):
+        """ Returns
+        -------
+        mac_stats : MacStats
+        """
+        checkLength(buffer, MAC_STATS_STRUCT.size, 'MAC stats')
+        return MacStats(*MAC_STATS_STRUCT.unpack_from(buffer))
+
+def decodeClusterInfo(buffer):
+        """ Returns
+        -------
+        cluster_info : ClusterInfo
+                seat of the anchor, bitmap of the seats taken in its cluster
+                and in the neighbor clusters
+        """
+        checkLength(buffer, CLUSTER_INFO_STRUCT.size, 'Cluster info')
+        return ClusterInfo(*CLUSTER_INFO_STRUCT.unpack_from(buffer))
+
+def decodeCountedList(buffer, entry_struct, name):
+        """ Count byte followed by count entry_struct records
+        Returns
+        -------
+        records : list of tuples
+        """
+        buffer = memoryview(buffer)
+        checkLength(buffer, 1, name)
+        n_entries = buffer[0]
+        if len(buffer) - 1 != n_entries * entry_struct.size:
+                raise ValueError(f'{name} with {n_entries} entries has invalid length {len(buffer)}')
+        return list(entry_struct.iter_unpack(buffer[1:]))
+
+def decodeAnchorList(buffer):
+        """ Decode the anchors an anchor hears
+        Returns
+        -------
+        anchors : tuple of AnchorListEntry, coordinates in meters
+        """
+        return tuple(AnchorListEntry(anchor_id, x / 1000.0, y / 1000.0, z / 1000.0, rssi, seat & 0x1F, seat >> 5 & 1)
+                     for anchor_id, x, y, z, rssi, seat in decodeCountedList(buffer, ANCHOR_LIST_ENTRY_STRUCT, 'Anchor list'))
+
+def decodeProxyPositions(buffer):
+        """ Decode the tag positions a proxy forwards
+        Returns
+        -------
+        positions : tuple of ProxyPosition
+        """
+        return tuple(ProxyPosition(node_id, Position(x / 1000.0, y / 1000.0, z / 1000.0, quality))
+                     for node_id, x, y, z, quality in decodeCountedList(buffer, PROXY_POSITION_STRUCT, 'Proxy positions'))
+
+def decodeDistances(buffer, offset = 0):
+        """ Decode distances block (count byte followed by anchor records)
+        Parameters
+        ----------
+        buffer : bytes-like
+        offset : int
+                offset of the count byte
+        Returns
+        -------
+        distances : tuple of AnchorDistance
+        """
+        n_anchors, = UINT8_STRUCT.unpack_from(buffer, offset)
+        offset += UINT8_STRUCT.size
+        if len(buffer) - offset != n_anchors * ANCHOR_DISTANCE_STRUCT.size:
+                raise ValueError(f'Distances block with {n_anchors} anchors has invalid length {len(buffer) - offset + 1}')
+        distances = []
+        for anchor_id, distance, quality in ANCHOR_DISTANCE_STRUCT.iter_unpack(buffer[offset:]):
+                distances.append(AnchorDistance(anchor_id, distance / 1000.0, quality))
+        return tuple(distances)
+
+def decodeLocationData(buffer):
+        """ Decode LOCATION_DATA frame in any location data mode
+        (0 = position, 1 = distances, 2 = position + distances)
+        Parameters
+        ----------
+        buffer : bytes-like
+        Returns
+        -------
+        location_data : LocationData
+        """
+        buffer = memoryview(buffer)
+        if len(buffer) == 0:
+                raise ValueError('Empty location data frame')
+        mode = buffer[0]
+        if mode == LOCATION_DATA_POSITION:
+                if len(buffer) != 1 + POSITION_STRUCT.size:
+                        raise ValueError(f'Position frame has invalid length {len(buffer)}')
+                return LocationData(mode, decodePosition(buffer, 1), ())
+        elif mode == LOCATION_DATA_DISTANCES:
+                if len(buffer) < 2:
+                        raise ValueError(f'Distances frame has invalid length {len(buffer)}')
+                return LocationData(mode, None, decodeDistances(buffer, 1))
+        elif mode == LOCATION_DATA_POSITION_DISTANCES:
+                if len(buffer) < 2 + POSITION_STRUCT.size:
+                        raise ValueError(f'Position and distances frame has invalid length {len(buffer)}')
+                return LocationData(mode, decodePosition(buffer, 1), decodeDistances(buffer, 1 + POSITION_STRUCT.size))
+        else:
+                raise ValueError(f'Unknown location data mode {mode}')
+
+def locationDataDtype(n_anchors, mode = LOCATION_DATA_DISTANCES):
+        """ NumPy structured dtype matching a LOCATION_DATA frame
+        Parameters
+        ----------
+        n_anchors : int
+                number of anchor records in the frame
+        mode : int
+                location data type
+        Returns
+        -------
+        dtype : numpy.dtype
+        """
+        import numpy as np
+        fields = [('mode', 'u1')]
+        if mode in (LOCATION_DATA_POSITION, LOCATION_DATA_POSITION_DISTANCES):
+                fields += [('x', '<i4'), ('y', '<i4'), ('z', '<i4'), ('position_quality', 'u1')]
+        if mode in (LOCATION_DATA_DISTANCES, LOCATION_DATA_POSITION_DISTANCES):
+                anchor_dtype = np.dtype([('id', '<u2'), ('distance', '<u4'), ('quality', 'u1')])
+                fields += [('n_anchors', 'u1'), ('anchors', anchor_dtype, (n_anchors,))]
+        return np.dtype(fields)
+
+def decodeLocationDataBuffer(buffer, n_anchors, mode = LOCATION_DATA_DISTANCES):
+        """ Decode a buffer of concatenated LOCATION_DATA frames with the same
+        mode and number of anchors in a single call, no data is copied
+        Parameters
+        ----------
+        buffer : bytes-like
+        n_anchors : int
+        mode : int
+        Returns
+        -------
+        frames : (N,) structured array, see locationDataDtype
+        """
+        import numpy as np
+        return np.frombuffer(buffer, dtype = locationDataDtype(n_anchors, mode))
+
+def decodeLocationDataFrames(frames, mode = LOCATION_DATA_DISTANCES):
+        """ Decode a sequence of LOCATION_DATA frames with different number
+        of anchors. Frames are grouped by length and each group is decoded
+        with a single decodeLocationDataBuffer call
+        Parameters
+        ----------
+        frames : list of bytes-like
+        mode : int
+        Returns
+        -------
+        anchor_ids : (N, max_anchors) uint16 array, 0 where there is no anchor
+        distances : (N, max_anchors) float array in meters, NaN where there is no anchor
+        qualities : (N, max_anchors) uint8 array
+        """
+        import numpy as np
+        if mode == LOCATION_DATA_POSITION:
+                empty = np.zeros((len(frames), 0))
+                return empty.astype(np.uint16), empty, empty.astype(np.uint8)
+        header_size = 1 + (POSITION_STRUCT.size if mode == LOCATION_DATA_POSITION_DISTANCES else 0)
+        groups = {}
+        for idx, frame in enumerate(frames):
+                n_anchors, remainder = divmod(len(frame) - header_size - 1, ANCHOR_DISTANCE_STRUCT.size)
+                if n_anchors < 0 or remainder != 0 or frame[0] != mode:
+                        raise ValueError(f'Frame {idx} is not a valid location data frame in mode {mode}')
+                groups.setdefault(n_anchors, []).append(idx)
+        max_anchors = max(groups) if groups else 0
+        anchor_ids = np.zeros((len(frames), max_anchors), dtype = np.uint16)
+        distances = np.full((len(frames), max_anchors), np.nan)
+        qualities = np.zeros((len(frames), max_anchors), dtype = np.uint8)
+        for n_anchors, indices in groups.items():
+                if n_anchors == 0:
+                        continue
+                decoded = decodeLocationDataBuffer(b''.join(frames[idx] for idx in indices), n_anchors, mode)
+                anchors = decoded['anchors']
+                anchor_ids[indices, :n_anchors] = anchors['id']
+                distances[indices, :n_anchors] = anchors['distance'] / 1000.0
+                qualities[indices, :n_anchors] = anchors['quality']
+        return anchor_ids, distances, qualities
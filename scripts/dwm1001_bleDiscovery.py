@@ -0,0 +1,155 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_bleDiscovery.py
+@description: on-disk caches of DWM1001 module names and BLE addresses, so
+              known modules can be reached without scanning, and of their
+              GATT handle tables, so later sessions skip handle resolution
+@author: Esau Ortiz
+@date: october 2026
+"""
+import json
+import os
+import time
+from os.path import expanduser
+
+DEFAULT_CACHE_PATH = os.path.join(expanduser("~"), '.cache', 'dwm1001_ble', 'devices.json')
+DEFAULT_GATT_CACHE_PATH = os.path.join(expanduser("~"), '.cache', 'dwm1001_ble', 'gatt.json')
+
+class JsonCache(object):
+        def __init__(self, path):
+                """ Dictionary stored as json, loaded on first use
+                Parameters
+                ----------
+                path: string
+                        cache file, created on first save. None keeps the
+                        cache in memory only
+                """
+                self.path = path
+                self.entries = None
+
+        def load(self):
+                if self.entries is None and self.path is None:
+                        self.entries = {}
+                if self.entries is None:
+                        try:
+                                with open(self.path, 'r') as stream:
+                                        self.entries = json.load(stream)
+                        except (OSError, ValueError):
+                                self.entries = {}
+                return self.entries
+
+        def save(self):
+                if self.path is None:
+                        return
+                os.makedirs(os.path.dirname(self.path), exist_ok = True)
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w') as stream:
+                        json.dump(self.load(), stream, indent = 1, sort_keys = True)
+                os.replace(tmp_path, self.path)
+
+class DeviceCache(JsonCache):
+        def __init__(self, path = DEFAULT_CACHE_PATH, ttl = 24 * 3600.0):
+                """ name to address cache stored as json
+                Parameters
+                ----------
+                path: string
+                        cache file, created on first save. None keeps the
+                        cache in memory only
+                ttl: float
+                        seconds a cached address is trusted
+                """
+                JsonCache.__init__(self, path)
+                self.ttl = ttl
+                self.entries = None # {name: {'address': address, 'seen': timestamp}}
+
+        def get(self, name):
+                """ Returns
+                -------
+                address : string or None if name is unknown or expired
+                """
+                entry = self.load().get(name)
+                if entry is None or time.time() - entry['seen'] > self.ttl:
+                        return None
+                return entry['address']
+
+        def lookup(self, names):
+                """
+                Parameters
+                ----------
+                names : iterable of strings
+                Returns
+                -------
+                found : dictionary of {name: address}
+                missing : set of names not cached or expired
+                """
+                found = {}
+                missing = set()
+                for name in names:
+                        address = self.get(name)
+                        if address is None:
+                                missing.add(name)
+                        else:
+                                found[name] = address
+                return found, missing
+
+        def update(self, devices):
+                """
+                Parameters
+                ----------
+                devices : dictionary of {name: address}
+                """
+                entries = self.load()
+                now = time.time()
+                for name, address in devices.items():
+                        entries[name] = {'address': address, 'seen': now}
+                self.save()
+
+        def invalidate(self, name):
+                if self.load().pop(name, None) is not None:
+                        self.save()
+
+class GattCache(JsonCache):
+        def __init__(self, path = DEFAULT_GATT_CACHE_PATH):
+                """ Characteristic handle table and negotiated MTU per device,
+                stored as json. Tables are only valid for the firmware version
+                they were resolved with, entries are replaced when the services
+                discovered on connect disagree and dropped when an operation by
+                handle fails, see PooledConnection
+                Parameters
+                ----------
+                path: string
+                        cache file, created on first save. None keeps the
+                        cache in memory only
+                """
+                JsonCache.__init__(self, path)
+                self.entries = None # {address: {'fw_version', 'handles': {uuid: handle}, 'mtu', 'seen'}}
+
+        def get(self, address):
+                """ Returns
+                -------
+                entry : dictionary with fw_version, handles and mtu keys, None if unknown
+                """
+                return self.load().get(address)
+
+        def update(self, address, fw_version, handles, mtu = None):
+                """
+                Parameters
+                ----------
+                address: string
+                fw_version: int
+                        firmware version read from DEVICE_INFO
+                handles: dictionary of {uuid: handle}
+                mtu: int
+                        negotiated ATT MTU, None if unknown
+                """
+                entry = self.get(address)
+                if entry is not None and entry['fw_version'] == fw_version and entry['handles'] == handles and entry['mtu'] == mtu:
+                        return
+                self.load()[address] = {'fw_version': fw_version, 'handles': handles, 'mtu': mtu, 'seen': time.time()}
+                self.save()
+
+        def invalidate(self, address):
+                """ Forget the handle table of address, e.g. after a firmware update """
+                if self.load().pop(address, None) is not None:
+                        self.save()
@@ -0,0 +1,205 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_bleStats.py
+@description: latency and throughput instrumentation of BLE operations,
+              per phase timers, per device and per UUID counters and latency
+              histograms exportable as json or csv
+@author: Esau Ortiz
+@date: october 2026
+"""
+import csv
+import json
+import math
+import random
+import time
+from collections import defaultdict
+
+# histogram buckets upper bounds in ms
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+class LatencyHistogram(object):
+        def __init__(self, max_samples = 10000):
+                """ Latency summary, percentiles are computed from a uniform
+                reservoir of at most max_samples durations
+                """
+                self.max_samples = max_samples
+                self.samples = []
+                self.count = 0
+                self.total = 0.0
+                self.min = float('inf')
+                self.max = 0.0
+                self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+        def add(self, duration):
+                """
+                Parameters
+                ----------
+                duration : float
+                        seconds
+                """
+                self.count += 1
+                self.total += duration
+                self.min = min(self.min, duration)
+                self.max = max(self.max, duration)
+                duration_ms = duration * 1000.0
+                bucket = 0
+                while bucket < len(HISTOGRAM_BOUNDS_MS) and duration_ms > HISTOGRAM_BOUNDS_MS[bucket]:
+                        bucket += 1
+                self.buckets[bucket] += 1
+                if len(self.samples) < self.max_samples:
+                        self.samples.append(duration)
+                else:
+                        idx = random.randrange(self.count)
+                        if idx < self.max_samples:
+                                self.samples[idx] = duration
+
+        def percentile(self, p):
+                """ Returns
+                -------
+                duration : float in seconds, nearest rank p-th percentile
+                """
+                if not self.samples:
+                        return float('nan')
+                ordered = sorted(self.samples)
+                rank = min(len(ordered) - 1, max(0, math.ceil(p / 100.0 * len(ordered)) - 1))
+                return ordered[rank]
+
+        def summary(self):
+                if self.count == 0:
+                        return {'count': 0}
+                histogram = {}
+                for bound, n in zip(HISTOGRAM_BOUNDS_MS, self.buckets):
+                        histogram[f'<={bound}'] = n
+                histogram[f'>{HISTOGRAM_BOUNDS_MS[-1]}'] = self.buckets[-1]
+                return {'count': self.count,
+                        'total_s': self.total,
+                        'mean_ms': self.total / self.count * 1000.0,
+                        'min_ms': self.min * 1000.0,
+                        'max_ms': self.max * 1000.0,
+                        'p50_ms': self.percentile(50) * 1000.0,
+                        'p95_ms': self.percentile(95) * 1000.0,
+                        'p99_ms': self.percentile(99) * 1000.0,
+                        'histogram_ms': histogram}
+
+class PhaseTimer(object):
+        __slots__ = ('stats', 'phase', 'address', 'uuid', 'start')
+
+        def __init__(self, stats, phase, address, uuid):
+                self.stats = stats
+                self.phase = phase
+                self.address = address
+                self.uuid = uuid
+
+        def __enter__(self):
+                self.start = time.perf_counter()
+                return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+                self.stats.record(self.phase, time.perf_counter() - self.start, self.address, self.uuid, failed = exc_type is not None)
+                return False
+
+class NullTimer(object):
+        __slots__ = ()
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+                return False
+
+NULL_TIMER = NullTimer()
+
+class BleStats(object):
+        def __init__(self, enabled = False):
+                """ Instrumentation of BleConnectionHandler operations. When
+                disabled, timers are a shared no-op object and counters return
+                straight away
+                Parameters
+                ----------
+                enabled : bool
+                """
+                self.enabled = enabled
+                self.reset()
+
+        def reset(self):
+                self.started = time.time()
+                self.phases = defaultdict(LatencyHistogram) # {phase: LatencyHistogram}
+                self.device_counters = defaultdict(lambda: defaultdict(int)) # {address: {counter: n}}
+                self.uuid_counters = defaultdict(lambda: defaultdict(int)) # {UUID: {counter: n}}
+                self.counters = defaultdict(int)
+
+        def timer(self, phase, address = None, uuid = None):
+                """ Time a phase, usage:
+                with stats.timer('read', address, UUID): ...
+                Parameters
+                ----------
+                phase : string
+                        e.g. scan, connect, read, write, subscribe
+                address : string
+                uuid : string
+                """
+                if not self.enabled:
+                        return NULL_TIMER
+                return PhaseTimer(self, phase, address, uuid)
+
+        def record(self, phase, duration, address = None, uuid = None, failed = False):
+                if not self.enabled:
+                        return
+                self.phases[phase].add(duration)
+                name = phase + ('_errors' if failed else 's')
+                self.count(name, address, uuid)
+
+        def count(self, name, address = None, uuid = None, n = 1):
+                """ Increase a counter globally and for address and uuid if given """
+                if not self.enabled:
+                        return
+                self.counters[name] += n
+                if address is not None:
+                        self.device_counters[address][name] += n
+                if uuid is not None:
+                        self.uuid_counters[uuid][name] += n
+
+        def snapshot(self):
+                """ Returns
+                -------
+                stats : dictionary with phases, counters, devices and uuids keys
+                """
+                elapsed = time.time() - self.started
+                return {'elapsed_s': elapsed,
+                        'phases': {phase: histogram.summary() for phase, histogram in self.phases.items()},
+                        'counters': dict(self.counters),
+                        'devices': {address: dict(counters) for address, counters in self.device_counters.items()},
+                        'uuids': {uuid: dict(counters) for uuid, counters in self.uuid_counters.items()}}
+
+        def exportJson(self, path):
+                with open(path, 'w') as stream:
+                        json.dump(self.snapshot(), stream, indent = 1)
+
+        def exportCsv(self, path):
+                """ Export as section, key, metric, value rows """
+                snapshot = self.snapshot()
+                with open(path, 'w', newline = '') as stream:
+                        writer = csv.writer(stream)
+                        writer.writerow(['section', 'key', 'metric', 'value'])
+                        writer.writerow(['run', '', 'elapsed_s', snapshot['elapsed_s']])
+                        for phase, summary in sorted(snapshot['phases'].items()):
+                                for metric, value in summary.items():
+                                        if metric == 'histogram_ms':
+                                                for bucket, n in value.items():
+                                                        writer.writerow(['histogram', phase, bucket, n])
+                                        else:
+                                                writer.writerow(['phase', phase, metric, value])
+                        for name, value in sorted(snapshot['counters'].items()):
+                                writer.writerow(['counter', '', name, value])
+                        for section in ('devices', 'uuids'):
+                                for key, counters in sorted(snapshot[section].items()):
+                                        for name, value in sorted(counters.items()):
+                                                writer.writerow([section[:-1], key, name, value])
+
+        def export(self, path):
+                """ Export as csv if path ends with .csv, json otherwise """
+                if path.endswith('.csv'):
+                        self.exportCsv(path)
+                else:
+                        self.exportJson(path)
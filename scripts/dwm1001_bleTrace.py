@@ -0,0 +1,525 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_bleTrace.py
+@description: record and replay of BLE traffic. RecordingTransport wraps any
+              transport and logs every scan result, connect, read, write and
+              notification to a compact binary trace; ReplayTransport feeds a
+              trace back through the same transport interface, at the
+              original timing or as fast as possible, so field runs can be
+              reproduced, profiled and regression tested offline
+@author: Esau Ortiz
+@date: october 2026
+@usage: python dwm1001_bleTrace.py <trace> [--bench-location-data]
+
+        # where <trace> is a trace recorded with --record
+        Optional flags:
+            --bench-location-data   decode every recorded LOCATION_DATA notification and report frames/s
+"""
+import asyncio
+import os
+import struct
+import time
+from collections import namedtuple, deque, Counter
+from dwm1001_bleTransport import gattHandles
+
+MAGIC = b'DWMTRCE1'
+HEADER_STRUCT = struct.Struct('<8sd') # magic, wall clock time at the start of the recording
+# type, start [s since recording start], duration [s], address id, uuid id, status, payload length
+RECORD_STRUCT = struct.Struct('<BdfHHbH')
+
+# record types, strings (addresses, UUIDs and names) are interned with TRACE_STRING records
+TRACE_STRING = 0
+TRACE_SCAN_START = 1
+TRACE_SCAN = 2 # status is the rssi, uuid id refers to the advertised name
+TRACE_DEVICE = 3 # address resolved by findDevices (e.g. from the device cache), uuid id refers to the name
+TRACE_CONNECT = 4
+TRACE_DISCONNECT = 5
+TRACE_READ = 6
+TRACE_WRITE = 7
+TRACE_SUBSCRIBE = 8
+TRACE_NOTIFY = 9
+TRACE_UNSUBSCRIBE = 10
+TRACE_TYPE_NAMES = {TRACE_SCAN_START: 'scan_start', TRACE_SCAN: 'scan', TRACE_DEVICE: 'device', TRACE_CONNECT: 'connect',
+                    TRACE_DISCONNECT: 'disconnect', TRACE_READ: 'read', TRACE_WRITE: 'write', TRACE_SUBSCRIBE: 'subscribe',
+                    TRACE_NOTIFY: 'notify', TRACE_UNSUBSCRIBE: 'unsubscribe'}
+
+# status of operations, failed ones carry the exception repr as payload
+TRACE_OK = 0
+TRACE_FAILED = 1
+
+TraceRecord = namedtuple('TraceRecord', ['type', 'timestamp', 'duration', 'address', 'uuid', 'status', 'payload'])
+TraceDevice = namedtuple('TraceDevice', ['name', 'address', 'rssi'])
+
+class ReplayError(Exception):
+        """ Replayed failure or operation missing from the trace """
+
+class TraceRecorder(object):
+        def __init__(self, path, flush_every = 256):
+                """ Append-only binary trace writer
+                Parameters
+                ----------
+                path: string
+                        trace file, overwritten
+                flush_every: int
+                        records buffered before writing to disk
+                """
+                self.path = path
+                self.flush_every = flush_every
+                self.stream = open(path, 'wb')
+                self.stream.write(HEADER_STRUCT.pack(MAGIC, time.time()))
+                self.start = time.monotonic()
+                self.strings = {}
+                self.buffer = []
+                self.n_records = 0
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+                self.close()
+                return False
+
+        def now(self):
+                """ seconds since the recording started """
+                return time.monotonic() - self.start
+
+        def _stringId(self, string):
+                string_id = self.strings.get(string)
+                if string_id is None:
+                        string_id = self.strings[string] = len(self.strings)
+                        data = string.encode()
+                        self.buffer.append(RECORD_STRUCT.pack(TRACE_STRING, 0.0, 0.0, string_id, 0, TRACE_OK, len(data)) + data)
+                return string_id
+
+        def record(self, record_type, address = '', uuid = '', status = TRACE_OK, payload = b'', timestamp = None, duration = 0.0):
+                """
+                Parameters
+                ----------
+                record_type: int
+                        TRACE_* constant
+                address, uuid: strings
+                status: int
+                        TRACE_OK, TRACE_FAILED or the rssi of scan records
+                payload: bytes-like
+                        at most 65535 bytes are kept
+                timestamp: float
+                        start of the operation, now if not provided
+                duration: float
+                        seconds the operation took
+                """
+                if self.stream is None:
+                        return
+                payload = bytes(payload)[:0xFFFF]
+                timestamp = self.now() if timestamp is None else timestamp
+                address_id, uuid_id = self._stringId(address), self._stringId(uuid)
+                self.buffer.append(RECORD_STRUCT.pack(record_type, timestamp, duration, address_id, uuid_id, status, len(payload)) + payload)
+                self.n_records += 1
+                if len(self.buffer) >= self.flush_every:
+                        self.flush()
+
+        def recordFailure(self, record_type, address, uuid, exc, timestamp):
+                self.record(record_type, address, uuid, TRACE_FAILED, repr(exc).encode(), timestamp, self.now() - timestamp)
+
+        def flush(self):
+                if self.stream is not None and self.buffer:
+                        self.stream.write(b''.join(self.buffer))
+                        self.stream.flush()
+                        self.buffer = []
+
+        def close(self):
+                if self.stream is not None:
+                        self.flush()
+                        self.stream.close()
+                        self.stream = None
+
+def readTrace(path):
+        """ Read a trace, a truncated last record (e.g. the recording
+        crashed) is ignored
+        Returns
+        -------
+        start_time : float, wall clock time at the start of the recording
+        records : list of TraceRecord with strings resolved, in file order
+        Raises
+        ------
+        ValueError: if path is not a trace
+        """
+        with open(path, 'rb') as stream:
+                data = stream.read()
+        if len(data) < HEADER_STRUCT.size:
+                raise ValueError(f'{path} is not a BLE trace')
+        magic, start_time = HEADER_STRUCT.unpack_from(data)
+        if magic != MAGIC:
+                raise ValueError(f'{path} is not a BLE trace')
+        strings = {}
+        records = []
+        offset = HEADER_STRUCT.size
+        while offset + RECORD_STRUCT.size <= len(data):
+                record_type, timestamp, duration, address_id, uuid_id, status, length = RECORD_STRUCT.unpack_from(data, offset)
+                offset += RECORD_STRUCT.size
+                if offset + length > len(data):
+                        break
+                payload = data[offset:offset + length]
+                offset += length
+                if record_type == TRACE_STRING:
+                        strings[address_id] = payload.decode()
+                else:
+                        records.append(TraceRecord(record_type, timestamp, duration, strings[address_id], strings[uuid_id], status, payload))
+        return start_time, records
+
+class RecordingTransport(object):
+        def __init__(self, transport, recorder):
+                """ Transport logging the traffic of transport to recorder
+                Parameters
+                ----------
+                transport: BleakTransport or compatible transport
+                recorder: TraceRecorder
+                """
+                self.transport = transport
+                self.recorder = recorder
+
+        def __getattr__(self, name):
+                # adapter, fleet, ... of the recorded transport
+                return getattr(self.__dict__['transport'], name)
+
+        def createClient(self, address):
+                return RecordingClient(self.transport.createClient(address), address, self.recorder)
+
+        def createScanner(self):
+                return RecordingScanner(self.transport.createScanner(), self.recorder)
+
+        async def discover(self, timeout = 5.0):
+                self.recorder.record(TRACE_SCAN_START)
+                devices = await self.transport.discover(timeout = timeout)
+                for device in devices:
+                        self.recorder.record(TRACE_SCAN, device.address, device.name or '', recordedRssi(device))
+                return devices
+
+        def transientExceptions(self):
+                return self.transport.transientExceptions()
+
+        def capacity(self):
+                return self.transport.capacity()
+
+def recordedRssi(device):
+        rssi = getattr(device, 'rssi', None)
+        return 0 if rssi is None else max(-128, min(127, int(rssi)))
+
+class RecordingScanner(object):
+        def __init__(self, scanner, recorder):
+                self.scanner = scanner
+                self.recorder = recorder
+
+        def register_detection_callback(self, callback):
+                def onDetection(device, advertisement_data):
+                        self.recorder.record(TRACE_SCAN, device.address, device.name or '', recordedRssi(device))
+                        callback(device, advertisement_data)
+                self.scanner.register_detection_callback(onDetection)
+
+        async def start(self):
+                self.recorder.record(TRACE_SCAN_START)
+                await self.scanner.start()
+
+        async def stop(self):
+                await self.scanner.stop()
+
+class RecordingClient(object):
+        def __init__(self, client, address, recorder):
+                """ Client logging every operation of client """
+                self.client = client
+                self.address = address
+                self.recorder = recorder
+
+        @property
+        def is_connected(self):
+                return self.client.is_connected
+
+        def __getattr__(self, name):
+                # services, mtu_size, _acquire_mtu, ...
+                return getattr(self.__dict__['client'], name)
+
+        def _uuid(self, char_specifier):
+                # handles are logged as UUIDs so traces do not depend on the handle table
+                if isinstance(char_specifier, int):
+                        uuids = {handle: uuid for uuid, handle in gattHandles(self.client).items()}
+                        return uuids.get(char_specifier, str(char_specifier))
+                return str(char_specifier)
+
+        async def _recorded(self, record_type, uuid, operation, payload = None):
+                """ Run operation and record it, payload is the recorded data
+                if given, the operation result otherwise
+                """
+                start = self.recorder.now()
+                try:
+                        result = await operation
+                except Exception as exc:
+                        self.recorder.recordFailure(record_type, self.address, uuid, exc, start)
+                        raise
+                data = payload if payload is not None else (result if isinstance(result, (bytes, bytearray)) else b'')
+                self.recorder.record(record_type, self.address, uuid, TRACE_OK, data, start, self.recorder.now() - start)
+                return result
+
+        async def connect(self, **kwargs):
+                return await self._recorded(TRACE_CONNECT, '', self.client.connect(**kwargs))
+
+        async def disconnect(self):
+                return await self._recorded(TRACE_DISCONNECT, '', self.client.disconnect())
+
+        async def read_gatt_char(self, char_specifier, **kwargs):
+                return await self._recorded(TRACE_READ, self._uuid(char_specifier), self.client.read_gatt_char(char_specifier, **kwargs))
+
+        async def write_gatt_char(self, char_specifier, data, response = False):
+                return await self._recorded(TRACE_WRITE, self._uuid(char_specifier),
+                                            self.client.write_gatt_char(char_specifier, data, response), bytes(data))
+
+        async def start_notify(self, char_specifier, callback, **kwargs):
+                uuid = self._uuid(char_specifier)
+                # notifications delivered before start_notify returns, recorded after the subscription
+                # so replay attaches them to it
+                early = []
+                def onNotification(sender, data):
+                        if early is None:
+                                self.recorder.record(TRACE_NOTIFY, self.address, uuid, TRACE_OK, data)
+                        else:
+                                early.append((self.recorder.now(), bytes(data)))
+                        callback(sender, data)
+                start = self.recorder.now()
+                try:
+                        result = await self.client.start_notify(char_specifier, onNotification, **kwargs)
+                except Exception as exc:
+                        self.recorder.recordFailure(TRACE_SUBSCRIBE, self.address, uuid, exc, start)
+                        raise
+                self.recorder.record(TRACE_SUBSCRIBE, self.address, uuid, TRACE_OK, b'', start, self.recorder.now() - start)
+                for timestamp, data in early:
+                        self.recorder.record(TRACE_NOTIFY, self.address, uuid, TRACE_OK, data, timestamp)
+                early = None
+                return result
+
+        async def stop_notify(self, char_specifier):
+                return await self._recorded(TRACE_UNSUBSCRIBE, self._uuid(char_specifier), self.client.stop_notify(char_specifier))
+
+class ReplayTransport(object):
+        def __init__(self, path, realtime = False):
+                """ Transport answering from a recorded trace. Operations are
+                matched to recorded ones per device and characteristic in
+                order; recorded failures are raised again as ReplayError
+                Parameters
+                ----------
+                path: string
+                        trace recorded with RecordingTransport
+                realtime: bool
+                        reproduce recorded durations and notification timing,
+                        otherwise replay as fast as possible
+                """
+                self.path = path
+                self.realtime = realtime
+                self.start_time, records = readTrace(path)
+                self.queues = {} # {(type, address, uuid): deque of TraceRecord}
+                self.notifications = {} # {(address, uuid): deque of subscriptions, each a list of (offset, payload)}
+                self.devices = {} # {address: TraceDevice}
+                self.scan_offsets = {} # {address: seconds from scan start to first advertisement}
+                self.mismatches = [] # (address, uuid, expected, written) of writes that differ from the trace
+                scan_start = None
+                for record in records:
+                        key = (record.address, record.uuid)
+                        if record.type == TRACE_SCAN_START:
+                                scan_start = record.timestamp
+                        elif record.type in (TRACE_SCAN, TRACE_DEVICE):
+                                if record.address not in self.devices:
+                                        self.devices[record.address] = TraceDevice(record.uuid, record.address, record.status)
+                                        if record.type == TRACE_SCAN and scan_start is not None:
+                                                self.scan_offsets[record.address] = record.timestamp - scan_start
+                        elif record.type == TRACE_NOTIFY:
+                                subscriptions = self.notifications.get(key)
+                                if subscriptions:
+                                        start, frames = subscriptions[-1]
+                                        # notifications delivered while subscribing are replayed right away
+                                        frames.append((max(0.0, record.timestamp - start), record.payload))
+                        else:
+                                self.queues.setdefault((record.type,) + key, deque()).append(record)
+                                if record.type == TRACE_SUBSCRIBE and record.status == TRACE_OK:
+                                        self.notifications.setdefault(key, deque()).append((record.timestamp + record.duration, []))
+
+        def next(self, record_type, address, uuid = ''):
+                """ Next recorded operation of a device and characteristic
+                Raises
+                ------
+                ReplayError: if the trace has no more such operations
+                """
+                queue = self.queues.get((record_type, address, uuid))
+                if not queue:
+                        raise ReplayError(f'No recorded {TRACE_TYPE_NAMES[record_type]} of {uuid or address} on {address} left')
+                return queue.popleft()
+
+        def nextNotifications(self, address, uuid):
+                """ Returns
+                -------
+                frames : list of (offset from subscription, payload) of the next recorded subscription
+                """
+                subscriptions = self.notifications.get((address, uuid))
+                return subscriptions.popleft()[1] if subscriptions else []
+
+        async def wait(self, duration):
+                await asyncio.sleep(duration if self.realtime else 0)
+
+        def createClient(self, address):
+                return ReplayClient(self, address)
+
+        def createScanner(self):
+                return ReplayScanner(self)
+
+        async def discover(self, timeout = 5.0):
+                return list(self.devices.values())
+
+        def transientExceptions(self):
+                return (ReplayError,)
+
+        def capacity(self):
+                return None
+
+class ReplayScanner(object):
+        def __init__(self, transport):
+                self.transport = transport
+                self.callback = None
+                self.tasks = []
+
+        def register_detection_callback(self, callback):
+                self.callback = callback
+
+        async def start(self):
+                async def advertise(device):
+                        await self.transport.wait(self.transport.scan_offsets.get(device.address, 0.0))
+                        if self.callback is not None:
+                                self.callback(device, None)
+                self.tasks = [asyncio.ensure_future(advertise(device)) for device in self.transport.devices.values()]
+
+        async def stop(self):
+                for task in self.tasks:
+                        task.cancel()
+                self.tasks = []
+
+class ReplayClient(object):
+        def __init__(self, transport, address):
+                self.transport = transport
+                self.address = address
+                self.is_connected = False
+                self.notify_tasks = {}
+
+        async def _replay(self, record_type, uuid = ''):
+                """ Wait for the recorded duration and raise recorded failures
+                Returns
+                -------
+                record : TraceRecord
+                """
+                if record_type != TRACE_CONNECT and not self.is_connected:
+                        raise ReplayError(f'Not connected to {self.address}')
+                record = self.transport.next(record_type, self.address, uuid)
+                await self.transport.wait(record.duration)
+                if record.status != TRACE_OK:
+                        if record_type != TRACE_CONNECT:
+                                self._dropLink()
+                        raise ReplayError(record.payload.decode(errors = 'replace'))
+                return record
+
+        def _dropLink(self):
+                self.is_connected = False
+                for task in self.notify_tasks.values():
+                        task.cancel()
+                self.notify_tasks.clear()
+
+        async def connect(self, **kwargs):
+                await self._replay(TRACE_CONNECT)
+                self.is_connected = True
+                return True
+
+        async def disconnect(self):
+                self._dropLink()
+                return True
+
+        async def read_gatt_char(self, char_specifier, **kwargs):
+                return bytearray((await self._replay(TRACE_READ, str(char_specifier))).payload)
+
+        async def write_gatt_char(self, char_specifier, data, response = False):
+                record = await self._replay(TRACE_WRITE, str(char_specifier))
+                if bytes(data) != record.payload:
+                        self.transport.mismatches.append((self.address, str(char_specifier), record.payload, bytes(data)))
+
+        async def start_notify(self, char_specifier, callback, **kwargs):
+                uuid = str(char_specifier)
+                await self._replay(TRACE_SUBSCRIBE, uuid)
+                frames = self.transport.nextNotifications(self.address, uuid)
+                async def notify():
+                        start = time.monotonic()
+                        for offset, payload in frames:
+                                if self.transport.realtime:
+                                        await asyncio.sleep(max(0.0, offset - (time.monotonic() - start)))
+                                else:
+                                        # let the consumer keep up instead of overflowing its queue
+                                        await asyncio.sleep(0)
+                                callback(0, bytearray(payload))
+                self.notify_tasks[uuid] = asyncio.ensure_future(notify())
+
+        async def stop_notify(self, char_specifier):
+                task = self.notify_tasks.pop(str(char_specifier), None)
+                if task is not None:
+                        task.cancel()
+
+def summarizeTrace(path):
+        """ Returns
+        -------
+        summary : dictionary with duration, number of records per type,
+                failed operations, devices and bytes of payload
+        """
+        start_time, records = readTrace(path)
+        counts = Counter(TRACE_TYPE_NAMES[record.type] for record in records)
+        return {'start_time': start_time,
+                'duration': max((record.timestamp + record.duration for record in records), default = 0.0),
+                'records': dict(counts),
+                'failures': sum(record.status == TRACE_FAILED and record.type not in (TRACE_SCAN, TRACE_DEVICE) for record in records),
+                'devices': len({record.address for record in records if record.address}),
+                'payload_bytes': sum(len(record.payload) for record in records),
+                'file_bytes': os.path.getsize(path)}
+
+def benchLocationData(path):
+        """ Decode every recorded LOCATION_DATA notification with LocationDataMsg
+        Returns
+        -------
+        n_frames : int
+        frames_per_s : float
+        n_invalid : int
+        """
+        from dwm1001_apiBle import DWM1001_BLE_API_COMMANDS, LocationDataMsg
+        _, records = readTrace(path)
+        frames = [record.payload for record in records
+                  if record.type == TRACE_NOTIFY and record.uuid == DWM1001_BLE_API_COMMANDS.LOCATION_DATA]
+        msg = LocationDataMsg()
+        n_invalid = 0
+        start = time.perf_counter()
+        for frame in frames:
+                try:
+                        msg.decodeBle(frame)
+                except ValueError:
+                        n_invalid += 1
+        elapsed = time.perf_counter() - start
+        return len(frames), len(frames) / elapsed if elapsed > 0 else 0.0, n_invalid
+
+def main():
+        import argparse
+        parser = argparse.ArgumentParser(description = 'Summarize a recorded BLE trace')
+        parser.add_argument('trace', help = 'trace recorded with --record')
+        parser.add_argument('--bench-location-data', action = 'store_true',
+                            help = 'decode every recorded LOCATION_DATA notification and report frames/s')
+        args = parser.parse_args()
+
+        summary = summarizeTrace(args.trace)
+        print(f'Recorded {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(summary["start_time"]))}, '
+              f'{summary["duration"]:.1f} s, {summary["devices"]} devices, {summary["failures"]} failed operations')
+        for record_type, count in sorted(summary['records'].items()):
+                print(f'{record_type:<14}{count}')
+        print(f'{summary["payload_bytes"]} payload bytes in {summary["file_bytes"]} bytes')
+        if args.bench_location_data:
+                n_frames, frames_per_s, n_invalid = benchLocationData(args.trace)
+                print(f'{n_frames} LOCATION_DATA frames decoded at {frames_per_s:.0f} frames/s ({n_invalid} invalid)')
+
+if __name__ == "__main__":
+        main()
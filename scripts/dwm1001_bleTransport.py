@@ -0,0 +1,373 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_bleTransport.py
+@description: BLE transports used by BleConnectionHandler. A transport creates
+              clients and scanners with the bleak interface (connect,
+              read_gatt_char, write_gatt_char, start_notify, ...) so the
+              handler can run over bleak or over a simulated fleet.
+              ShardedTransport spreads connections over several adapters
+@author: Esau Ortiz
+@date: october 2026
+"""
+import asyncio
+import math
+import time
+
+class BleakTransport(object):
+        def __init__(self, adapter = None):
+                """ Transport backed by bleak, bleak is imported on first use
+                Parameters
+                ----------
+                adapter: string
+                        HCI adapter (e.g. 'hci0'), bleak default if not provided
+                """
+                self.adapter = adapter
+
+        def _adapterKwargs(self):
+                return {} if self.adapter is None else {'adapter': self.adapter}
+
+        def createClient(self, address):
+                """ Returns
+                -------
+                client : BleakClient, not connected
+                """
+                from bleak import BleakClient
+                return BleakClient(address, **self._adapterKwargs())
+
+        def createScanner(self):
+                """ Returns
+                -------
+                scanner : BleakScanner
+                """
+                from bleak import BleakScanner
+                return BleakScanner(**self._adapterKwargs())
+
+        async def discover(self, timeout = 5.0):
+                """ Returns
+                -------
+                devices : list of BLEDevice
+                """
+                from bleak import discover
+                return await discover(timeout = timeout, **self._adapterKwargs())
+
+        def transientExceptions(self):
+                """ Returns
+                -------
+                exceptions : tuple of exception classes raised by this transport
+                        on link failures, see RetryPolicy
+                """
+                from bleak.exc import BleakError
+                return (BleakError,)
+
+        def capacity(self):
+                """ Returns
+                -------
+                capacity : int, simultaneous connections supported, None if unknown
+                """
+                return None
+
+class HandleClient(object):
+        def __init__(self, client, handles, on_stale = None):
+                """ Client resolving characteristic UUIDs to handles from a
+                cached handle table, so operations skip the lookup by UUID over
+                the discovered services. Unknown UUIDs are passed as they are.
+                A read or (un)subscription that fails by handle on a live link
+                is retried by UUID, and if that succeeds the table is dropped
+                as stale. A failed write is only retried by UUID when the handle
+                is missing from the discovered services, i.e. nothing was
+                written; otherwise the table is dropped and the error raised, so
+                a write is never sent twice on top of RetryPolicy
+                Parameters
+                ----------
+                client: BleakClient or transport client
+                handles: dictionary of {uuid: handle}
+                on_stale: callable
+                        called without arguments once the table is found stale
+                """
+                self.client = client
+                self.handles = handles
+                self.on_stale = on_stale
+
+        def _resolve(self, char_specifier):
+                if isinstance(char_specifier, str):
+                        return self.handles.get(char_specifier.lower(), char_specifier)
+                return char_specifier
+
+        @property
+        def is_connected(self):
+                return self.client.is_connected
+
+        def __getattr__(self, name):
+                return getattr(self.__dict__['client'], name)
+
+        def _dropTable(self):
+                self.handles = {}
+                if self.on_stale is not None:
+                        self.on_stale()
+
+        def _lookupFailed(self, handle):
+                """ Whether handle is missing from the services the client
+                discovered, in which case the operation failed before anything
+                was sent
+                """
+                discovered = gattHandles(self.client)
+                return bool(discovered) and handle not in discovered.values()
+
+        async def _call(self, operation, char_specifier, *args, idempotent = True, **kwargs):
+                handle = self._resolve(char_specifier)
+                if handle is char_specifier:
+                        return await operation(char_specifier, *args, **kwargs)
+                try:
+                        return await operation(handle, *args, **kwargs)
+                except Exception:
+                        if not self.client.is_connected:
+                                raise
+                        if not idempotent and not self._lookupFailed(handle):
+                                # the write may have been applied, RetryPolicy decides whether to send it again
+                                self._dropTable()
+                                raise
+                        result = await operation(char_specifier, *args, **kwargs)
+                        self._dropTable()
+                        return result
+
+        async def read_gatt_char(self, char_specifier, **kwargs):
+                return await self._call(self.client.read_gatt_char, char_specifier, **kwargs)
+
+        async def write_gatt_char(self, char_specifier, data, response = False):
+                return await self._call(self.client.write_gatt_char, char_specifier, data, response, idempotent = False)
+
+        async def start_notify(self, char_specifier, callback, **kwargs):
+                # enabling notifications twice leaves them enabled
+                return await self._call(self.client.start_notify, char_specifier, callback, **kwargs)
+
+        async def stop_notify(self, char_specifier):
+                return await self._call(self.client.stop_notify, char_specifier)
+
+def gattHandles(client):
+        """ Returns
+        -------
+        handles : dictionary of {uuid: handle} of every characteristic the
+                client discovered, empty if the client does not expose services
+        """
+        services = getattr(client, 'services', None)
+        if services is None:
+                return {}
+        return {str(characteristic.uuid).lower(): characteristic.handle
+                for service in services for characteristic in service.characteristics}
+
+async def negotiateMtu(client):
+        """ Request the largest ATT MTU the backend supports, so long
+        values are read and notified in as few packets as possible
+        Returns
+        -------
+        mtu : int, None if the backend does not report it
+        """
+        # bleak only exposes MTU exchange on some backends and versions
+        acquire = getattr(client, '_acquire_mtu', None)
+        if acquire is not None:
+                try:
+                        await acquire()
+                except Exception as exc:
+                        print(f'MTU could not be negotiated: {exc!r}')
+        return getattr(client, 'mtu_size', None)
+
+class AdapterShard(object):
+        """ Per adapter state kept by ShardedTransport """
+        def __init__(self, index, transport):
+                self.index = index
+                self.transport = transport
+                self.clients = set() # ShardedClient connected or connecting through this adapter
+                self.rssi = {} # {address: last seen rssi}
+                self.failures = {} # {address: time of last connection failure}
+
+        def load(self):
+                # links dropped without disconnect are forgotten here
+                self.clients = {client for client in self.clients if client.connecting or client.is_connected}
+                return len(self.clients)
+
+        def recentlyFailed(self, address, failure_timeout):
+                failed_at = self.failures.get(address)
+                return failed_at is not None and time.monotonic() - failed_at < failure_timeout
+
+class ShardedClient(object):
+        def __init__(self, sharded_transport, address):
+                """ Client whose adapter is chosen by ShardedTransport when
+                connecting, every other call goes to the client of that adapter
+                """
+                self.sharded_transport = sharded_transport
+                self.address = address
+                self.shard = None
+                self.client = None
+                self.connecting = False
+
+        @property
+        def is_connected(self):
+                return self.client is not None and self.client.is_connected
+
+        @property
+        def adapter(self):
+                return None if self.shard is None else self.shard.transport.adapter
+
+        def __getattr__(self, name):
+                # services, mtu_size, ... of the client of the chosen adapter
+                client = self.__dict__.get('client')
+                if client is None:
+                        raise AttributeError(name)
+                return getattr(client, name)
+
+        async def connect(self, **kwargs):
+                self.shard = self.sharded_transport.assign(self.address)
+                self.shard.clients.add(self)
+                self.client = self.shard.transport.createClient(self.address)
+                self.connecting = True
+                try:
+                        return await self.client.connect(**kwargs)
+                except BaseException:
+                        self._failed()
+                        raise
+                finally:
+                        self.connecting = False
+
+        def _failed(self):
+                # next connection to this device prefers another adapter
+                self.shard.failures[self.address] = time.monotonic()
+                if not self.is_connected:
+                        self.shard.clients.discard(self)
+
+        async def _call(self, method, *args, **kwargs):
+                try:
+                        return await getattr(self.client, method)(*args, **kwargs)
+                except self.shard.transport.transientExceptions():
+                        self._failed()
+                        raise
+
+        async def disconnect(self):
+                if self.shard is not None:
+                        self.shard.clients.discard(self)
+                if self.client is not None:
+                        return await self.client.disconnect()
+                return True
+
+        async def read_gatt_char(self, char_specifier, **kwargs):
+                return await self._call('read_gatt_char', char_specifier, **kwargs)
+
+        async def write_gatt_char(self, char_specifier, data, response = False):
+                return await self._call('write_gatt_char', char_specifier, data, response)
+
+        async def start_notify(self, char_specifier, callback, **kwargs):
+                return await self._call('start_notify', char_specifier, callback, **kwargs)
+
+        async def stop_notify(self, char_specifier):
+                return await self._call('stop_notify', char_specifier)
+
+class ShardedScanner(object):
+        """ Scans on every adapter at once, recording the RSSI each adapter sees """
+        def __init__(self, sharded_transport):
+                self.sharded_transport = sharded_transport
+                self.scanners = []
+                for shard in sharded_transport.shards:
+                        scanner = shard.transport.createScanner()
+                        scanner.register_detection_callback(self._detectionCallback(shard))
+                        self.scanners.append(scanner)
+                self.callback = None
+
+        def _detectionCallback(self, shard):
+                def onDetection(device, advertisement_data):
+                        self.sharded_transport.recordRssi(shard, device)
+                        if self.callback is not None:
+                                self.callback(device, advertisement_data)
+                return onDetection
+
+        def register_detection_callback(self, callback):
+                self.callback = callback
+
+        async def start(self):
+                await asyncio.gather(*[scanner.start() for scanner in self.scanners])
+
+        async def stop(self):
+                await asyncio.gather(*[scanner.stop() for scanner in self.scanners], return_exceptions = True)
+
+class ShardedTransport(object):
+        def __init__(self, transports, max_connections_per_adapter = None, failure_timeout = 30.0):
+                """ Spread connections over several adapters. Each connection
+                goes to the adapter with the fewest open connections, ties
+                broken by the best RSSI seen by that adapter. An adapter whose
+                connection to a device failed is avoided for that device during
+                failure_timeout seconds, so retries fail over to another adapter
+                Parameters
+                ----------
+                transports: list of transports, one per adapter, e.g.
+                        [BleakTransport('hci0'), BleakTransport('hci1')]
+                max_connections_per_adapter: int
+                        adapters at this number of connections are only used if
+                        every adapter is, None for no limit
+                failure_timeout: float
+                        seconds a failed adapter is avoided for a device
+                """
+                self.shards = [AdapterShard(index, transport) for index, transport in enumerate(transports)]
+                self.max_connections_per_adapter = max_connections_per_adapter
+                self.failure_timeout = failure_timeout
+
+        @property
+        def adapter(self):
+                return ','.join(str(shard.transport.adapter) for shard in self.shards)
+
+        def recordRssi(self, shard, device):
+                rssi = getattr(device, 'rssi', None)
+                if rssi is not None:
+                        shard.rssi[device.address] = rssi
+
+        def assign(self, address):
+                """ Choose the adapter of a new connection to address
+                Returns
+                -------
+                shard : AdapterShard
+                """
+                def cost(shard):
+                        full = self.max_connections_per_adapter is not None and shard.load() >= self.max_connections_per_adapter
+                        # adapters that never saw the device rank after the ones that did
+                        rssi = shard.rssi.get(address, -math.inf)
+                        return (shard.recentlyFailed(address, self.failure_timeout), full, shard.load(), -rssi, shard.index)
+                return min(self.shards, key = cost)
+
+        def load(self):
+                """ Returns
+                -------
+                load : dictionary of {adapter: open connections}
+                """
+                return {shard.transport.adapter: shard.load() for shard in self.shards}
+
+        def createClient(self, address):
+                return ShardedClient(self, address)
+
+        def createScanner(self):
+                return ShardedScanner(self)
+
+        async def discover(self, timeout = 5.0):
+                results = await asyncio.gather(*[shard.transport.discover(timeout) for shard in self.shards])
+                devices = {}
+                for shard, shard_devices in zip(self.shards, results):
+                        for device in shard_devices:
+                                self.recordRssi(shard, device)
+                                devices.setdefault(device.address, device)
+                return list(devices.values())
+
+        def capacity(self):
+                capacities = [shard.transport.capacity() for shard in self.shards]
+                if self.max_connections_per_adapter is not None:
+                        capacities = [self.max_connections_per_adapter if capacity is None else min(capacity, self.max_connections_per_adapter)
+                                      for capacity in capacities]
+                return None if None in capacities else sum(capacities)
+
+        def transientExceptions(self):
+                exceptions = ()
+                for shard in self.shards:
+                        exceptions += tuple(exc for exc in shard.transport.transientExceptions() if exc not in exceptions)
+                return exceptions
+
+def adapterTransport(adapters):
+        """ Transport for a list of adapter names, e.g. ['hci0', 'hci1'] """
+        if len(adapters) == 1:
+                return BleakTransport(adapters[0])
+        return ShardedTransport([BleakTransport(adapter) for adapter in adapters])
@@ -0,0 +1,289 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_calibration.py
+@description: fleet-wide autocalibration scheduler. Every anchor of the nodes
+              configuration is switched to tag mode in turn, ranges to the
+              anchors of every network are collected and merged into a single
+              anchor by anchor range matrix
+@author: Esau Ortiz
+@date: october 2026
+"""
+import asyncio
+import math
+import time
+from collections import namedtuple
+from dwm1001_apiBle import BleOperationError
+from dwm1001_apiBle import OperationModeMsg, NetworkIdMsg, LocationDataMsg, LocationDataModeMsg
+from dwm1001_bleCodec import LOCATION_DATA_DISTANCES, parseNetworkId
+from dwm1001_rangeStats import AdaptiveSampler
+
+CalibrationNetwork = namedtuple('CalibrationNetwork', ['network_id', 'anchor_ids', 'coordinates'])
+
+def parseNetworks(nodes_cfg):
+        """ Read networks from a nodes configuration with n_networks and
+        networkN entries, each one with network_id, n_anchors, anchorM_id and
+        optionally anchorM_coordinates
+        Returns
+        -------
+        networks : list of CalibrationNetwork
+        """
+        networks = []
+        for i in range(nodes_cfg['n_networks']):
+                network_cfg = nodes_cfg['network' + str(i)]
+                anchor_ids = []
+                coordinates = {}
+                for j in range(network_cfg['n_anchors']):
+                        anchor_id = network_cfg['anchor' + str(j) + '_id']
+                        anchor_ids.append(anchor_id)
+                        if 'anchor' + str(j) + '_coordinates' in network_cfg:
+                                coordinates[anchor_id] = network_cfg['anchor' + str(j) + '_coordinates']
+                networks.append(CalibrationNetwork(network_cfg['network_id'], anchor_ids, coordinates))
+        return networks
+
+class CalibrationScheduler(object):
+        def __init__(self, ble_handler, networks, tag_operation_mode, n_samples = 10, sample_time_budget = 1.0,
+                     interference_range = 30.0, known_ranges = None, on_sample = None,
+                     confidence_interval = None, min_samples = 5):
+                """ Collect the full inter-anchor range matrix in a single run
+                Parameters
+                ----------
+                ble_handler: AsyncBleConnectionHandler
+                networks: list of CalibrationNetwork
+                tag_operation_mode: dictionary
+                        operation mode used while an anchor is ranging as tag
+                n_samples: int
+                        samples per target and network, hard cap if confidence_interval is given
+                sample_time_budget: float
+                        seconds allowed per requested sample before giving up on a network
+                interference_range: float
+                        targets whose configured coordinates are closer than
+                        this distance in meters are never calibrated at the same time
+                known_ranges: dictionary of {(anchor_id, anchor_id): distance}
+                        e.g. from a previous run, targets that ranged each other
+                        are never calibrated at the same time
+                on_sample: callable
+                        called with (timestamp, target_id, network_id, anchor_id, distance)
+                        for every received range, outliers included
+                confidence_interval: float
+                        stop sampling a network once the mean range to every
+                        visible anchor is known within +/- confidence_interval
+                        meters (95 %), see AdaptiveSampler
+                min_samples: int
+                        samples per target and network before stopping early
+                """
+                self.ble_handler = ble_handler
+                self.networks = networks
+                self.tag_operation_mode = tag_operation_mode
+                self.n_samples = n_samples
+                self.sample_time_budget = sample_time_budget
+                self.interference_range = interference_range
+                self.known_ranges = known_ranges if known_ranges is not None else {}
+                self.on_sample = on_sample
+                self.confidence_interval = confidence_interval
+                self.min_samples = min_samples
+                self.anchor_ids = [anchor_id for network in networks for anchor_id in network.anchor_ids]
+                self.home_network = {anchor_id: network for network in networks for anchor_id in network.anchor_ids}
+                self.range_sums = {} # {(target_id, anchor_id): (sum, n)}
+                self.n_writes = 0
+                self.n_frames = 0
+
+        def conflicts(self, target_a, target_b):
+                """ Whether two targets may disturb each other's ranging if both
+                are tags at the same time, i.e. they share their home network or
+                may be in range of each other
+                """
+                if self.home_network[target_a] is self.home_network[target_b]:
+                        return True
+                if (target_a, target_b) in self.known_ranges or (target_b, target_a) in self.known_ranges:
+                        return True
+                coordinates_a = self.home_network[target_a].coordinates.get(target_a)
+                coordinates_b = self.home_network[target_b].coordinates.get(target_b)
+                if coordinates_a is None or coordinates_b is None:
+                        # unknown position, assume they are in range
+                        return True
+                distance = math.sqrt(sum((float(a) - float(b)) ** 2 for a, b in zip(coordinates_a, coordinates_b)))
+                return distance < self.interference_range
+
+        def batches(self, targets = None):
+                """ Group targets in batches of mutually non conflicting anchors
+                (greedy coloring of the conflict graph, most constrained first)
+                Returns
+                -------
+                batches : list of lists of anchor ids
+                """
+                targets = list(self.anchor_ids if targets is None else targets)
+                degree = {target: sum(self.conflicts(target, other) for other in targets if other != target) for target in targets}
+                batches = []
+                for target in sorted(targets, key = lambda target: -degree[target]):
+                        for batch in batches:
+                                if not any(self.conflicts(target, other) for other in batch):
+                                        batch.append(target)
+                                        break
+                        else:
+                                batches.append([target])
+                return batches
+
+        def networkOrder(self, target_id):
+                """ Networks visited by target, the home network first since the
+                target is already in it and last write brings it back home
+                """
+                home = self.home_network[target_id]
+                return [home] + [network for network in self.networks if network is not home]
+
+        async def _write(self, address, msgs):
+                self.n_writes += len(msgs)
+                await self.ble_handler.sendBatch(address, msgs)
+
+        def sampler(self):
+                return AdaptiveSampler(self.confidence_interval, max_samples = self.n_samples,
+                                       min_samples = min(self.min_samples, self.n_samples))
+
+        async def _collect(self, target_id, address, network):
+                location_data_msg = LocationDataMsg()
+                sampler = self.sampler()
+                deadline = time.monotonic() + self.n_samples * self.sample_time_budget
+                while not sampler.done() and time.monotonic() < deadline:
+                        # every frame is a sample, none is dropped while samples are processed
+                        frames = self.ble_handler.stream(address, location_data_msg, n_samples = sampler.remaining(),
+                                                         duration = deadline - time.monotonic(), queue_size = None)
+                        try:
+                                async for timestamp, location_data in frames:
+                                        ranges = {'DW' + anchor: distance for anchor, distance in location_data.ranges().items()
+                                                  if 'DW' + anchor in self.home_network}
+                                        accepted = sampler.update(ranges)
+                                        for anchor_id, distance in ranges.items():
+                                                self.addSample(timestamp, target_id, network.network_id, anchor_id, distance,
+                                                               accepted = anchor_id in accepted)
+                                        if sampler.done():
+                                                break
+                        except BleOperationError as exc:
+                                print(f'{exc}. Retrying ... ')
+                        finally:
+                                await frames.aclose()
+                self.n_frames += sampler.n_frames
+                n_rejected = sum(stats.n_rejected for stats in sampler.anchors.values())
+                if not sampler.done():
+                        print(f'{target_id}: only {sampler.n_frames}/{self.n_samples} samples received from network {network.network_id}')
+                elif sampler.n_frames < self.n_samples:
+                        print(f'{target_id}: ranges in network {network.network_id} converged after {sampler.n_frames} samples')
+                if n_rejected:
+                        print(f'{target_id}: {n_rejected} outlier ranges rejected in network {network.network_id}')
+
+        def addSample(self, timestamp, target_id, network_id, anchor_id, distance, accepted = True):
+                """ Record a range, rejected ones are only passed to on_sample """
+                if anchor_id not in self.home_network:
+                        return
+                if accepted:
+                        total, n = self.range_sums.get((target_id, anchor_id), (0.0, 0))
+                        self.range_sums[(target_id, anchor_id)] = (total + distance, n + 1)
+                if self.on_sample is not None:
+                        self.on_sample(timestamp, target_id, network_id, anchor_id, distance)
+
+        def _substituteInitiator(self, target_id, targets):
+                """ Non target anchor of target's network that can act as initiator """
+                for anchor_id in self.home_network[target_id].anchor_ids:
+                        if anchor_id != target_id and anchor_id not in targets and anchor_id in self.addresses:
+                                return anchor_id
+                return None
+
+        async def calibrateTarget(self, target_id, targets):
+                """ Switch target to tag, collect ranges in every network and
+                restore its original operation mode, location data mode and
+                network. Every step that was started is undone, even if it
+                failed halfway
+                """
+                address = self.addresses[target_id]
+                home = self.home_network[target_id]
+                operation_mode_msg = OperationModeMsg()
+                original_mode = await self.ble_handler.read(address, operation_mode_msg, decode_msg = True)
+                original_location_data_mode = await self.ble_handler.read(address, LocationDataModeMsg(), decode_msg = True)
+
+                substitute_id, substitute_mode = None, None
+                switched = False
+                current_network_id = parseNetworkId(home.network_id)
+                try:
+                        # keep target's network ranging while the target is a tag
+                        if original_mode['initiator_enable']:
+                                candidate_id = self._substituteInitiator(target_id, targets)
+                                if candidate_id is not None:
+                                        substitute_address = self.addresses[candidate_id]
+                                        substitute_mode = await self.ble_handler.read(substitute_address, operation_mode_msg, decode_msg = True)
+                                        substitute_id = candidate_id
+                                        print(f'{substitute_id} acts as initiator of network {home.network_id} while {target_id} is calibrated')
+                                        await self._write(substitute_address, [OperationModeMsg(dict(substitute_mode, initiator_enable = 1))])
+
+                        print(f'{target_id}: anchor -> tag')
+                        switched = True
+                        await self._write(address, [OperationModeMsg(dict(self.tag_operation_mode)), LocationDataModeMsg(LOCATION_DATA_DISTANCES)])
+                        for network in self.networkOrder(target_id):
+                                if parseNetworkId(network.network_id) != current_network_id:
+                                        # set first, a failed write may still have been applied
+                                        current_network_id = parseNetworkId(network.network_id)
+                                        await self._write(address, [NetworkIdMsg(network.network_id)])
+                                print(f'{target_id}: retrieving ranges in network {network.network_id}')
+                                await self._collect(target_id, address, network)
+                finally:
+                        try:
+                                if switched:
+                                        print(f'{target_id}: tag -> anchor')
+                                        restore_msgs = []
+                                        if current_network_id != parseNetworkId(home.network_id):
+                                                restore_msgs.append(NetworkIdMsg(home.network_id))
+                                        restore_msgs += [OperationModeMsg(original_mode), LocationDataModeMsg(original_location_data_mode)]
+                                        await self._write(address, restore_msgs)
+                        finally:
+                                if substitute_id is not None:
+                                        await self._write(self.addresses[substitute_id], [OperationModeMsg(substitute_mode)])
+
+        async def run(self, addresses, targets = None):
+                """ Calibrate every target, targets of the same batch are
+                calibrated concurrently
+                Parameters
+                ----------
+                addresses: dictionary of {anchor_id: address}
+                targets: list of anchor ids, every found anchor if not provided
+                Returns
+                -------
+                failed: list of anchor ids that could not be calibrated
+                """
+                self.addresses = addresses
+                targets = [target for target in (self.anchor_ids if targets is None else targets) if target in addresses]
+                failed = []
+                for batch_idx, batch in enumerate(self.batches(targets)):
+                        print(f'Batch {batch_idx + 1}: {", ".join(batch)}')
+                        results = await asyncio.gather(*[self.calibrateTarget(target_id, batch) for target_id in batch], return_exceptions = True)
+                        for target_id, result in zip(batch, results):
+                                if isinstance(result, Exception):
+                                        print(f'{target_id} calibration failed: {result}')
+                                        failed.append(target_id)
+                return failed
+
+        def rangeMatrix(self):
+                """ Anchor by anchor matrix of mean ranges, both directions of
+                each pair are merged
+                Returns
+                -------
+                ranges : (N, N) array in meters, NaN where no range was collected
+                counts : (N, N) array with the number of samples
+                """
+                import numpy as np
+                n_anchors = len(self.anchor_ids)
+                index = {anchor_id: idx for idx, anchor_id in enumerate(self.anchor_ids)}
+                sums = np.zeros((n_anchors, n_anchors))
+                counts = np.zeros((n_anchors, n_anchors), dtype = int)
+                for (target_id, anchor_id), (total, n) in self.range_sums.items():
+                        i, j = index[target_id], index[anchor_id]
+                        sums[i, j] += total
+                        counts[i, j] += n
+                sums = sums + sums.T
+                counts = counts + counts.T
+                with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                        ranges = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+                return ranges, counts
+
+        def save(self, path):
+                """ Save range matrix, sample counts and anchor ids as .npz """
+                import numpy as np
+                ranges, counts = self.rangeMatrix()
+                np.savez(path, ranges = ranges, counts = counts, anchor_ids = np.array(self.anchor_ids))
@@ -0,0 +1,361 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_cli.py
+@description: single entry point to scan, configure, read and calibrate
+              modules. Modules are imported only by the subcommands that need
+              them (numpy only by calibrate), and when a daemon is running
+              subcommands are forwarded to it over a unix socket, so the
+              client imports nothing but the standard library while the
+              daemon keeps the event loop, device cache and connections warm
+@author: Esau Ortiz
+@date: october 2026
+@usage: python dwm1001_cli.py <command> [options]
+
+        # where <command> is one of
+            scan [NAMES ...]                    scan BT devices, only NAMES if given
+            configure [LABEL] [DEVICES ...]     write nodes_cfg/LABEL.yaml (default 'default') to the found devices,
+                                                asking per device unless --yes is given (required through the daemon)
+            read DEVICE CHARACTERISTIC          read and decode a characteristic, e.g. read DW2020 operation_mode
+            calibrate [LABEL]                   collect the range matrix of every anchor of nodes_cfg/LABEL.yaml
+            stats                               BLE latency stats collected by the daemon
+            daemon                              serve the other commands over a unix socket
+        Optional flags of every command:
+            --socket PATH           daemon socket (default $XDG_RUNTIME_DIR/dwm1001_ble.sock)
+            --no-daemon             run the command in this process even if a daemon is running
+        Run python dwm1001_cli.py <command> --help for the options of each command
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), 'dwm1001_ble.sock')
+
+# characteristic name: message class of dwm1001_apiBle
+READ_MSGS = {'operation_mode': 'OperationModeMsg',
+             'network_id': 'NetworkIdMsg',
+             'location_data_mode': 'LocationDataModeMsg',
+             'location_data': 'LocationDataMsg',
+             'device_info': 'DeviceInfoMsg',
+             'statistics': 'StatisticsMsg',
+             'mac_stats': 'MacStatsMsg',
+             'cluster_info': 'ClusterInfoMsg',
+             'anchor_list': 'AnchorListMsg',
+             'proxy_positions': 'ProxyPositionsMsg'}
+
+# arguments holding paths, made absolute before a command is forwarded to the daemon
+PATH_ARGS = ('params_dir', 'output', 'samples_output', 'stats_output')
+
+def parseArgs(argv = None):
+    common = argparse.ArgumentParser(add_help = False)
+    common.add_argument('--socket', default = DEFAULT_SOCKET,
+                        help = 'daemon socket')
+    common.add_argument('--no-daemon', action = 'store_true',
+                        help = 'run the command in this process even if a daemon is running')
+    common.add_argument('--adapters', default = None,
+                        help = 'comma separated HCI adapters to spread connections over, e.g. hci0,hci1. '
+                               'Ignored when the command runs in the daemon')
+
+    parser = argparse.ArgumentParser(description = 'DWM1001 BLE command line interface')
+    commands = parser.add_subparsers(dest = 'command')
+    commands.required = True
+
+    scan = commands.add_parser('scan', parents = [common], help = 'scan BT devices')
+    scan.add_argument('names', nargs = '*',
+                      help = 'device names to look for, cached addresses are used unless --rescan is given')
+    scan.add_argument('--timeout', type = float, default = 5.0,
+                      help = 'maximum scanning time in seconds')
+    scan.add_argument('--rescan', action = 'store_true',
+                      help = 'ignore cached device addresses')
+
+    configure = commands.add_parser('configure', parents = [common], help = 'configure tag and anchors')
+    configure.add_argument('nodes_cfg_description', nargs = '?', default = 'default',
+                           help = "label of nodes_cfg/<label>.yaml, 'default' if not provided")
+    configure.add_argument('devices', nargs = '*',
+                           help = 'only configure these devices of the plan')
+    configure.add_argument('--params-dir', default = None,
+                           help = 'directory with nodes_cfg/ and operation mode yaml files '
+                                  '(default params/ of the enclosing dwm1001_drivers package, or ~/catkin_ws/src/dwm1001_drivers/params)')
+    configure.add_argument('--max-concurrency', type = int, default = 4,
+                           help = 'maximum number of devices configured at once')
+    configure.add_argument('--scan-timeout', type = float, default = 5.0,
+                           help = 'maximum scanning time in seconds')
+    configure.add_argument('--rescan', action = 'store_true',
+                           help = 'ignore cached device addresses')
+    configure.add_argument('--diff', action = 'store_true',
+                           help = 'read current settings and only write the ones that differ')
+    configure.add_argument('--dry-run', action = 'store_true',
+                           help = 'print the configuration plan without connecting to any device')
+    configure.add_argument('-y', '--yes', action = 'store_true',
+                           help = 'do not ask for confirmation before configuring a node, required to configure through the daemon')
+
+    read = commands.add_parser('read', parents = [common], help = 'read and decode a characteristic')
+    read.add_argument('device', help = 'module id with DW1234 format')
+    read.add_argument('characteristic', choices = sorted(READ_MSGS))
+
+    calibrate = commands.add_parser('calibrate', parents = [common], help = 'collect the inter-anchor range matrix')
+    calibrate.add_argument('nodes_cfg_description', nargs = '?', default = 'default',
+                           help = "label of nodes_cfg/<label>.yaml, 'default' if not provided")
+    calibrate.add_argument('--params-dir', default = None,
+                           help = 'directory with nodes_cfg/ and operation mode yaml files '
+                                  '(default params/ of the enclosing dwm1001_drivers package, or ~/catkin_ws/src/dwm1001_drivers/params)')
+    calibrate.add_argument('--n-samples', type = int, default = 10,
+                           help = 'samples per anchor and network')
+    calibrate.add_argument('--output', default = 'ranging_matrix.npz',
+                           help = 'range matrix file')
+    calibrate.add_argument('--samples-output', default = None,
+                           help = 'append every range sample to this sample store')
+    calibrate.add_argument('--confidence-interval', type = float, default = None,
+                           help = "stop sampling a network once every anchor's mean range is known within +/- this many meters")
+    calibrate.add_argument('--min-samples', type = int, default = 5,
+                           help = 'samples per network before stopping early')
+
+    stats = commands.add_parser('stats', parents = [common], help = 'BLE latency stats collected by the daemon')
+    stats.add_argument('--stats-output', default = None,
+                       help = 'export the stats as json (or csv if the file ends with .csv)')
+
+    daemon = commands.add_parser('daemon', parents = [common], help = 'serve the other commands over a unix socket')
+    daemon.add_argument('--max-connections', type = int, default = 8,
+                        help = 'maximum number of simultaneously open connections')
+    daemon.add_argument('--idle-timeout', type = float, default = 300.0,
+                        help = 'seconds an unused connection is kept open')
+    daemon.add_argument('--stop', action = 'store_true',
+                        help = 'stop the running daemon')
+    return parser.parse_args(argv)
+
+async def scanCmd(ble_handler, args):
+    if args.names:
+        devices = await ble_handler.findDevices(args.names, args.timeout, use_cache = not args.rescan)
+        for name in args.names:
+            if name not in devices:
+                print(f'{name} not found')
+    else:
+        devices = await ble_handler.scan(None, args.timeout)
+    for name, address in sorted(devices.items()):
+        print(f'{name:<10}{address}')
+    return 0 if all(name in devices for name in args.names) else 1
+
+async def configureCmd(ble_handler, args):
+    from dwm1001_configPlan import DEFAULT_PARAMS_DIR, DEFAULT_PLAN_CACHE_DIR, paramsPaths, loadPlan, executePlan
+    from dwm1001_configure import confirm, printFleetReport
+    paths = paramsPaths(args.params_dir or DEFAULT_PARAMS_DIR, args.nodes_cfg_description)
+    plan, cached = loadPlan(paths, DEFAULT_PLAN_CACHE_DIR)
+    print(f'Configuration plan {plan.config_hash[:12]} ' + ('loaded from cache' if cached else 'compiled'))
+    if args.dry_run:
+        print('\n'.join(plan.describe()))
+        return 0
+    names = [device for device in plan.devices() if not args.devices or device in args.devices]
+    devices = await ble_handler.findDevices(names, args.scan_timeout, use_cache = not args.rescan)
+    # same prompts as dwm1001_configure.py, anchors are configured unless refused, tags only when accepted
+    selected = {}
+    for device, role in plan.roles:
+        if device not in names:
+            continue
+        if device not in devices:
+            print(f'{role.capitalize()} {device} not found')
+        elif confirm(f'{role.capitalize()} {device} found. Do you want to configure it? (y/n)', args.yes, role != 'tag'):
+            selected[device] = devices[device]
+    results = await executePlan(ble_handler, plan, selected, args.max_concurrency, args.diff)
+    printFleetReport(results)
+    return 0 if len(devices) == len(names) and all(result['success'] for result in results) else 1
+
+async def readCmd(ble_handler, args):
+    import dwm1001_apiBle
+    devices = await ble_handler.findDevices([args.device])
+    if args.device not in devices:
+        print(f'{args.device} not found')
+        return 1
+    msg = getattr(dwm1001_apiBle, READ_MSGS[args.characteristic])()
+    print(await ble_handler.read(devices[args.device], msg, decode_msg = True))
+    return 0
+
+async def calibrateCmd(ble_handler, args):
+    import time
+    import yaml
+    from dwm1001_calibration import CalibrationScheduler, parseNetworks
+    from dwm1001_configPlan import DEFAULT_PARAMS_DIR, paramsPaths
+    from dwm1001_sampleStore import SampleStore
+    nodes_cfg_path, _, tag_operation_mode_path = paramsPaths(args.params_dir or DEFAULT_PARAMS_DIR, args.nodes_cfg_description)
+    with open(nodes_cfg_path) as stream:
+        nodes_cfg = yaml.safe_load(stream)
+    with open(tag_operation_mode_path) as stream:
+        tag_operation_mode = yaml.safe_load(stream)
+    sample_store = SampleStore(args.samples_output) if args.samples_output is not None else None
+    scheduler = CalibrationScheduler(ble_handler, parseNetworks(nodes_cfg), tag_operation_mode, n_samples = args.n_samples,
+                                     on_sample = sample_store.append if sample_store is not None else None,
+                                     confidence_interval = args.confidence_interval, min_samples = args.min_samples)
+    devices = await ble_handler.findDevices(scheduler.anchor_ids)
+    for anchor_id in scheduler.anchor_ids:
+        if anchor_id not in devices:
+            print(f'Module {anchor_id} not found')
+    start = time.monotonic()
+    try:
+        failed = await scheduler.run(devices)
+    finally:
+        if sample_store is not None:
+            sample_store.close()
+    scheduler.save(args.output)
+    print(f'{len(devices) - len(failed)} anchors calibrated in {time.monotonic() - start:.1f} s '
+          f'with {scheduler.n_writes} writes and {scheduler.n_frames} samples. Range matrix saved to {args.output}')
+    return 0 if not failed and len(devices) == len(scheduler.anchor_ids) else 1
+
+async def statsCmd(ble_handler, args):
+    if not ble_handler.ble_stats.enabled:
+        print('BLE stats are collected by the daemon, start it with: python dwm1001_cli.py daemon')
+        return 1
+    stats = ble_handler.stats()
+    print(f'{"phase":<12}{"count":<8}{"mean [ms]":<12}{"p95 [ms]":<12}{"p99 [ms]":<12}')
+    for phase, summary in sorted(stats['phases'].items()):
+        if summary['count']:
+            print(f'{phase:<12}{summary["count"]:<8}{summary["mean_ms"]:<12.1f}{summary["p95_ms"]:<12.1f}{summary["p99_ms"]:<12.1f}')
+    for name, value in sorted(stats['counters'].items()):
+        print(f'{name}: {value}')
+    print(f'{len(ble_handler.pool.connections)} open connections, up for {stats["elapsed_s"]:.0f} s')
+    if args.stats_output is not None:
+        ble_handler.exportStats(args.stats_output)
+        print(f'BLE stats exported to {args.stats_output}')
+    return 0
+
+COMMANDS = {'scan': scanCmd, 'configure': configureCmd, 'read': readCmd, 'calibrate': calibrateCmd, 'stats': statsCmd}
+
+def runLocal(args):
+    """ Run the command in this process with a new BLE handler """
+    import asyncio
+    from dwm1001_apiBle import AsyncBleConnectionHandler
+    async def run():
+        async with AsyncBleConnectionHandler(max(4, getattr(args, 'max_concurrency', 4)),
+                                             adapters = args.adapters.split(',') if args.adapters else None) as ble_handler:
+            return await COMMANDS[args.command](ble_handler, args)
+    return asyncio.get_event_loop().run_until_complete(run())
+
+def forward(args, request):
+    """ Send request to the daemon and print its output
+    Returns
+    -------
+    status : int, exit status of the command, None if no daemon is running
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(args.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        return None
+    with client, client.makefile('rwb') as stream:
+        stream.write(json.dumps(request).encode() + b'\n')
+        stream.flush()
+        for line in stream:
+            message = json.loads(line.decode())
+            if 'status' in message:
+                return message['status']
+            sys.stdout.write(message['output'])
+            sys.stdout.flush()
+    print('Connection to the daemon lost')
+    return 1
+
+class SocketOutput(object):
+    """ File-like object sending every complete line to a daemon client """
+    def __init__(self, writer):
+        self.writer = writer
+        self.buffer = ''
+
+    def write(self, text):
+        self.buffer += text
+        if '\n' in self.buffer:
+            end = self.buffer.rindex('\n') + 1
+            self.writer.write(json.dumps({'output': self.buffer[:end]}).encode() + b'\n')
+            self.buffer = self.buffer[end:]
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.writer.write(json.dumps({'output': self.buffer}).encode() + b'\n')
+            self.buffer = ''
+
+def runDaemon(args):
+    """ Serve commands over a unix socket with a BLE handler kept open
+    between them. Commands run one at a time and their output is sent back
+    to the client
+    """
+    if args.stop:
+        return 0 if forward(args, {'stop': True}) is not None else 1
+    if forward(args, {'ping': True}) is not None:
+        print(f'A daemon is already serving {args.socket}')
+        return 1
+    if os.path.exists(args.socket):
+        # left behind by a daemon that did not exit cleanly
+        os.unlink(args.socket)
+
+    import asyncio
+    import signal
+    from dwm1001_apiBle import AsyncBleConnectionHandler
+    loop = asyncio.get_event_loop()
+    ble_handler = AsyncBleConnectionHandler(args.max_connections, args.idle_timeout, collect_stats = True,
+                                            adapters = args.adapters.split(',') if args.adapters else None)
+    command_lock = asyncio.Lock()
+    stop = asyncio.Event()
+
+    async def onClient(reader, writer):
+        try:
+            request = json.loads((await reader.readline()).decode())
+            status = 0
+            if request.get('stop'):
+                stop.set()
+            elif request.get('args', {}).get('command') == 'configure' and not (request['args']['yes'] or request['args']['dry_run']):
+                # the daemon has no terminal to ask for confirmations
+                writer.write(json.dumps({'output': 'configure needs --yes when run by the daemon\n'}).encode() + b'\n')
+                status = 2
+            elif 'args' in request:
+                async with command_lock:
+                    output = SocketOutput(writer)
+                    stdout, sys.stdout = sys.stdout, output
+                    try:
+                        status = await COMMANDS[request['args']['command']](ble_handler, argparse.Namespace(**request['args']))
+                    except Exception as exc:
+                        print(f'{request["args"]["command"]} failed: {exc!r}')
+                        status = 1
+                    finally:
+                        sys.stdout = stdout
+                        output.flush()
+            writer.write(json.dumps({'status': status}).encode() + b'\n')
+            await writer.drain()
+        except (ConnectionError, ValueError) as exc:
+            print(f'Client dropped: {exc!r}')
+        finally:
+            writer.close()
+
+    server = loop.run_until_complete(asyncio.start_unix_server(onClient, path = args.socket))
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+    print(f'Serving on {args.socket}')
+    try:
+        loop.run_until_complete(stop.wait())
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.run_until_complete(ble_handler.close())
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+    print('Daemon stopped')
+    return 0
+
+def main(argv = None):
+    args = parseArgs(argv)
+    if args.command == 'daemon':
+        return runDaemon(args)
+    for name in PATH_ARGS:
+        if getattr(args, name, None) is not None:
+            setattr(args, name, os.path.abspath(os.path.expanduser(getattr(args, name))))
+    # confirmations are asked in this process, the daemon only configures with --yes
+    if args.command == 'configure' and not (args.yes or args.dry_run):
+        args.no_daemon = True
+    if not args.no_daemon:
+        status = forward(args, {'args': vars(args)})
+        if status is not None:
+            return status
+    return runLocal(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
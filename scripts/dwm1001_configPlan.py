@@ -0,0 +1,313 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_configPlan.py
+@description: configuration plan compiler and executor. The nodes
+              configuration and operation mode yaml files are compiled once
+              into an immutable plan of (device, UUID, payload) write
+              operations, identical settings are encoded once and share
+              their payload, and plans are cached on disk keyed by the hash
+              of the configuration files so unchanged configurations are
+              neither parsed nor encoded again
+@author: Esau Ortiz
+@date: october 2026
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple, OrderedDict
+from os.path import expanduser
+import dwm1001_bleCodec as codec
+from dwm1001_apiBle import DWM1001_BLE_API_COMMANDS, BleOperationError
+
+# bump when compiled plans change so cached plans are not reused
+PLAN_FORMAT_VERSION = 1
+# params of the dwm1001_drivers package these scripts are checked out in, the catkin workspace one otherwise
+PACKAGE_PARAMS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), 'params')
+CATKIN_PARAMS_DIR = os.path.join(expanduser("~"), 'catkin_ws', 'src', 'dwm1001_drivers', 'params')
+DEFAULT_PARAMS_DIR = PACKAGE_PARAMS_DIR if os.path.isdir(PACKAGE_PARAMS_DIR) else CATKIN_PARAMS_DIR
+DEFAULT_PLAN_CACHE_DIR = os.path.join(expanduser("~"), '.cache', 'dwm1001_ble', 'plans')
+
+PlanOperation = namedtuple('PlanOperation', ['device', 'uuid', 'payload', 'description'])
+
+class PayloadCache(object):
+        def __init__(self):
+                """ Encodes every distinct setting once, operations with the
+                same setting share the same payload bytes object
+                """
+                self.payloads = {} # {(UUID, key): payload}
+                self.n_requests = 0
+
+        def get(self, UUID, key, encode):
+                self.n_requests += 1
+                payload = self.payloads.get((UUID, key))
+                if payload is None:
+                        payload = self.payloads[(UUID, key)] = bytes(encode())
+                return payload
+
+        def networkId(self, network_id):
+                network_id = codec.parseNetworkId(network_id)
+                return self.get(DWM1001_BLE_API_COMMANDS.NETWORK_ID, network_id, lambda: codec.encodeNetworkId(network_id))
+
+        def operationMode(self, operation_mode):
+                return self.get(DWM1001_BLE_API_COMMANDS.OPERATION_MODE, tuple(sorted(operation_mode.items())),
+                                lambda: codec.encodeOperationMode(operation_mode))
+
+        def position(self, coords):
+                # keyed by the encoded millimeters, equal positions share the payload
+                key = tuple(int(float(coord) * 1000) for coord in coords)
+                return self.get(DWM1001_BLE_API_COMMANDS.PERSISTED_POSITION, key, lambda: codec.encodePosition(coords, quality = 100))
+
+class ConfigPlan(object):
+        def __init__(self, operations, roles, config_hash = None):
+                """ Immutable execution plan
+                Parameters
+                ----------
+                operations: iterable of PlanOperation
+                        writes in execution order
+                roles: iterable of (device, role) tuples
+                        role is 'anchor', 'initiator' or 'tag', devices are
+                        configured in this order
+                config_hash: string
+                        hash of the configuration the plan was compiled from
+                """
+                self.operations = tuple(operations)
+                self.roles = tuple(roles)
+                self.config_hash = config_hash
+
+        def devices(self):
+                return [device for device, _ in self.roles]
+
+        def byDevice(self):
+                """ Returns
+                -------
+                operations : OrderedDict of {device: tuple of PlanOperation} in execution order
+                """
+                operations = OrderedDict((device, []) for device, _ in self.roles)
+                for operation in self.operations:
+                        operations[operation.device].append(operation)
+                return OrderedDict((device, tuple(device_operations)) for device, device_operations in operations.items())
+
+        def distinctPayloads(self):
+                return len({id(operation.payload) for operation in self.operations})
+
+        def describe(self):
+                """ Returns
+                -------
+                lines : list of strings describing every operation, for dry runs
+                """
+                roles = dict(self.roles)
+                lines = [f'Plan {self.config_hash or ""} with {len(self.operations)} writes to {len(self.roles)} devices '
+                         f'({self.distinctPayloads()} distinct payloads)']
+                for device, operations in self.byDevice().items():
+                        lines.append(f'{device} ({roles[device]}):')
+                        for operation in operations:
+                                lines.append(f'    {operation.description:<40} {operation.uuid}  {operation.payload.hex()}')
+                return lines
+
+        def toJson(self):
+                """ Serializable representation, shared payloads are stored once """
+                payloads = []
+                payload_idx = {}
+                operations = []
+                for operation in self.operations:
+                        if operation.payload not in payload_idx:
+                                payload_idx[operation.payload] = len(payloads)
+                                payloads.append(operation.payload.hex())
+                        operations.append([operation.device, operation.uuid, payload_idx[operation.payload], operation.description])
+                return {'version': PLAN_FORMAT_VERSION, 'config_hash': self.config_hash, 'roles': [list(role) for role in self.roles],
+                        'payloads': payloads, 'operations': operations}
+
+        @classmethod
+        def fromJson(cls, data):
+                """ Raises
+                ------
+                ValueError: if data was saved by another plan format version
+                """
+                if data.get('version') != PLAN_FORMAT_VERSION:
+                        raise ValueError(f'Plan format version {data.get("version")} is not {PLAN_FORMAT_VERSION}')
+                payloads = [bytes.fromhex(payload) for payload in data['payloads']]
+                operations = [PlanOperation(device, UUID, payloads[idx], description) for device, UUID, idx, description in data['operations']]
+                return cls(operations, [tuple(role) for role in data['roles']], data['config_hash'])
+
+        def save(self, path):
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'w') as stream:
+                        json.dump(self.toJson(), stream, indent = 1)
+                os.replace(tmp_path, path)
+
+        @classmethod
+        def load(cls, path):
+                with open(path, 'r') as stream:
+                        return cls.fromJson(json.load(stream))
+
+def compilePlan(nodes_cfg, anchor_operation_mode, tag_operation_mode, config_hash = None):
+        """ Compile a nodes configuration into a plan. Every anchor gets its
+        network id, operation mode (initiator enabled for the initiator) and
+        persisted position, the tag gets its operation mode
+        Parameters
+        ----------
+        nodes_cfg, anchor_operation_mode, tag_operation_mode: dictionaries
+                parsed yaml files
+        Returns
+        -------
+        plan : ConfigPlan
+        """
+        payloads = PayloadCache()
+        operations = []
+        roles = []
+        network_id = nodes_cfg['network_id']
+        initiator_id = nodes_cfg.get('initiator_id')
+        for i in range(nodes_cfg['n_anchors']):
+                anchor_id = nodes_cfg[f'anchor{i}_id']
+                is_initiator = anchor_id == initiator_id
+                operation_mode = dict(anchor_operation_mode, initiator_enable = int(is_initiator))
+                x, y, z = nodes_cfg[f'anchor{i}_coordinates']
+                roles.append((anchor_id, 'initiator' if is_initiator else 'anchor'))
+                operations += [PlanOperation(anchor_id, DWM1001_BLE_API_COMMANDS.NETWORK_ID, payloads.networkId(network_id),
+                                             f'network id {network_id}'),
+                               PlanOperation(anchor_id, DWM1001_BLE_API_COMMANDS.OPERATION_MODE, payloads.operationMode(operation_mode),
+                                             'operation mode' + (' as initiator' if is_initiator else '')),
+                               PlanOperation(anchor_id, DWM1001_BLE_API_COMMANDS.PERSISTED_POSITION, payloads.position([x, y, z]),
+                                             f'position [X: {x} Y: {y} Z: {z}]')]
+        tag_id = nodes_cfg.get('tag0_id')
+        if tag_id is not None:
+                roles.append((tag_id, 'tag'))
+                operations.append(PlanOperation(tag_id, DWM1001_BLE_API_COMMANDS.OPERATION_MODE, payloads.operationMode(tag_operation_mode),
+                                                'operation mode'))
+        return ConfigPlan(operations, roles, config_hash)
+
+def paramsPaths(params_dir, nodes_cfg_description = 'default'):
+        """ Returns
+        -------
+        paths : nodes configuration, anchor operation mode and tag operation mode yaml files
+        """
+        return (os.path.join(params_dir, 'nodes_cfg', nodes_cfg_description + '.yaml'),
+                os.path.join(params_dir, 'anchor_operation_mode.yaml'),
+                os.path.join(params_dir, 'tag_operation_mode.yaml'))
+
+def configHash(paths):
+        """ Hash of the content of the configuration files, moving them does
+        not change it
+        """
+        digest = hashlib.sha256(f'plan format {PLAN_FORMAT_VERSION}'.encode())
+        for path in paths:
+                with open(path, 'rb') as stream:
+                        content = stream.read()
+                digest.update(len(content).to_bytes(8, 'little'))
+                digest.update(content)
+        return digest.hexdigest()
+
+def loadPlan(paths, cache_dir = DEFAULT_PLAN_CACHE_DIR):
+        """ Load the plan of the configuration files from the plan cache, or
+        compile and cache it if the files changed
+        Parameters
+        ----------
+        paths: nodes configuration, anchor operation mode and tag operation mode yaml files
+        cache_dir: string
+                directory of cached plans, None to always compile
+        Returns
+        -------
+        plan : ConfigPlan
+        cached : bool
+                whether the plan was loaded from the cache
+        """
+        config_hash = configHash(paths)
+        cache_path = None if cache_dir is None else os.path.join(cache_dir, config_hash + '.json')
+        if cache_path is not None:
+                try:
+                        return ConfigPlan.load(cache_path), True
+                except (OSError, ValueError, KeyError, TypeError):
+                        pass
+        import yaml
+        configs = []
+        for path in paths:
+                with open(path, 'r') as stream:
+                        configs.append(yaml.safe_load(stream))
+        plan = compilePlan(*configs, config_hash = config_hash)
+        if cache_path is not None:
+                try:
+                        plan.save(cache_path)
+                except OSError as exc:
+                        print(f'Plan could not be cached: {exc}')
+        return plan, False
+
+async def isUpToDate(ble_handler, address, operation):
+        """ Check whether the device already has the setting operation writes """
+        if operation.uuid == DWM1001_BLE_API_COMMANDS.PERSISTED_POSITION:
+                # persisted position is write only, position is read from location data
+                data = await ble_handler.readFromDevice(address, DWM1001_BLE_API_COMMANDS.LOCATION_DATA)
+                location_data = codec.decodeLocationData(data)
+                if location_data.position is None:
+                        return False
+                current = [round(coord * 1000) for coord in location_data.position[:3]]
+                return current == list(codec.POSITION_STRUCT.unpack(operation.payload)[:3])
+        elif operation.uuid == DWM1001_BLE_API_COMMANDS.OPERATION_MODE:
+                # compared field by field, bits outside the decoded fields are ignored
+                current = await ble_handler.readFromDevice(address, operation.uuid)
+                return codec.decodeOperationMode(current) == codec.decodeOperationMode(operation.payload)
+        elif operation.uuid == DWM1001_BLE_API_COMMANDS.NETWORK_ID:
+                return bytes(await ble_handler.readFromDevice(address, operation.uuid)) == operation.payload
+        return False
+
+async def pendingOperations(ble_handler, address, operations):
+        """ Read current settings and keep only operations whose setting
+        differs. Operations whose setting can not be read are kept
+        Returns
+        -------
+        operations : list of PlanOperation
+        """
+        pending = []
+        for operation in operations:
+                try:
+                        up_to_date = await isUpToDate(ble_handler, address, operation)
+                except Exception as exc:
+                        print(f'Could not read current {operation.description} from {address}: {exc}')
+                        up_to_date = False
+                if not up_to_date:
+                        pending.append(operation)
+        return pending
+
+async def executeDevice(ble_handler, device, address, operations, semaphore, diff = False):
+        async with semaphore:
+                print(f'Configuring {device} ...')
+                start = time.monotonic()
+                n_retries = 0
+                try:
+                        if diff:
+                                operations = await pendingOperations(ble_handler, address, operations)
+                        n_retries = await ble_handler.writeBatch(address, [(operation.uuid, operation.payload) for operation in operations])
+                        success = True
+                except BleOperationError as exc:
+                        print(exc)
+                        n_retries = exc.n_attempts - 1
+                        success = False
+                except Exception as exc:
+                        # other devices are configured and reported anyway
+                        print(f'{device}: {exc!r}')
+                        success = False
+                elapsed = time.monotonic() - start
+                print(f'{device} ' + ('configured' if success else 'FAILED') + f' in {elapsed:.2f} s')
+                return {'device': device, 'success': success, 'retries': n_retries, 'writes': len(operations), 'elapsed': elapsed}
+
+async def executePlan(ble_handler, plan, addresses, max_concurrency = 4, diff = False):
+        """ Write the plan to the devices in addresses, each device over a
+        single connection and up to max_concurrency devices at once
+        Parameters
+        ----------
+        ble_handler : AsyncBleConnectionHandler
+        plan : ConfigPlan
+        addresses : dictionary of {device: address}
+                devices of the plan to configure, others are skipped
+        diff : bool
+                only write settings that differ from the current ones
+        Returns
+        -------
+        results : list of dictionaries with device, success, retries, writes and elapsed keys
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        return await asyncio.gather(*[executeDevice(ble_handler, device, addresses[device], operations, semaphore, diff)
+                                      for device, operations in plan.byDevice().items() if device in addresses])
@@ -9,120 +9,115 @@
 @usage: python dwm_cfg.py 'cfg_description' # where 'cfg_description' is an optional
         label for nodes_cfg_'cfg_description'.yaml file. If label is not provided is
         set to 'default'.
+        Optional flags:
+            --fleet                 configure found anchors concurrently
+            --max-concurrency N     maximum number of anchors configured at once (default 4)
+            --scan-timeout S        maximum scanning time in seconds (default 5)
+            --rescan                ignore cached device addresses
+            --diff                  read current settings and only write the ones that differ
+            --adapters LIST         comma separated HCI adapters to spread connections over, e.g. hci0,hci1
+            --stats-output FILE     export BLE latency stats as json (or csv if FILE ends with .csv)
+            --params-dir DIR        directory with nodes_cfg/ and operation mode yaml files
+                                    (default params/ of the enclosing dwm1001_drivers package, or
+                                    ~/catkin_ws/src/dwm1001_drivers/params)
+            --dry-run               print the configuration plan and exit
+            --no-plan-cache         compile the configuration plan even if a cached one exists
+            -y, --yes               do not ask for confirmation before configuring a node
+            --record FILE           record every BLE scan result, read, write and notification to a binary trace
 """
 
-import yaml
-import sys
-from os.path import expanduser
-from pprint import pprint
+import argparse
 from dwm1001_apiBle import BleConnectionHandler
-from dwm1001_apiBle import PersistedPositionMsg, OperationModeMsg, NetworkIdMsg
-from dwm1001_apiBle import LocationDataMsg, LocationDataModeMsg
-
-def readYaml(file):
-    with open(file, 'r') as stream:
-        try:
-            return yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
+from dwm1001_configPlan import DEFAULT_PARAMS_DIR, DEFAULT_PLAN_CACHE_DIR, paramsPaths, loadPlan, executePlan
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description = 'Configure DWM1001 tag and anchors through BLE')
+    parser.add_argument('nodes_cfg_description', nargs = '?', default = 'default',
+                        help = 'label of the nodes_cfg yaml file')
+    parser.add_argument('--fleet', action = 'store_true',
+                        help = 'configure found anchors concurrently')
+    parser.add_argument('--max-concurrency', type = int, default = 4,
+                        help = 'maximum number of anchors configured at once in fleet mode')
+    parser.add_argument('--scan-timeout', type = float, default = 5.0,
+                        help = 'maximum scanning time in seconds')
+    parser.add_argument('--rescan', action = 'store_true',
+                        help = 'ignore cached device addresses and scan every device')
+    parser.add_argument('--diff', action = 'store_true',
+                        help = 'read current settings and only write the ones that differ')
+    parser.add_argument('--adapters', default = None,
+                        help = 'comma separated HCI adapters to spread connections over, e.g. hci0,hci1')
+    parser.add_argument('--stats-output', default = None,
+                        help = 'export BLE latency stats as json (or csv if the file ends with .csv)')
+    parser.add_argument('--params-dir', default = DEFAULT_PARAMS_DIR,
+                        help = 'directory with nodes_cfg/, anchor_operation_mode.yaml and tag_operation_mode.yaml')
+    parser.add_argument('--dry-run', action = 'store_true',
+                        help = 'print the configuration plan without connecting to any device')
+    parser.add_argument('--no-plan-cache', action = 'store_true',
+                        help = 'compile the configuration plan even if a cached one exists')
+    parser.add_argument('-y', '--yes', action = 'store_true',
+                        help = 'do not ask for confirmation before configuring a node')
+    parser.add_argument('--record', default = None,
+                        help = 'record every BLE scan result, read, write and notification to a binary trace')
+    return parser.parse_args()
+
+def confirm(question, assume_yes, default = True):
+    """ Ask a y/n question, any answer but the opposite of default (e.g. just
+    Enter) keeps default
+    """
+    if assume_yes:
+        return True
+    print(question)
+    answer = input()
+    return answer != 'n' if default else answer == 'y'
+
+def printFleetReport(results):
+    print(f'{"device":<10}{"result":<10}{"retries":<10}{"writes":<10}{"elapsed [s]":<12}')
+    for result in results:
+        print(f'{result["device"]:<10}{"ok" if result["success"] else "FAILED":<10}{result["retries"]:<10}{result["writes"]:<10}{result["elapsed"]:<12.2f}')
+    n_ok = sum(result['success'] for result in results)
+    print(f'{n_ok}/{len(results)} devices configured\n')
 
 if __name__ == "__main__":
 
-    # BLE connection handler
-    ble_handler = BleConnectionHandler()
-    
-    # read BT devices
-    devices = ble_handler.getDevices()
-    devices_found_id = {}
-    for dev in devices:
-        devices_found_id[dev.name] = dev.address # e.g. {'DW2020' : '00:11:22:33:FF:EE'}
-
-    # load anchors cfg
-    try:
-        nodes_cfg_description = sys.argv[1]
-    except:
-        nodes_cfg_description = 'default'
-    # load anchors cfg
-    nodes_cfg = readYaml(expanduser("~") + "/catkin_ws/src/dwm1001_drivers/params/nodes_cfg/" + nodes_cfg_description + ".yaml")
-    # load anchors operation mode
-    anchor_operation_mode = readYaml(expanduser("~") + "/catkin_ws/src/dwm1001_drivers/params/anchor_operation_mode.yaml")
-    # load tag operation mode
-    tag_operation_mode = readYaml(expanduser("~") + "/catkin_ws/src/dwm1001_drivers/params/tag_operation_mode.yaml")
-
-    # set some node variables
-    network_id = nodes_cfg['network_id']
-    tag_id = nodes_cfg['tag0_id']
-    n_anchors = nodes_cfg['n_anchors']
-    anchors_expected_id = []
-    for i in range(n_anchors):
-        # append expected anchor_id (e.g. DW2020)
-        anchors_expected_id.append(nodes_cfg[f'anchor{i}_id'])
-    initiator_id = nodes_cfg['initiator_id']
-
-    # msgs to send through BLE
-    anchor_pose_msg = PersistedPositionMsg()
-    operation_mode_msg = OperationModeMsg()
-    network_id_msg = NetworkIdMsg(network_id)
-
-    # setting anchors' configuration
-    for i in range(n_anchors):
-        anchor_id = nodes_cfg[f'anchor{i}_id']
-        try:
-            anchor_address = devices_found_id[anchor_id]
-        except KeyError:
-            print(f'Anchor {anchor_id} not found')
-            continue
-
-        if anchor_id in devices_found_id:
-            if anchor_id == initiator_id:
-                anchor_operation_mode['initiator_enable'] = 1
-                str_is_initiator = ' as initiator'
-            else:
-                anchor_operation_mode['initiator_enable'] = 0 
-                str_is_initiator = ''
+    args = parseArgs()
 
-            print(f'Anchor {anchor_id} found. Do you want to configure it? (y/n)' )
-            if input() == 'n':
-                print('\n')
-                continue
-            anchor_pose = nodes_cfg[f'anchor{i}_coordinates'] #.split(', ') # not as list
-
-            # set network
-            print(f'Setting anchor {anchor_id} network id to {network_id}')
-            ble_handler.send(anchor_address, network_id_msg)
-
-            # set operation mode
-            print(f'Setting anchor {anchor_id} operation mode' + str_is_initiator + ' ...')
-            operation_mode_msg.setData(anchor_operation_mode)
-            ble_handler.send(anchor_address, operation_mode_msg)
-
-            # set anchor pose
-            print(f'Setting anchor {anchor_id} pose to [X: {anchor_pose[0]} Y: {anchor_pose[1]} Z: {anchor_pose[2]}] ...\n')
-            anchor_pose_msg.setData(anchor_pose)
-            ble_handler.send(anchor_address, anchor_pose_msg)
-        else:
-            print(f'{anchor_id} not found\n')
-
-    print("Found anchors's mode are set as follows:")
-    pprint(anchor_operation_mode)
-    print("\n")
-
-    # setting tag configuration
-    if tag_id in devices_found_id:
-        tag_address = devices_found_id[tag_id]
-        print(f'Tag {tag_id} found. Do you want to configure it? (y/n)' )
-        if input() == 'y':
-            # set operation mode
-            print(f'Setting tag {tag_id} operation mode ...')
-            operation_mode_msg.setData(tag_operation_mode)
-            ble_handler.send(tag_address, operation_mode_msg)
-            
-            print(f'Found tag {tag_id} mode are set as follows:')
-            pprint(tag_operation_mode)
-            # set network could be added
-            # TODO
-        print("\n")
-    else:
-        print(f'Tag {tag_id} not found\n')
+    # configuration plan, compiled only if the yaml files changed since the last run
+    paths = paramsPaths(args.params_dir, args.nodes_cfg_description)
+    plan, cached = loadPlan(paths, None if args.no_plan_cache else DEFAULT_PLAN_CACHE_DIR)
+    print(f'Configuration plan {plan.config_hash[:12]} ' + ('loaded from cache' if cached else 'compiled') + '\n')
+    if args.dry_run:
+        print('\n'.join(plan.describe()))
+        raise SystemExit(0)
 
+    # BLE connection handler
+    ble_handler = BleConnectionHandler(max_connections = max(4, args.max_concurrency),
+                                       collect_stats = args.stats_output is not None,
+                                       adapters = args.adapters.split(',') if args.adapters else None,
+                                       record = args.record)
+
+    # find BT devices, cached addresses are used unless --rescan is given
+    devices_found_id = ble_handler.findDevices(plan.devices(), timeout = args.scan_timeout,
+                                               use_cache = not args.rescan) # e.g. {'DW2020' : '00:11:22:33:FF:EE'}
+
+    # devices to configure are selected before any write
+    selected = {}
+    for device_id, role in plan.roles:
+        if device_id not in devices_found_id:
+            print(f'{role.capitalize()} {device_id} not found\n')
+        # anchors are configured unless refused, tags only when explicitly accepted
+        elif confirm(f'{role.capitalize()} {device_id} found. Do you want to configure it? (y/n)', args.yes, role != 'tag'):
+            selected[device_id] = devices_found_id[device_id]
+
+    if selected:
+        # each device is written over a single connection, concurrently in fleet mode
+        max_concurrency = args.max_concurrency if args.fleet else 1
+        print(f'Configuring {len(selected)} devices with up to {max_concurrency} at once ...')
+        results = ble_handler.loop.run_until_complete(executePlan(ble_handler.async_handler, plan, selected,
+                                                                  max_concurrency, args.diff))
+        printFleetReport(results)
+
+    ble_handler.close()
+    if args.stats_output is not None:
+        ble_handler.exportStats(args.stats_output)
+        print(f'BLE stats exported to {args.stats_output}')
     print('Configuration finished')
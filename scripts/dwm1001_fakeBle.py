@@ -0,0 +1,554 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_fakeBle.py
+@description: in-process simulated DWM1001 fleet exposing the BLE API
+              characteristics through a transport compatible with
+              BleConnectionHandler, with configurable latencies and failures
+@author: Esau Ortiz
+@date: october 2026
+@usage: fleet = FakeFleet.grid(n_anchors = 30)
+        ble_handler = BleConnectionHandler(transport = FakeBleTransport(fleet))
+"""
+import asyncio
+import math
+import random
+import time
+import zlib
+from collections import namedtuple
+import dwm1001_bleCodec as codec
+from dwm1001_apiBle import DWM1001_BLE_API_COMMANDS
+
+ANCHOR_OPERATION_MODE = {'node_type': 1, 'UWB': 2, 'firmware': 0, 'accelerometer_enable': 0,
+                         'LED_indication_enabled': 1, 'firmware_update_enable': 0, 'initiator_enable': 0,
+                         'low_power_mode_enable': 0, 'location_engine_enable': 0}
+TAG_OPERATION_MODE = dict(ANCHOR_OPERATION_MODE, node_type = 0, accelerometer_enable = 1, location_engine_enable = 1)
+
+FakeAdvertisement = namedtuple('FakeAdvertisement', ['name', 'address', 'rssi'])
+FakeCharacteristic = namedtuple('FakeCharacteristic', ['uuid', 'handle'])
+FakeService = namedtuple('FakeService', ['uuid', 'characteristics'])
+
+DWM1001_SERVICE_UUID = '680c21d9-c946-4c1f-9c11-baa1c21329e7'
+DWM1001_CHARACTERISTIC_UUIDS = sorted({uuid for name, uuid in vars(DWM1001_BLE_API_COMMANDS).items()
+                                       if not name.startswith('_') and '-' in uuid})
+DEFAULT_ATT_MTU = 23
+
+class FakeBleError(Exception):
+        """ Simulated link failure """
+
+class FakeDwm1001Device(object):
+        def __init__(self, name, address, true_position, operation_mode = None, network_id = 0x1234,
+                     location_data_mode = codec.LOCATION_DATA_POSITION):
+                """ Simulated DWM1001 module
+                Parameters
+                ----------
+                name: string
+                        advertised name, e.g. 'DW1A2B'
+                address: string
+                        BLE address
+                true_position: (3,) array
+                        real position in meters, used to simulate ranges
+                operation_mode: dictionary
+                        anchor operation mode if not provided
+                network_id: int
+                location_data_mode: int
+                """
+                self.name = name
+                self.address = address
+                self.node_id = int(name[2:], 16) if name.startswith('DW') else int(address.replace(':', '')[-4:], 16)
+                self.true_position = tuple(true_position)
+                self.position = codec.Position(0.0, 0.0, 0.0, 0) # persisted position
+                self.operation_mode = dict(operation_mode if operation_mode is not None else ANCHOR_OPERATION_MODE)
+                self.network_id = network_id
+                self.location_data_mode = location_data_mode
+                self.n_writes = 0
+                self.fleet = None
+                self.hw_version = 0x2A
+                self.fw_version = 0x01030000
+                self.fw_buffer_size = 1024 # bytes requested per FW_UPDATE_POLL buffer request
+                self.fw_update = None # {'offer', 'image', 'requested'} of the upload in progress
+                self.fw_listeners = [] # FW_UPDATE_POLL notification callbacks
+                self.boot_time = time.monotonic()
+                self.n_connections = 0
+                self.degradation = 0.0 # 0 healthy, 1 frame errors, missed beacons and weak rssi everywhere
+
+        def isAnchor(self):
+                return self.operation_mode['node_type'] == 1
+
+        def handles(self):
+                """ Returns
+                -------
+                handles : dictionary of {uuid: handle}, the table moves with
+                        the firmware version
+                """
+                base = 0x0C + (self.fw_version >> 16 & 0xF) * 0x10
+                return {uuid: base + 2 * i for i, uuid in enumerate(DWM1001_CHARACTERISTIC_UUIDS)}
+
+        def read(self, UUID):
+                """ Returns
+                -------
+                data : bytearray
+                """
+                if UUID == DWM1001_BLE_API_COMMANDS.OPERATION_MODE:
+                        data = codec.encodeOperationMode(self.operation_mode)
+                elif UUID == DWM1001_BLE_API_COMMANDS.NETWORK_ID:
+                        data = codec.encodeNetworkId(self.network_id)
+                elif UUID == DWM1001_BLE_API_COMMANDS.LOCATION_DATA_MODE:
+                        data = codec.encodeLocationDataMode(self.location_data_mode)
+                elif UUID == DWM1001_BLE_API_COMMANDS.LOCATION_DATA:
+                        data = self.locationDataFrame()
+                elif UUID == DWM1001_BLE_API_COMMANDS.DEVICE_INFO:
+                        data = codec.DEVICE_INFO_STRUCT.pack(self.node_id, self.hw_version, self.fw_version, self.fw_version, 0, 0, 0)
+                elif UUID == DWM1001_BLE_API_COMMANDS.STATISTICS:
+                        data = self.statistics()
+                elif UUID == DWM1001_BLE_API_COMMANDS.PROXY_POSITIONS:
+                        data = bytes([0])
+                elif UUID == DWM1001_BLE_API_COMMANDS.MAC_STATS and self.isAnchor():
+                        data = self.macStats()
+                elif UUID == DWM1001_BLE_API_COMMANDS.CLUSTER_INFO and self.isAnchor():
+                        data = self.clusterInfo()
+                elif UUID == DWM1001_BLE_API_COMMANDS.ANCHOR_LIST and self.isAnchor():
+                        data = self.anchorList()
+                elif UUID == DWM1001_BLE_API_COMMANDS.LABEL:
+                        data = self.name.encode()
+                else:
+                        raise FakeBleError(f'Characteristic {UUID} is not readable')
+                return bytearray(data)
+
+        def write(self, UUID, data):
+                self.n_writes += 1
+                if UUID == DWM1001_BLE_API_COMMANDS.OPERATION_MODE:
+                        self.operation_mode = codec.decodeOperationMode(data)
+                elif UUID == DWM1001_BLE_API_COMMANDS.NETWORK_ID:
+                        self.network_id = codec.decodeNetworkId(data)
+                elif UUID == DWM1001_BLE_API_COMMANDS.LOCATION_DATA_MODE:
+                        self.location_data_mode = codec.decodeLocationDataMode(data)
+                elif UUID == DWM1001_BLE_API_COMMANDS.PERSISTED_POSITION:
+                        self.position = codec.decodePosition(data)
+                elif UUID == DWM1001_BLE_API_COMMANDS.LABEL:
+                        self.name = bytes(data).decode()
+                elif UUID == DWM1001_BLE_API_COMMANDS.FW_UPDATE_PUSH:
+                        self.pushFirmware(data)
+                else:
+                        raise FakeBleError(f'Characteristic {UUID} is not writable')
+
+        def notifyFirmware(self, poll_type, offset = 0, size = 0):
+                frame = bytearray(codec.encodeFirmwarePoll(poll_type, offset, size))
+                loop = asyncio.get_event_loop()
+                for callback in list(self.fw_listeners):
+                        loop.call_soon(callback, 0, frame)
+
+        def requestFirmwareBuffer(self):
+                offset = len(self.fw_update['image'])
+                size = min(self.fw_buffer_size, self.fw_update['offer'][3] - offset)
+                self.fw_update['requested'] = offset + size
+                self.notifyFirmware(codec.FW_POLL_BUFFER_REQUEST, offset, size)
+
+        def pushFirmware(self, data):
+                """ Emulates the FW_UPDATE_PUSH side of the firmware update
+                protocol. Chunks must arrive in order, others are dropped and
+                the host has to offer the image again to resume
+                """
+                if data[0] == codec.FW_PUSH_OFFER:
+                        offer = codec.decodeFirmwareOffer(data)
+                        if offer[0] != self.hw_version:
+                                self.notifyFirmware(codec.FW_POLL_ERROR)
+                                return
+                        # an interrupted upload of the same image is resumed
+                        if self.fw_update is None or self.fw_update['offer'] != offer:
+                                self.fw_update = {'offer': offer, 'image': bytearray(), 'requested': 0}
+                        self.requestFirmwareBuffer()
+                elif data[0] == codec.FW_PUSH_CHUNK and self.fw_update is not None:
+                        offset, chunk = codec.decodeFirmwareChunk(data)
+                        image = self.fw_update['image']
+                        requested = self.fw_update['requested']
+                        if offset != len(image) or offset >= requested:
+                                return
+                        image += chunk[:requested - offset]
+                        if len(image) < requested:
+                                return
+                        _, fw_version, checksum, size = self.fw_update['offer']
+                        if len(image) < size:
+                                self.requestFirmwareBuffer()
+                        elif zlib.crc32(bytes(image)) & 0xFFFFFFFF == checksum:
+                                self.fw_version = fw_version
+                                self.fw_update = None
+                                self.notifyFirmware(codec.FW_POLL_SUCCESS)
+                        else:
+                                self.fw_update = None
+                                self.notifyFirmware(codec.FW_POLL_SAVE_FAILED)
+
+        def statistics(self):
+                """ STATISTICS payload, counters grow with uptime """
+                uptime = time.monotonic() - self.boot_time
+                rx_frames = int(uptime * 20)
+                rx_errors = int(rx_frames * (0.001 + 0.2 * self.degradation))
+                tx_ok = int(uptime * 10)
+                tx_errors = int(tx_ok * 0.1 * self.degradation)
+                return codec.STATISTICS_STRUCT.pack(int(uptime), 24000, rx_frames + tx_ok, int(uptime * self.degradation),
+                                                    rx_frames - rx_errors, rx_errors, tx_ok - tx_errors, tx_errors, self.n_connections)
+
+        def neighbors(self):
+                """ Returns
+                -------
+                anchors : list of (anchor, distance) heard by this anchor, sorted by node id
+                """
+                if self.fleet is None:
+                        return []
+                return self.fleet.neighbors(self)
+
+        def seat(self):
+                network_anchors = sorted(device.node_id for device in self.fleet.devices.values()
+                                         if device.isAnchor() and device.network_id == self.network_id)
+                return network_anchors.index(self.node_id) % 16 if self.node_id in network_anchors else 0
+
+        def macStats(self):
+                uptime = time.monotonic() - self.boot_time
+                expected = int(uptime * 10 * len(self.neighbors()))
+                missed = int(expected * 0.5 * self.degradation)
+                return codec.MAC_STATS_STRUCT.pack(int(uptime * 10), expected - missed, missed, int(uptime * self.degradation))
+
+        def clusterInfo(self):
+                cluster_map = neighbor_map = 0
+                for device, _ in self.neighbors():
+                        if device.network_id == self.network_id:
+                                cluster_map |= 1 << device.seat()
+                        else:
+                                neighbor_map |= 1 << device.seat()
+                seat = self.seat() if self.fleet is not None else 0
+                return codec.CLUSTER_INFO_STRUCT.pack(seat, cluster_map | 1 << seat, neighbor_map)
+
+        def anchorList(self):
+                anchors = self.neighbors()
+                data = bytearray([len(anchors)])
+                for device, distance in anchors:
+                        rssi = -40 - 20 * math.log10(max(distance, 1.0)) - 30 * self.degradation
+                        seat = device.seat() | (device.network_id != self.network_id) << 5
+                        x, y, z = (int(coord * 1000) for coord in device.position[:3])
+                        data += codec.ANCHOR_LIST_ENTRY_STRUCT.pack(device.node_id, x, y, z, max(-128, int(rssi)), seat)
+                return bytes(data)
+
+        def locationDataFrame(self):
+                """ Returns
+                -------
+                frame : bytes in the current location data mode
+                """
+                frame = bytearray([self.location_data_mode])
+                if self.location_data_mode in (codec.LOCATION_DATA_POSITION, codec.LOCATION_DATA_POSITION_DISTANCES):
+                        frame += codec.encodePosition(self.position[:3], quality = 100)
+                if self.location_data_mode in (codec.LOCATION_DATA_DISTANCES, codec.LOCATION_DATA_POSITION_DISTANCES):
+                        ranges = self.fleet.ranges(self) if self.fleet is not None and not self.isAnchor() else []
+                        frame.append(len(ranges))
+                        for anchor_id, distance in ranges:
+                                frame += codec.ANCHOR_DISTANCE_STRUCT.pack(anchor_id, max(0, int(distance * 1000)), 100)
+                return bytes(frame)
+
+class FakeFleet(object):
+        def __init__(self, devices, range_noise = 0.02, update_rate = 10.0, max_ranged_anchors = 4, seed = None):
+                """ Simulated fleet
+                Parameters
+                ----------
+                devices: list of FakeDwm1001Device
+                range_noise: float
+                        standard deviation of simulated ranges in meters
+                update_rate: float
+                        location data notifications per second
+                max_ranged_anchors: int
+                        a tag ranges to the nearest max_ranged_anchors anchors of its network
+                seed: int
+                """
+                self.devices = {device.address: device for device in devices}
+                for device in devices:
+                        device.fleet = self
+                self.range_noise = range_noise
+                self.update_rate = update_rate
+                self.max_ranged_anchors = max_ranged_anchors
+                self.random = random.Random(seed)
+
+        @classmethod
+        def grid(cls, n_anchors = 16, n_tags = 1, spacing = 5.0, network_id = 0x1234, seed = None, **kwargs):
+                """ Anchors on a square grid and tags in between """
+                rng = random.Random(seed)
+                side = max(1, int(math.ceil(math.sqrt(n_anchors))))
+                devices = []
+                for i in range(n_anchors):
+                        position = ((i % side) * spacing, (i // side) * spacing, 2.0 + rng.uniform(-0.2, 0.2))
+                        devices.append(FakeDwm1001Device(f'DW{0x1000 + i:04X}', f'00:00:00:00:{i // 256:02X}:{i % 256:02X}',
+                                                         position, network_id = network_id))
+                for i in range(n_tags):
+                        position = (rng.uniform(0, side * spacing), rng.uniform(0, side * spacing), 1.0)
+                        devices.append(FakeDwm1001Device(f'DW{0x8000 + i:04X}', f'00:00:00:01:{i // 256:02X}:{i % 256:02X}',
+                                                         position, TAG_OPERATION_MODE, network_id,
+                                                         codec.LOCATION_DATA_DISTANCES))
+                return cls(devices, seed = seed, **kwargs)
+
+        def byName(self, name):
+                return next(device for device in self.devices.values() if device.name == name)
+
+        def ranges(self, tag):
+                """ Simulated ranges from tag to the nearest anchors of its network
+                Returns
+                -------
+                ranges : list of (anchor_id, distance)
+                """
+                ranges = []
+                for device in self.devices.values():
+                        if device is tag or not device.isAnchor() or device.network_id != tag.network_id:
+                                continue
+                        distance = math.sqrt(sum((a - b) ** 2 for a, b in zip(tag.true_position, device.true_position)))
+                        ranges.append((device.node_id, distance + self.random.gauss(0.0, self.range_noise)))
+                ranges.sort(key = lambda item: item[1])
+                return ranges[:self.max_ranged_anchors]
+
+        def neighbors(self, anchor, max_range = 30.0, max_anchors = 16):
+                """ Anchors within UWB range of anchor, any network
+                Returns
+                -------
+                anchors : list of (device, distance) sorted by node id
+                """
+                anchors = []
+                for device in self.devices.values():
+                        if device is anchor or not device.isAnchor():
+                                continue
+                        distance = math.sqrt(sum((a - b) ** 2 for a, b in zip(anchor.true_position, device.true_position)))
+                        if distance <= max_range:
+                                anchors.append((device, distance))
+                anchors.sort(key = lambda item: item[1])
+                return sorted(anchors[:max_anchors], key = lambda item: item[0].node_id)
+
+class FakeBleClient(object):
+        def __init__(self, transport, address):
+                self.transport = transport
+                self.address = address
+                self.is_connected = False
+                self.notify_tasks = {}
+                self.fw_listener = None
+                self.services = None
+                self.mtu_size = DEFAULT_ATT_MTU
+
+        def _uuid(self, char_specifier):
+                """ UUID of a characteristic given by UUID or handle """
+                if isinstance(char_specifier, int):
+                        uuids = {handle: uuid for uuid, handle in self._device().handles().items()}
+                        if char_specifier not in uuids:
+                                raise FakeBleError(f'Characteristic with handle {char_specifier} was not found')
+                        return uuids[char_specifier]
+                return char_specifier
+
+        def _device(self):
+                device = self.transport.fleet.devices.get(self.address)
+                if device is None:
+                        raise FakeBleError(f'Device {self.address} not found')
+                return device
+
+        async def _operation(self, latency):
+                if not self.is_connected:
+                        raise FakeBleError(f'Not connected to {self.address}')
+                await self.transport.wait(latency)
+                if self.transport.fails():
+                        self._dropLink()
+                        raise FakeBleError(f'Link to {self.address} dropped')
+
+        def _dropLink(self):
+                self.is_connected = False
+                self.transport.connected.discard(self)
+                for task in self.notify_tasks.values():
+                        task.cancel()
+                self.notify_tasks.clear()
+                self._removeFirmwareListener()
+
+        def _removeFirmwareListener(self):
+                if self.fw_listener is not None:
+                        device = self.transport.fleet.devices.get(self.address)
+                        if device is not None and self.fw_listener in device.fw_listeners:
+                                device.fw_listeners.remove(self.fw_listener)
+                        self.fw_listener = None
+
+        async def connect(self, use_cached = False, **kwargs):
+                device = self._device()
+                latency = self.transport.connect_latency
+                # service discovery is skipped when the backend kept the services of the last session
+                if not (use_cached and self.transport.backend == 'winrt' and self.address in self.transport.discovered):
+                        latency += self.transport.discovery_latency
+                if self.transport.serial_connects:
+                        async with self.transport.connectLock():
+                                await self.transport.wait(latency)
+                else:
+                        await self.transport.wait(latency)
+                if self.transport.fails():
+                        raise FakeBleError(f'Connection to {self.address} failed')
+                if self.transport.max_connections is not None and len(self.transport.connected) >= self.transport.max_connections:
+                        raise FakeBleError(f'Connection limit of adapter {self.transport.adapter} reached')
+                self.is_connected = True
+                self.transport.connected.add(self)
+                self.transport.discovered.add(self.address)
+                device.n_connections += 1
+                self.mtu_size = DEFAULT_ATT_MTU
+                self.services = [FakeService(DWM1001_SERVICE_UUID, [FakeCharacteristic(uuid, handle)
+                                                                    for uuid, handle in device.handles().items()])]
+                return True
+
+        async def _acquire_mtu(self):
+                await self._operation(self.transport.write_latency)
+                self.mtu_size = self.transport.mtu
+
+        async def disconnect(self):
+                self._dropLink()
+                return True
+
+        async def read_gatt_char(self, char_specifier, **kwargs):
+                await self._operation(self.transport.read_latency)
+                data = self._device().read(self._uuid(char_specifier))
+                # values longer than MTU - 1 bytes take one read blob round trip per MTU - 1 bytes
+                for _ in range(1, math.ceil(len(data) / (self.mtu_size - 1))):
+                        await self._operation(self.transport.read_latency)
+                return data
+
+        async def write_gatt_char(self, char_specifier, data, response = False):
+                char_specifier = self._uuid(char_specifier)
+                if response:
+                        await self._operation(self.transport.write_latency)
+                        self._device().write(char_specifier, bytes(data))
+                else:
+                        # writes without response are queued on the link in order
+                        # and may be applied even if the link drops afterwards
+                        if not self.is_connected:
+                                raise FakeBleError(f'Not connected to {self.address}')
+                        self._device().write(char_specifier, bytes(data))
+                        await self._operation(self.transport.write_latency)
+
+        async def start_notify(self, char_specifier, callback, **kwargs):
+                char_specifier = self._uuid(char_specifier)
+                await self._operation(self.transport.write_latency)
+                device = self._device()
+                if char_specifier == DWM1001_BLE_API_COMMANDS.FW_UPDATE_POLL:
+                        self._removeFirmwareListener()
+                        self.fw_listener = callback
+                        device.fw_listeners.append(callback)
+                        return
+                if char_specifier != DWM1001_BLE_API_COMMANDS.LOCATION_DATA:
+                        raise FakeBleError(f'Characteristic {char_specifier} does not notify')
+                async def notify():
+                        period = 1.0 / self.transport.fleet.update_rate
+                        while self.is_connected:
+                                await asyncio.sleep(period)
+                                # notifications carry at most MTU - 3 bytes
+                                callback(0, bytearray(device.locationDataFrame()[:self.mtu_size - 3]))
+                self.notify_tasks[char_specifier] = asyncio.ensure_future(notify())
+
+        async def stop_notify(self, char_specifier):
+                char_specifier = self._uuid(char_specifier)
+                if char_specifier == DWM1001_BLE_API_COMMANDS.FW_UPDATE_POLL:
+                        self._removeFirmwareListener()
+                task = self.notify_tasks.pop(char_specifier, None)
+                if task is not None:
+                        task.cancel()
+
+class FakeScanner(object):
+        def __init__(self, transport):
+                self.transport = transport
+                self.callback = None
+                self.tasks = []
+
+        def register_detection_callback(self, callback):
+                self.callback = callback
+
+        async def start(self):
+                async def advertise(device):
+                        # first advertisement arrives within one advertising interval
+                        await asyncio.sleep(self.transport.random.uniform(0, self.transport.advertising_interval))
+                        if self.callback is not None:
+                                self.callback(FakeAdvertisement(device.name, device.address, self.transport.rssi), None)
+                self.tasks = [asyncio.ensure_future(advertise(device)) for device in self.transport.fleet.devices.values()]
+
+        async def stop(self):
+                for task in self.tasks:
+                        task.cancel()
+                self.tasks = []
+
+class FakeBleTransport(object):
+        def __init__(self, fleet, connect_latency = 0.05, read_latency = 0.01, write_latency = 0.01,
+                     failure_rate = 0.0, advertising_interval = 0.1, seed = None, adapter = None, max_connections = None,
+                     rssi = -60, serial_connects = False, discovery_latency = 0.0, mtu = 247, backend = 'bluez'):
+                """ Transport over a simulated fleet, see BleakTransport
+                Parameters
+                ----------
+                fleet: FakeFleet
+                connect_latency: float
+                        seconds per connection, service discovery excluded
+                read_latency: float
+                        seconds per GATT read
+                write_latency: float
+                        seconds per GATT write
+                failure_rate: float
+                        probability of each connect, read or write failing
+                advertising_interval: float
+                        seconds until a device is seen by a scan
+                seed: int
+                adapter: string
+                        simulated adapter name
+                max_connections: int
+                        simultaneous connections the simulated controller
+                        accepts, None for no limit
+                rssi: int
+                        advertised RSSI seen by this adapter
+                serial_connects: bool
+                        connections are established one at a time, as a single
+                        controller does
+                discovery_latency: float
+                        seconds of service discovery added to connections,
+                        skipped with connect(use_cached = True) once a device
+                        has been discovered if backend is 'winrt'
+                mtu: int
+                        ATT MTU granted when the client requests a larger one
+                backend: string
+                        simulated bleak backend, 'bluez' or 'winrt'. bleak only
+                        honours use_cached on WinRT, BlueZ discovers services
+                        on every connection
+                """
+                self.fleet = fleet
+                self.connect_latency = connect_latency
+                self.read_latency = read_latency
+                self.write_latency = write_latency
+                self.failure_rate = failure_rate
+                self.advertising_interval = advertising_interval
+                self.random = random.Random(seed)
+                self.adapter = adapter
+                self.max_connections = max_connections
+                self.rssi = rssi
+                self.connected = set() # FakeBleClient
+                self.serial_connects = serial_connects
+                self.discovery_latency = discovery_latency
+                self.mtu = mtu
+                self.backend = backend
+                self.discovered = set() # addresses whose services are known
+                self._connect_lock = None
+
+        def connectLock(self):
+                # created lazily so it binds to the running loop
+                if self._connect_lock is None:
+                        self._connect_lock = asyncio.Lock()
+                return self._connect_lock
+
+        async def wait(self, latency):
+                if latency > 0:
+                        await asyncio.sleep(latency)
+
+        def fails(self):
+                return self.failure_rate > 0 and self.random.random() < self.failure_rate
+
+        def createClient(self, address):
+                return FakeBleClient(self, address)
+
+        def createScanner(self):
+                return FakeScanner(self)
+
+        async def discover(self, timeout = 5.0):
+                await asyncio.sleep(min(timeout, self.advertising_interval))
+                return [FakeAdvertisement(device.name, device.address, self.rssi) for device in self.fleet.devices.values()]
+
+        def transientExceptions(self):
+                return (FakeBleError,)
+
+        def capacity(self):
+                return self.max_connections
@@ -0,0 +1,343 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_firmwareUpdate.py
+@description: firmware update over the FW_UPDATE_PUSH / FW_UPDATE_POLL BLE
+              characteristics. The image is offered, the module requests
+              buffers through FW_UPDATE_POLL notifications and each buffer is
+              sent as a sliding window of chunks written without response.
+              Interrupted uploads are resumed from the last offset requested
+              by the module and several modules are updated concurrently
+@author: Esau Ortiz
+@date: october 2026
+@usage: python dwm1001_firmwareUpdate.py <firmware> <module> [<module> ...] --hw-version HW --fw-version FW
+
+        # where <firmware> is the firmware binary image
+                <module> module ids with DW1234 format
+        Optional flags:
+            --window N              chunks in flight per module (default 8)
+            --max-concurrency N     modules updated at once (default 4)
+            --poll-timeout S        seconds without FW_UPDATE_POLL notification before resuming (default 5)
+            --adapters LIST         comma separated HCI adapters to spread connections over
+            --scan-timeout S        maximum scanning time in seconds (default 5)
+"""
+import asyncio
+import time
+import zlib
+import dwm1001_bleCodec as codec
+from dwm1001_apiBle import DWM1001_BLE_API_COMMANDS, RetryPolicy
+
+class FirmwareUpdateError(Exception):
+        """ Firmware rejected by the module, not worth retrying """
+
+class FirmwareImage(object):
+        def __init__(self, data, hw_version, fw_version):
+                """
+                Parameters
+                ----------
+                data: bytes
+                        firmware binary image
+                hw_version: int
+                        hardware version the image is built for
+                fw_version: int
+                        version of the image
+                """
+                self.data = bytes(data)
+                self.hw_version = hw_version
+                self.fw_version = fw_version
+                self.checksum = zlib.crc32(self.data) & 0xFFFFFFFF
+
+        @classmethod
+        def fromFile(cls, path, hw_version, fw_version):
+                with open(path, 'rb') as stream:
+                        return cls(stream.read(), hw_version, fw_version)
+
+        def __len__(self):
+                return len(self.data)
+
+        def offer(self):
+                return codec.encodeFirmwareOffer(self.hw_version, self.fw_version, self.checksum, len(self.data))
+
+        def chunk(self, offset):
+                """ FW_UPDATE_PUSH chunk message starting at offset """
+                return codec.encodeFirmwareChunk(offset, self.data[offset:offset + codec.FW_CHUNK_SIZE])
+
+class FirmwareUpdateProgress(object):
+        def __init__(self, name, address, size):
+                """ Progress of the update of a single module
+                Attributes
+                ----------
+                state: string
+                        'pending', 'uploading', 'done' or 'failed'
+                acknowledged: int
+                        bytes the module confirmed by requesting the next ones
+                sent: int
+                        bytes written, including resent ones
+                resumes: int
+                        times the upload was resumed on a new connection
+                """
+                self.name = name
+                self.address = address
+                self.size = size
+                self.state = 'pending'
+                self.acknowledged = 0
+                self.sent = 0
+                self.resumes = 0
+                self.error = None
+                self.start = None
+                self.end = None
+
+        def elapsed(self):
+                if self.start is None:
+                        return 0.0
+                return (self.end if self.end is not None else time.monotonic()) - self.start
+
+        def fraction(self):
+                return self.acknowledged / self.size if self.size else 1.0
+
+        def throughput(self):
+                """ acknowledged bytes per second """
+                elapsed = self.elapsed()
+                return self.acknowledged / elapsed if elapsed > 0 else 0.0
+
+class FirmwareUpdater(object):
+        def __init__(self, ble_handler, image, window = 8, poll_timeout = 5.0, retry_policy = None, on_progress = None):
+                """
+                Parameters
+                ----------
+                ble_handler: AsyncBleConnectionHandler
+                image: FirmwareImage
+                window: int
+                        chunks written without response in flight at once,
+                        1 for stop and wait
+                poll_timeout: float
+                        seconds without FW_UPDATE_POLL notification before the
+                        upload is resumed on a new connection
+                retry_policy: RetryPolicy
+                        resumes of a single module, by default ble_handler's
+                        policy without deadline since uploads take minutes.
+                        The attempt budget is restored whenever the module
+                        acknowledges new data
+                on_progress: callable
+                        called with a FirmwareUpdateProgress on every buffer
+                        request and when a module finishes
+                """
+                self.ble_handler = ble_handler
+                self.image = image
+                self.window = max(1, window)
+                self.poll_timeout = poll_timeout
+                if retry_policy is None:
+                        policy = ble_handler.retry_policy
+                        retry_policy = RetryPolicy(policy.max_attempts, policy.base_delay, policy.max_delay, policy.multiplier,
+                                                   policy.jitter, None, policy.transient_exceptions)
+                self.retry_policy = retry_policy
+                self.on_progress = on_progress
+                self.progress = {} # {address: FirmwareUpdateProgress}
+
+        def _report(self, progress):
+                if self.on_progress is not None:
+                        self.on_progress(progress)
+
+        async def _sendBuffer(self, client, progress, offset, size):
+                """ Write the chunks of a requested buffer keeping up to window
+                writes in flight
+                """
+                pending = set()
+                try:
+                        for chunk_offset in range(offset, min(offset + size, len(self.image)), codec.FW_CHUNK_SIZE):
+                                while len(pending) >= self.window:
+                                        done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                                        await raiseFirstError(done, pending)
+                                chunk = self.image.chunk(chunk_offset)
+                                pending.add(asyncio.ensure_future(client.write_gatt_char(DWM1001_BLE_API_COMMANDS.FW_UPDATE_PUSH, chunk, False)))
+                                progress.sent += len(chunk) - codec.FW_CHUNK_HEADER_STRUCT.size
+                        if pending:
+                                done, pending = await asyncio.wait(pending)
+                                await raiseFirstError(done, pending)
+                finally:
+                        # e.g. the session was cancelled, writes still in flight are waited for
+                        await cancelTasks(pending)
+
+        async def _session(self, address, progress):
+                """ Offer the image and serve buffer requests on a single
+                connection until the module reports the result
+                """
+                stats = self.ble_handler.ble_stats
+                polls = asyncio.Queue()
+                def onPoll(sender, data):
+                        polls.put_nowait(bytes(data))
+
+                async with self.ble_handler.pool.lease(address) as client:
+                        with stats.timer('subscribe', address, DWM1001_BLE_API_COMMANDS.FW_UPDATE_POLL):
+                                await client.start_notify(DWM1001_BLE_API_COMMANDS.FW_UPDATE_POLL, onPoll)
+                        try:
+                                # the module answers with a buffer request at the offset it has reached
+                                await client.write_gatt_char(DWM1001_BLE_API_COMMANDS.FW_UPDATE_PUSH, self.image.offer(), True)
+                                while True:
+                                        try:
+                                                poll = codec.decodeFirmwarePoll(await asyncio.wait_for(polls.get(), self.poll_timeout))
+                                        except asyncio.TimeoutError:
+                                                state = 'connected' if client.is_connected else 'disconnected'
+                                                raise asyncio.TimeoutError(f'No firmware update poll from {address} in {self.poll_timeout} s ({state})')
+                                        if poll.type == codec.FW_POLL_BUFFER_REQUEST:
+                                                progress.acknowledged = poll.offset
+                                                self._report(progress)
+                                                with stats.timer('fw_buffer', address):
+                                                        await self._sendBuffer(client, progress, poll.offset, poll.size)
+                                        elif poll.type == codec.FW_POLL_SUCCESS:
+                                                progress.acknowledged = progress.size
+                                                return
+                                        elif poll.type == codec.FW_POLL_SAVE_FAILED:
+                                                raise FirmwareUpdateError(f'{progress.name} could not save the firmware image')
+                                        else:
+                                                raise FirmwareUpdateError(f'{progress.name} refused the firmware update (poll type {poll.type})')
+                        finally:
+                                if client.is_connected:
+                                        try:
+                                                await client.stop_notify(DWM1001_BLE_API_COMMANDS.FW_UPDATE_POLL)
+                                        except Exception as exc:
+                                                print(f'Error unsubscribing from {address}: {exc!r}')
+
+        async def update(self, address, name = None):
+                """ Update a single module, resuming on new connections after
+                link failures
+                Returns
+                -------
+                progress : FirmwareUpdateProgress
+                Raises
+                ------
+                FirmwareUpdateError: if the module rejects the image
+                BleOperationError: if resumes are exhausted
+                """
+                progress = self.progress.get(address)
+                if progress is None:
+                        progress = self.progress[address] = FirmwareUpdateProgress(name or address, address, len(self.image))
+                progress.state = 'uploading'
+                progress.start = time.monotonic()
+                retry_state = self.retry_policy.start(f'Firmware update of {progress.name}')
+                try:
+                        while True:
+                                acknowledged = progress.acknowledged
+                                try:
+                                        await self._session(address, progress)
+                                        break
+                                except Exception as exc:
+                                        if progress.acknowledged > acknowledged:
+                                                retry_state.reset()
+                                        retry_state.description = f'Firmware update of {progress.name} at {progress.acknowledged}/{progress.size} bytes'
+                                        await retry_state.failed(exc)
+                                        progress.resumes += 1
+                                        self.ble_handler.ble_stats.count('fw_resumes', address)
+                        # the new firmware may lay out its characteristics differently
+                        self.ble_handler.gatt_cache.invalidate(address)
+                        progress.state = 'done'
+                except Exception as exc:
+                        progress.state = 'failed'
+                        progress.error = exc
+                        raise
+                finally:
+                        progress.end = time.monotonic()
+                        self._report(progress)
+                return progress
+
+        async def updateFleet(self, devices, max_concurrency = 4):
+                """ Update several modules concurrently
+                Parameters
+                ----------
+                devices: dictionary of {name: address}
+                max_concurrency: int
+                        modules updated at once
+                Returns
+                -------
+                progress : dictionary of {name: FirmwareUpdateProgress}, failed
+                        modules have state 'failed' and the exception as error
+                """
+                semaphore = asyncio.Semaphore(max_concurrency)
+                for name, address in devices.items():
+                        self.progress.setdefault(address, FirmwareUpdateProgress(name, address, len(self.image)))
+
+                async def updateOne(name, address):
+                        async with semaphore:
+                                try:
+                                        await self.update(address, name)
+                                except Exception as exc:
+                                        print(f'{name} firmware update failed: {exc}')
+
+                await asyncio.gather(*[updateOne(name, address) for name, address in devices.items()])
+                return {name: self.progress[address] for name, address in devices.items()}
+
+async def cancelTasks(tasks):
+        """ Cancel tasks and wait for them, retrieving their exceptions """
+        for task in tasks:
+                task.cancel()
+        if tasks:
+                await asyncio.gather(*tasks, return_exceptions = True)
+
+async def raiseFirstError(done, pending):
+        """ If a task of done failed, cancel and wait for the pending ones
+        and raise the first error. Every exception is retrieved, later ones
+        are printed
+        """
+        errors = [task.exception() for task in done if not task.cancelled() and task.exception() is not None]
+        if not errors:
+                return
+        await cancelTasks(pending)
+        pending.clear()
+        for exc in errors[1:]:
+                print(f'Concurrent chunk write failed too: {exc!r}')
+        raise errors[0]
+
+def printProgressReport(progress_list):
+        print(f'{"module":<10}{"result":<10}{"bytes":<12}{"resumes":<10}{"elapsed [s]":<14}{"rate [kB/s]":<12}')
+        for progress in progress_list:
+                print(f'{progress.name:<10}{progress.state:<10}{progress.acknowledged:<12}{progress.resumes:<10}'
+                      f'{progress.elapsed():<14.1f}{progress.throughput() / 1000:<12.2f}')
+        n_done = sum(progress.state == 'done' for progress in progress_list)
+        print(f'{n_done}/{len(progress_list)} modules updated\n')
+
+def progressPrinter(step = 0.1):
+        """ on_progress callback printing every step fraction of each module """
+        printed = {}
+        def onProgress(progress):
+                decile = int(progress.fraction() / step)
+                if progress.state in ('done', 'failed') or decile > printed.get(progress.address, -1):
+                        printed[progress.address] = decile
+                        print(f'{progress.name}: {100 * progress.fraction():5.1f} % {progress.throughput() / 1000:7.2f} kB/s '
+                              f'{progress.state}' + (f' ({progress.resumes} resumes)' if progress.resumes else ''))
+        return onProgress
+
+def main():
+        import argparse
+        from dwm1001_apiBle import BleConnectionHandler
+        parser = argparse.ArgumentParser(description = 'Update DWM1001 firmware through BLE')
+        parser.add_argument('firmware', help = 'firmware binary image')
+        parser.add_argument('modules', nargs = '+', help = 'module ids with DW1234 format')
+        parser.add_argument('--hw-version', type = lambda value: int(value, 0), required = True,
+                            help = 'hardware version the image is built for, e.g. 0x2A')
+        parser.add_argument('--fw-version', type = lambda value: int(value, 0), required = True,
+                            help = 'firmware version of the image, e.g. 0x01030000')
+        parser.add_argument('--window', type = int, default = 8, help = 'chunks in flight per module')
+        parser.add_argument('--max-concurrency', type = int, default = 4, help = 'modules updated at once')
+        parser.add_argument('--poll-timeout', type = float, default = 5.0,
+                            help = 'seconds without FW_UPDATE_POLL notification before resuming')
+        parser.add_argument('--adapters', default = None,
+                            help = 'comma separated HCI adapters to spread connections over, e.g. hci0,hci1')
+        parser.add_argument('--scan-timeout', type = float, default = 5.0, help = 'maximum scanning time in seconds')
+        args = parser.parse_args()
+
+        image = FirmwareImage.fromFile(args.firmware, args.hw_version, args.fw_version)
+        with BleConnectionHandler(max_connections = max(4, args.max_concurrency),
+                                  adapters = args.adapters.split(',') if args.adapters else None) as ble_handler:
+                devices = ble_handler.findDevices(args.modules, timeout = args.scan_timeout)
+                for module in args.modules:
+                        if module not in devices:
+                                print(f'Module {module} not found')
+                updater = FirmwareUpdater(ble_handler.async_handler, image, window = args.window,
+                                          poll_timeout = args.poll_timeout, on_progress = progressPrinter())
+                print(f'Updating {len(devices)} modules with {len(image)} bytes image ...')
+                progress = ble_handler.loop.run_until_complete(updater.updateFleet(devices, args.max_concurrency))
+        printProgressReport(list(progress.values()))
+        return all(module_progress.state == 'done' for module_progress in progress.values())
+
+if __name__ == "__main__":
+        main()
@@ -0,0 +1,171 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_rangeStats.py
+@description: online per-anchor range statistics for autocalibration. Mean and
+              variance are updated with Welford's algorithm, outliers are
+              rejected against a windowed median/MAD and sampling stops once
+              every visible anchor reaches the requested confidence interval
+@author: Esau Ortiz
+@date: october 2026
+"""
+import math
+from collections import deque
+
+# scale factor that turns MAD into a standard deviation estimate for normal data
+MAD_TO_STD = 1.4826
+
+class RangeStatistics(object):
+        def __init__(self, window = 31, outlier_threshold = 3.0, min_window = 5):
+                """ Running statistics of a single anchor range
+                Parameters
+                ----------
+                window: int
+                        number of recent samples used by median and MAD
+                outlier_threshold: float
+                        samples further than outlier_threshold scaled MADs from
+                        the median are rejected
+                min_window: int
+                        samples required before outliers are rejected
+                """
+                self.outlier_threshold = outlier_threshold
+                self.min_window = min_window
+                self.recent = deque(maxlen = window)
+                self.n = 0
+                self.n_rejected = 0
+                self.mean = 0.0
+                self.m2 = 0.0
+
+        def median(self):
+                if not self.recent:
+                        return math.nan
+                values = sorted(self.recent)
+                middle = len(values) // 2
+                return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+        def mad(self):
+                """ median absolute deviation of the recent samples """
+                median = self.median()
+                if math.isnan(median):
+                        return math.nan
+                deviations = sorted(abs(value - median) for value in self.recent)
+                middle = len(deviations) // 2
+                return deviations[middle] if len(deviations) % 2 else (deviations[middle - 1] + deviations[middle]) / 2
+
+        def isOutlier(self, distance):
+                if len(self.recent) < self.min_window:
+                        return False
+                # a zero MAD (e.g. quantised ranges) would reject every different sample
+                scale = max(MAD_TO_STD * self.mad(), 1e-3)
+                return abs(distance - self.median()) > self.outlier_threshold * scale
+
+        def update(self, distance):
+                """ Add a sample
+                Returns
+                -------
+                accepted : bool
+                        False if the sample was rejected as outlier
+                """
+                outlier = self.isOutlier(distance)
+                # rejected samples are still kept in the window, otherwise a
+                # real change of the range would be rejected forever
+                self.recent.append(distance)
+                if outlier:
+                        self.n_rejected += 1
+                        return False
+                self.n += 1
+                delta = distance - self.mean
+                self.mean += delta / self.n
+                self.m2 += delta * (distance - self.mean)
+                return True
+
+        def variance(self):
+                return self.m2 / (self.n - 1) if self.n > 1 else math.nan
+
+        def std(self):
+                return math.sqrt(self.variance()) if self.n > 1 else math.nan
+
+        def confidenceHalfWidth(self, z = 1.96):
+                """ half width of the confidence interval of the mean in meters """
+                return z * self.std() / math.sqrt(self.n) if self.n > 1 else math.inf
+
+class AdaptiveSampler(object):
+        def __init__(self, confidence_interval = None, max_samples = 10, min_samples = 5, z = 1.96,
+                     window = 31, outlier_threshold = 3.0):
+                """ Decide when enough location data frames have been collected
+                Parameters
+                ----------
+                confidence_interval: float
+                        target half width of every anchor's mean confidence
+                        interval in meters. If None, exactly max_samples frames
+                        are collected
+                max_samples: int
+                        hard cap of frames
+                min_samples: int
+                        frames collected before stopping early
+                z: float
+                        normal quantile of the confidence level, 1.96 for 95 %
+                window, outlier_threshold:
+                        see RangeStatistics
+                """
+                self.confidence_interval = confidence_interval
+                self.max_samples = max_samples
+                self.min_samples = min_samples
+                self.z = z
+                self.window = window
+                self.outlier_threshold = outlier_threshold
+                self.anchors = {} # {anchor_id: RangeStatistics}
+                self.last_seen = {} # {anchor_id: index of the last frame with a range to it}
+                self.n_frames = 0
+
+        def update(self, ranges):
+                """ Add the ranges of a location data frame
+                Parameters
+                ----------
+                ranges: dictionary of {anchor_id: distance}
+                Returns
+                -------
+                accepted : dictionary of {anchor_id: distance} without outliers
+                """
+                self.n_frames += 1
+                accepted = {}
+                for anchor_id, distance in ranges.items():
+                        self.last_seen[anchor_id] = self.n_frames
+                        if anchor_id not in self.anchors:
+                                self.anchors[anchor_id] = RangeStatistics(self.window, self.outlier_threshold)
+                        if self.anchors[anchor_id].update(distance):
+                                accepted[anchor_id] = distance
+                return accepted
+
+        def visible(self):
+                """ Anchors whose range must converge: those with min_samples
+                accepted samples or seen in the last min_samples frames. Edge
+                anchors that only showed up in a few frames long ago are ignored
+                """
+                return [anchor_id for anchor_id, stats in self.anchors.items()
+                        if stats.n >= self.min_samples or self.n_frames - self.last_seen[anchor_id] < self.min_samples]
+
+        def converged(self):
+                """ Whether every visible anchor reached the confidence interval """
+                visible = self.visible()
+                return bool(visible) and all(self.anchors[anchor_id].confidenceHalfWidth(self.z) <= self.confidence_interval
+                                             for anchor_id in visible)
+
+        def done(self):
+                if self.n_frames >= self.max_samples:
+                        return True
+                if self.confidence_interval is None or self.n_frames < self.min_samples:
+                        return False
+                return self.converged()
+
+        def remaining(self):
+                return max(self.max_samples - self.n_frames, 0)
+
+        def summary(self):
+                """
+                Returns
+                -------
+                summary : dictionary of {anchor_id: (mean, std, n, n_rejected)}
+                """
+                return {anchor_id: (stats.mean, stats.std(), stats.n, stats.n_rejected)
+                        for anchor_id, stats in self.anchors.items()}
@@ -0,0 +1,156 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_sampleStore.py
+@description: append-only binary store of autocalibration range samples.
+              Records are flushed incrementally so a crash loses at most the
+              last unflushed records, and files are read back lazily with a
+              NumPy memory map or chunk by chunk without NumPy
+@author: Esau Ortiz
+@date: october 2026
+"""
+import os
+import struct
+import time
+
+MAGIC = b'DWMSMPL1'
+HEADER_STRUCT = struct.Struct('<8sII') # magic, record size, reserved
+# timestamp [s], target module, network id, anchor module, distance [m]
+RECORD_STRUCT = struct.Struct('<dHHHf')
+
+def moduleIdToInt(module_id):
+        """ 'DW1A2B' -> 0x1A2B """
+        return int(module_id[2:], 16) if isinstance(module_id, str) else int(module_id)
+
+def intToModuleId(value):
+        """ 0x1A2B -> 'DW1A2B' """
+        return f'DW{int(value):04X}'
+
+def networkIdToInt(network_id):
+        return int(network_id, 16) if isinstance(network_id, str) else int(network_id)
+
+def recordDtype():
+        """ NumPy dtype matching RECORD_STRUCT """
+        import numpy as np
+        return np.dtype([('timestamp', '<f8'), ('target', '<u2'), ('network', '<u2'), ('anchor', '<u2'), ('distance', '<f4')])
+
+class SampleStore(object):
+        def __init__(self, path, flush_every = 256, flush_interval = 1.0, fsync = False):
+                """ Append-only sample store, existing files are appended to
+                Parameters
+                ----------
+                path: string
+                flush_every: int
+                        flush after this many buffered records
+                flush_interval: float
+                        flush when the oldest buffered record is older than this in seconds
+                fsync: bool
+                        also force flushed data to disk
+                """
+                self.path = path
+                self.flush_every = flush_every
+                self.flush_interval = flush_interval
+                self.fsync = fsync
+                self.buffer = bytearray()
+                self.n_buffered = 0
+                self.n_records = 0
+                self.oldest_buffered = None
+                is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+                if not is_new:
+                        checkHeader(path)
+                self.stream = open(path, 'ab')
+                if is_new:
+                        self.stream.write(HEADER_STRUCT.pack(MAGIC, RECORD_STRUCT.size, 0))
+                else:
+                        # drop a partially written record left by a crash
+                        size = os.path.getsize(path) - HEADER_STRUCT.size
+                        if size % RECORD_STRUCT.size:
+                                self.stream.truncate(HEADER_STRUCT.size + size - size % RECORD_STRUCT.size)
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+                self.close()
+                return False
+
+        def append(self, timestamp, target_id, network_id, anchor_id, distance):
+                """
+                Parameters
+                ----------
+                timestamp: float
+                        seconds since epoch
+                target_id: string or int
+                        module ranging as tag, e.g. 'DW1A2B'
+                network_id: string or int
+                        e.g. '0x1234'
+                anchor_id: string or int
+                        ranged anchor, e.g. 'DW2020'
+                distance: float
+                        meters
+                """
+                self.buffer += RECORD_STRUCT.pack(timestamp, moduleIdToInt(target_id), networkIdToInt(network_id),
+                                                  moduleIdToInt(anchor_id), distance)
+                self.n_buffered += 1
+                self.n_records += 1
+                now = time.monotonic()
+                if self.oldest_buffered is None:
+                        self.oldest_buffered = now
+                if self.n_buffered >= self.flush_every or now - self.oldest_buffered >= self.flush_interval:
+                        self.flush()
+
+        def flush(self):
+                if self.buffer:
+                        self.stream.write(self.buffer)
+                        self.buffer = bytearray()
+                        self.n_buffered = 0
+                        self.oldest_buffered = None
+                self.stream.flush()
+                if self.fsync:
+                        os.fsync(self.stream.fileno())
+
+        def close(self):
+                if not self.stream.closed:
+                        self.flush()
+                        self.stream.close()
+
+def checkHeader(path):
+        with open(path, 'rb') as stream:
+                header = stream.read(HEADER_STRUCT.size)
+        if len(header) != HEADER_STRUCT.size:
+                raise ValueError(f'{path} is not a sample store file')
+        magic, record_size, _ = HEADER_STRUCT.unpack(header)
+        if magic != MAGIC or record_size != RECORD_STRUCT.size:
+                raise ValueError(f'{path} is not a sample store file')
+
+def readSamples(path):
+        """ Lazily map every complete record of a store
+        Returns
+        -------
+        samples : (N,) read-only structured memmap with timestamp, target,
+                network, anchor and distance fields, see recordDtype
+        """
+        import numpy as np
+        checkHeader(path)
+        n_records = (os.path.getsize(path) - HEADER_STRUCT.size) // RECORD_STRUCT.size
+        if n_records == 0:
+                return np.zeros(0, dtype = recordDtype())
+        return np.memmap(path, dtype = recordDtype(), mode = 'r', offset = HEADER_STRUCT.size, shape = (n_records,))
+
+def iterSamples(path, chunk_size = 4096):
+        """ Read records chunk by chunk without NumPy
+        Returns
+        -------
+        generator of (timestamp, target_id, network_id, anchor_id, distance)
+                with module ids as 'DW1A2B' strings
+        """
+        checkHeader(path)
+        with open(path, 'rb') as stream:
+                stream.seek(HEADER_STRUCT.size)
+                while True:
+                        chunk = stream.read(chunk_size * RECORD_STRUCT.size)
+                        chunk = chunk[:len(chunk) - len(chunk) % RECORD_STRUCT.size]
+                        if not chunk:
+                                return
+                        for timestamp, target, network, anchor, distance in RECORD_STRUCT.iter_unpack(chunk):
+                                yield timestamp, intToModuleId(target), network, intToModuleId(anchor), distance
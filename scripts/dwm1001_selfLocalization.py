@@ -0,0 +1,283 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_selfLocalization.py
+@description: estimate anchor coordinates from an inter-anchor range matrix
+              (e.g. the one saved by autocalibration_sample_ble.py). Classical
+              MDS on the shortest path completed matrix gives the initial
+              guess, which is refined by robust nonlinear least squares over
+              every measured pair at once
+@author: Esau Ortiz
+@date: october 2026
+@usage: python dwm1001_selfLocalization.py <range_matrix> <nodes_cfg_file>
+
+        # where <range_matrix> is the .npz file saved by autocalibration_sample_ble.py all
+                <nodes_cfg_file> is the nodes configuration yaml file whose
+                anchorN_coordinates are estimated, it is never modified
+        Optional flags:
+            --dim D                 2 to keep configured anchor heights, 3 to estimate them too (default 3)
+            --output FILE           updated nodes configuration (default <nodes_cfg_file>.localized.yaml)
+            --push                  write the estimated positions to the anchors with PersistedPositionMsg
+"""
+import asyncio
+import os
+import numpy as np
+
+def completeRanges(ranges):
+        """ Fill missing ranges with the shortest path through measured ones
+        Parameters
+        ----------
+        ranges: (N, N) array, NaN where missing
+        Returns
+        -------
+        completed : (N, N) array, inf between disconnected anchors
+        """
+        from scipy.sparse.csgraph import shortest_path
+        graph = np.where(np.isfinite(ranges), ranges, 0.0)
+        np.fill_diagonal(graph, 0.0)
+        return shortest_path(graph, method = 'D', directed = False)
+
+def classicalMds(ranges, dim = 3):
+        """ Classical multidimensional scaling
+        Parameters
+        ----------
+        ranges: (N, N) array of complete distances
+        Returns
+        -------
+        positions : (N, dim) array, centered at the origin
+        """
+        n_anchors = len(ranges)
+        centering = np.eye(n_anchors) - np.full((n_anchors, n_anchors), 1.0 / n_anchors)
+        gram = -0.5 * centering @ (ranges ** 2) @ centering
+        eigenvalues, eigenvectors = np.linalg.eigh(gram)
+        largest = np.argsort(eigenvalues)[::-1][:dim]
+        return eigenvectors[:, largest] * np.sqrt(np.maximum(eigenvalues[largest], 0.0))
+
+def measuredPairs(ranges, counts = None):
+        """
+        Returns
+        -------
+        i, j : arrays of anchor indexes of every measured pair with i < j
+        distances : array of measured distances
+        weights : array of residual weights, sqrt of the number of samples
+        """
+        i, j = np.triu_indices(len(ranges), k = 1)
+        measured = np.isfinite(ranges[i, j])
+        i, j = i[measured], j[measured]
+        if counts is None:
+                weights = np.ones(len(i))
+        else:
+                weights = np.sqrt(np.maximum(counts[i, j], 1))
+        return i, j, ranges[i, j], weights
+
+def refine(positions, i, j, distances, weights, loss = 'soft_l1', f_scale = 0.1):
+        """ Robust nonlinear least squares of (|p_i - p_j| - d_ij) * w_ij
+        Parameters
+        ----------
+        positions: (N, dim) initial guess
+        i, j, distances, weights: see measuredPairs
+        loss, f_scale: see scipy.optimize.least_squares
+        Returns
+        -------
+        positions : (N, dim) array
+        residuals : array of unweighted range residuals in meters
+        """
+        from scipy.optimize import least_squares
+        from scipy.sparse import csr_matrix
+        n_anchors, dim = positions.shape
+        n_pairs = len(i)
+        rows = np.repeat(np.arange(n_pairs), 2 * dim)
+        # every residual only depends on the coordinates of its two anchors
+        columns = np.hstack([i[:, None] * dim + np.arange(dim), j[:, None] * dim + np.arange(dim)]).ravel()
+
+        def differences(x):
+                points = x.reshape(n_anchors, dim)
+                delta = points[i] - points[j]
+                return delta, np.maximum(np.linalg.norm(delta, axis = 1), 1e-9)
+
+        def residuals(x):
+                _, norm = differences(x)
+                return (norm - distances) * weights
+
+        def jacobian(x):
+                delta, norm = differences(x)
+                unit = delta / norm[:, None] * weights[:, None]
+                values = np.hstack([unit, -unit]).ravel()
+                return csr_matrix((values, (rows, columns)), shape = (n_pairs, n_anchors * dim))
+
+        # sub-millimeter tolerances, tighter ones only add iterations
+        result = least_squares(residuals, positions.ravel(), jac = jacobian, loss = loss, f_scale = f_scale,
+                               tr_solver = 'lsmr', ftol = 1e-6, xtol = 1e-6)
+        positions = result.x.reshape(n_anchors, dim)
+        return positions, result.fun / weights
+
+def align(positions, reference, mask):
+        """ Rigidly move positions onto the reference coordinates of the
+        anchors in mask, reflections allowed since ranges can not tell them apart
+        Returns
+        -------
+        positions : (N, dim) array
+        """
+        source, target = positions[mask], reference[mask]
+        source_center, target_center = source.mean(axis = 0), target.mean(axis = 0)
+        u, _, vt = np.linalg.svd((source - source_center).T @ (target - target_center))
+        return (positions - source_center) @ (u @ vt) + target_center
+
+def canonicalFrame(positions):
+        """ First anchor at the origin, second one on the x axis and third
+        one in the xy plane
+        """
+        positions = positions - positions[0]
+        axes = []
+        for point in positions[1:]:
+                for axis in axes:
+                        point = point - (point @ axis) * axis
+                if np.linalg.norm(point) > 1e-6:
+                        axes.append(point / np.linalg.norm(point))
+                if len(axes) == positions.shape[1]:
+                        break
+        if len(axes) < positions.shape[1]:
+                return positions
+        return positions @ np.array(axes).T
+
+def localize(ranges, counts = None, reference = None, dim = 3, loss = 'soft_l1', f_scale = 0.1):
+        """ Estimate anchor coordinates from inter-anchor ranges
+        Parameters
+        ----------
+        ranges: (N, N) array in meters, NaN where no range was measured
+        counts: (N, N) array with the number of samples of each range, used as weights
+        reference: (N, 3) array of configured coordinates, NaN where unknown.
+                Estimated positions are expressed in the reference frame if at
+                least three anchors have reference coordinates. With dim = 2 the
+                reference heights are kept and ranges are projected on the
+                horizontal plane
+        dim: int
+                2 or 3
+        Returns
+        -------
+        positions : (N, 3) array
+        residuals : array of range residuals in meters of every measured pair
+        """
+        ranges = np.array(ranges, dtype = float)
+        heights = np.zeros(len(ranges))
+        if reference is not None:
+                reference = np.array(reference, dtype = float)
+                heights = np.nan_to_num(reference[:, 2])
+        if dim == 2:
+                height_differences = heights[:, None] - heights[None, :]
+                ranges = np.sqrt(np.maximum(ranges ** 2 - height_differences ** 2, 0.0))
+        completed = completeRanges(ranges)
+        if not np.all(np.isfinite(completed)):
+                raise ValueError('Range matrix is not connected, some anchors have no path of ranges to the rest')
+        i, j, distances, weights = measuredPairs(ranges, counts)
+        initial = classicalMds(completed, dim)
+        if dim == 3 and reference is not None and np.any(np.isfinite(reference[:, 2])):
+                # anchors are usually close to coplanar, which makes heights weakly
+                # observable: the least significant MDS axis is taken as vertical
+                # and configured heights are used as its initial guess
+                known = np.isfinite(reference[:, 2])
+                initial[:, 2] = np.where(known, reference[:, 2] - reference[known, 2].mean(), initial[:, 2])
+        positions, residuals = refine(initial, i, j, distances, weights, loss, f_scale)
+
+        mask = None
+        if reference is not None:
+                mask = np.all(np.isfinite(reference[:, :dim]), axis = 1)
+        if mask is not None and mask.sum() >= 3:
+                positions = align(positions, reference[:, :dim], mask)
+        else:
+                positions = canonicalFrame(positions)
+        if dim == 2:
+                positions = np.hstack([positions, heights[:, None]])
+        return positions, residuals
+
+def referenceCoordinates(nodes_cfg, anchor_ids):
+        """ Configured anchorN_coordinates of every anchor, NaN if missing """
+        coordinates = np.full((len(anchor_ids), 3), np.nan)
+        for anchor_cfg, key in anchorEntries(nodes_cfg):
+                anchor_id = anchor_cfg[key + '_id']
+                if anchor_id in anchor_ids and key + '_coordinates' in anchor_cfg:
+                        coordinates[anchor_ids.index(anchor_id)] = [float(coord) for coord in anchor_cfg[key + '_coordinates']]
+        return coordinates
+
+def anchorEntries(nodes_cfg):
+        """ (cfg dictionary, 'anchorN') of every anchor either in a single
+        network nodes configuration or in networkN entries
+        """
+        cfgs = [nodes_cfg] + [nodes_cfg['network' + str(i)] for i in range(nodes_cfg.get('n_networks', 0))]
+        return [(cfg, 'anchor' + str(j)) for cfg in cfgs for j in range(cfg.get('n_anchors', 0))]
+
+def localizedPath(nodes_cfg_path):
+        """ Default file for the updated nodes configuration, the hand
+        maintained one is kept as it is
+        """
+        return os.path.splitext(nodes_cfg_path)[0] + '.localized.yaml'
+
+def updateNodesCfg(nodes_cfg, anchor_ids, positions):
+        """ Write positions as anchorN_coordinates (rounded to millimeters)
+        Returns
+        -------
+        n_updated : int
+        """
+        n_updated = 0
+        for anchor_cfg, key in anchorEntries(nodes_cfg):
+                anchor_id = anchor_cfg[key + '_id']
+                if anchor_id in anchor_ids:
+                        position = positions[anchor_ids.index(anchor_id)]
+                        anchor_cfg[key + '_coordinates'] = [round(float(coord), 3) for coord in position]
+                        n_updated += 1
+        return n_updated
+
+async def pushPositions(ble_handler, addresses, anchor_ids, positions):
+        """ Write estimated positions to every found anchor concurrently
+        Parameters
+        ----------
+        ble_handler: AsyncBleConnectionHandler
+        addresses: dictionary of {anchor_id: address}
+        Returns
+        -------
+        failed : list of anchor ids
+        """
+        from dwm1001_apiBle import PersistedPositionMsg
+        targets = [(anchor_id, position) for anchor_id, position in zip(anchor_ids, positions) if anchor_id in addresses]
+        results = await asyncio.gather(*[ble_handler.send(addresses[anchor_id], PersistedPositionMsg(list(position)))
+                                         for anchor_id, position in targets], return_exceptions = True)
+        return [anchor_id for (anchor_id, _), result in zip(targets, results) if isinstance(result, Exception)]
+
+def main():
+        import argparse
+        import yaml
+        parser = argparse.ArgumentParser(description = 'Estimate anchor coordinates from an inter-anchor range matrix')
+        parser.add_argument('range_matrix', help = '.npz file with ranges, counts and anchor_ids')
+        parser.add_argument('nodes_cfg_file', help = 'nodes configuration yaml file with the reference coordinates')
+        parser.add_argument('--dim', type = int, choices = [2, 3], default = 3,
+                            help = '2 to keep configured anchor heights, 3 to estimate them too')
+        parser.add_argument('--output', default = None,
+                            help = 'updated nodes configuration file, default <nodes_cfg_file>.localized.yaml')
+        parser.add_argument('--push', action = 'store_true',
+                            help = 'write the estimated positions to the anchors')
+        args = parser.parse_args()
+
+        data = np.load(args.range_matrix)
+        anchor_ids = [str(anchor_id) for anchor_id in data['anchor_ids']]
+        with open(args.nodes_cfg_file, 'r') as stream:
+                nodes_cfg = yaml.safe_load(stream)
+        positions, residuals = localize(data['ranges'], data['counts'], referenceCoordinates(nodes_cfg, anchor_ids), args.dim)
+        for anchor_id, position in zip(anchor_ids, positions):
+                print(f'{anchor_id}: [X: {position[0]:.3f} Y: {position[1]:.3f} Z: {position[2]:.3f}]')
+        print(f'Range residuals RMS {np.sqrt(np.mean(residuals ** 2)):.3f} m, max {np.max(np.abs(residuals)):.3f} m')
+
+        updateNodesCfg(nodes_cfg, anchor_ids, positions)
+        output = args.output if args.output is not None else localizedPath(args.nodes_cfg_file)
+        with open(output, 'w') as stream:
+                yaml.safe_dump(nodes_cfg, stream, sort_keys = False)
+        print(f'Anchor coordinates written to {output}')
+
+        if args.push:
+                from dwm1001_apiBle import BleConnectionHandler
+                with BleConnectionHandler(max_connections = 8) as ble_handler:
+                        addresses = ble_handler.findDevices(anchor_ids)
+                        failed = ble_handler.loop.run_until_complete(pushPositions(ble_handler.async_handler, addresses, anchor_ids, positions))
+                print(f'{len(addresses) - len(failed)}/{len(anchor_ids)} anchor positions pushed')
+
+if __name__ == "__main__":
+        main()
@@ -0,0 +1,365 @@
+#!/usr/bin python3.6
+
+"""
+@file: dwm1001_telemetry.py
+@description: fleet health poller. Read-only telemetry characteristics
+              (STATISTICS, MAC_STATS, CLUSTER_INFO, ANCHOR_LIST, ...) are read
+              from every module at a fixed rate, in a single batch per
+              connection, and the most recent values are kept in bounded ring
+              buffers per device. Time series can be exported as csv or json
+              and degraded modules are reported
+@author: Esau Ortiz
+@date: october 2026
+@usage: python dwm1001_telemetry.py <module> [<module> ...] [--tags <module> ...]
+
+        # where <module> module ids with DW1234 format, anchors unless listed with --tags
+        Optional flags:
+            --interval S            seconds between polls of each module (default 10)
+            --duration S            seconds polling, until interrupted if not set
+            --history N             values kept per module and characteristic (default 360)
+            --max-concurrency N     modules polled at once (default 4)
+            --output FILE           export time series to FILE (.csv or .json)
+            --adapters LIST         comma separated HCI adapters to spread connections over
+"""
+import asyncio
+import csv
+import json
+import math
+import time
+from collections import deque
+from dwm1001_apiBle import DeviceInfoMsg, StatisticsMsg, MacStatsMsg, ClusterInfoMsg, AnchorListMsg, ProxyPositionsMsg
+
+TELEMETRY_MSGS = {'device_info': DeviceInfoMsg,
+                  'statistics': StatisticsMsg,
+                  'mac_stats': MacStatsMsg,
+                  'cluster_info': ClusterInfoMsg,
+                  'anchor_list': AnchorListMsg,
+                  'proxy_positions': ProxyPositionsMsg}
+ANCHOR_CHARACTERISTICS = ('device_info', 'statistics', 'mac_stats', 'cluster_info', 'anchor_list')
+TAG_CHARACTERISTICS = ('device_info', 'statistics', 'proxy_positions')
+# read on the first successful poll only
+STATIC_CHARACTERISTICS = ('device_info',)
+
+def flattenTelemetry(characteristic, value):
+        """ Numeric metrics of a decoded telemetry value
+        Returns
+        -------
+        metrics : dictionary of {'characteristic.metric': number}
+        """
+        if characteristic == 'anchor_list':
+                rssi = [anchor.rssi for anchor in value]
+                return {'anchor_list.n_anchors': len(value),
+                        'anchor_list.min_rssi': min(rssi) if rssi else float('nan'),
+                        'anchor_list.mean_rssi': sum(rssi) / len(rssi) if rssi else float('nan')}
+        if characteristic == 'proxy_positions':
+                return {'proxy_positions.n_positions': len(value)}
+        return {f'{characteristic}.{field}': getattr(value, field) for field in value._fields}
+
+class TelemetryHistory(object):
+        def __init__(self, max_samples = 360):
+                """ Ring buffers of the most recent telemetry values
+                Parameters
+                ----------
+                max_samples: int
+                        values kept per device and characteristic, older ones
+                        are dropped
+                """
+                self.max_samples = max_samples
+                self.samples = {} # {device: {characteristic: deque of (timestamp, value)}}
+
+        def add(self, device, characteristic, timestamp, value):
+                buffers = self.samples.setdefault(device, {})
+                if characteristic not in buffers:
+                        buffers[characteristic] = deque(maxlen = self.max_samples)
+                buffers[characteristic].append((timestamp, value))
+
+        def devices(self):
+                return list(self.samples)
+
+        def latest(self, device, characteristic):
+                """ Returns
+                -------
+                (timestamp, value) or None if never read
+                """
+                buffer = self.samples.get(device, {}).get(characteristic)
+                return buffer[-1] if buffer else None
+
+        def series(self, device, metric):
+                """ Parameters
+                ----------
+                metric: string
+                        'characteristic.metric', e.g. 'statistics.rx_errors'
+                Returns
+                -------
+                series : list of (timestamp, number)
+                """
+                characteristic = metric.split('.')[0]
+                return [(timestamp, flattenTelemetry(characteristic, value)[metric])
+                        for timestamp, value in self.samples.get(device, {}).get(characteristic, ())]
+
+        def delta(self, device, metric):
+                """ Increase of a counter over the buffered window
+                Returns
+                -------
+                delta : number, None with less than two values or if the
+                        counter was reset (e.g. the module rebooted)
+                """
+                series = self.series(device, metric)
+                if len(series) < 2 or series[-1][1] < series[0][1]:
+                        return None
+                return series[-1][1] - series[0][1]
+
+        def rows(self):
+                """ Returns
+                -------
+                generator of (timestamp, device, metric, value) in time order per device
+                """
+                for device, buffers in self.samples.items():
+                        for characteristic, buffer in buffers.items():
+                                for timestamp, value in buffer:
+                                        for metric, number in flattenTelemetry(characteristic, value).items():
+                                                yield timestamp, device, metric, number
+
+        def exportCsv(self, path):
+                with open(path, 'w', newline = '') as stream:
+                        writer = csv.writer(stream)
+                        writer.writerow(['timestamp', 'device', 'metric', 'value'])
+                        for row in self.rows():
+                                writer.writerow(row)
+
+        def exportJson(self, path):
+                """ {device: {metric: [[timestamp, value], ...]}}, NaN exported as null """
+                data = {}
+                for timestamp, device, metric, number in self.rows():
+                        if isinstance(number, float) and math.isnan(number):
+                                number = None
+                        data.setdefault(device, {}).setdefault(metric, []).append([timestamp, number])
+                with open(path, 'w') as stream:
+                        json.dump(data, stream, indent = 1)
+
+        def export(self, path):
+                """ Export as csv if path ends with .csv, json otherwise """
+                if path.endswith('.csv'):
+                        self.exportCsv(path)
+                else:
+                        self.exportJson(path)
+
+class TelemetryPoller(object):
+        def __init__(self, ble_handler, devices = None, characteristics = ANCHOR_CHARACTERISTICS, interval = 10.0,
+                     max_concurrency = 4, history = None, on_sample = None):
+                """
+                Parameters
+                ----------
+                ble_handler: AsyncBleConnectionHandler
+                devices: dictionary of {name: address}
+                        polled with the default characteristics and interval,
+                        see addDevice for others
+                characteristics: iterable of TELEMETRY_MSGS keys
+                interval: float
+                        seconds between polls of each device
+                max_concurrency: int
+                        devices polled at once
+                history: TelemetryHistory
+                        ring buffers to fill, a new one with 360 values per
+                        device and characteristic if not provided
+                on_sample: callable
+                        called as on_sample(name, timestamp, values) after each
+                        successful poll, values as {characteristic: decoded value}
+                """
+                self.ble_handler = ble_handler
+                self.characteristics = tuple(characteristics)
+                self.interval = interval
+                self.max_concurrency = max_concurrency
+                self.history = history if history is not None else TelemetryHistory()
+                self.on_sample = on_sample
+                self.devices = {} # {name: {'address', 'characteristics', 'interval'}}
+                self.status = {} # {name: {'n_polls', 'n_failures', 'consecutive_failures', 'last_poll', 'last_error'}}
+                for name, address in (devices or {}).items():
+                        self.addDevice(name, address)
+
+        def addDevice(self, name, address, characteristics = None, interval = None):
+                """ Poll a device with its own characteristics (e.g.
+                TAG_CHARACTERISTICS for tags) or interval
+                """
+                unknown = set(characteristics or ()) - set(TELEMETRY_MSGS)
+                if unknown:
+                        raise ValueError(f'Unknown telemetry characteristics {sorted(unknown)}')
+                self.devices[name] = {'address': address,
+                                      'characteristics': tuple(characteristics) if characteristics is not None else self.characteristics,
+                                      'interval': interval if interval is not None else self.interval}
+                self.status[name] = {'n_polls': 0, 'n_failures': 0, 'consecutive_failures': 0, 'last_poll': None, 'last_error': None}
+
+        async def pollDevice(self, name):
+                """ Read every telemetry characteristic of a device over a
+                single connection and store the decoded values
+                Returns
+                -------
+                values : dictionary of {characteristic: decoded value}
+                Raises
+                ------
+                BleOperationError: if retries are exhausted
+                """
+                device = self.devices[name]
+                characteristics = [characteristic for characteristic in device['characteristics']
+                                   if characteristic not in STATIC_CHARACTERISTICS
+                                   or self.history.latest(name, characteristic) is None]
+                msgs = [TELEMETRY_MSGS[characteristic]() for characteristic in characteristics]
+                decoded = await self.ble_handler.readBatch(device['address'], msgs, decode_msg = True)
+                timestamp = time.time()
+                values = dict(zip(characteristics, decoded))
+                for characteristic, value in values.items():
+                        self.history.add(name, characteristic, timestamp, value)
+                status = self.status[name]
+                status['n_polls'] += 1
+                status['consecutive_failures'] = 0
+                status['last_poll'] = timestamp
+                if self.on_sample is not None:
+                        self.on_sample(name, timestamp, values)
+                return values
+
+        async def _pollLoop(self, name, semaphore, delay):
+                # first polls are spread over the interval instead of all at once
+                await asyncio.sleep(delay)
+                interval = self.devices[name]['interval']
+                while True:
+                        start = time.monotonic()
+                        async with semaphore:
+                                try:
+                                        await self.pollDevice(name)
+                                except asyncio.CancelledError:
+                                        raise
+                                except Exception as exc:
+                                        status = self.status[name]
+                                        status['n_failures'] += 1
+                                        status['consecutive_failures'] += 1
+                                        status['last_error'] = repr(exc)
+                                        print(f'Telemetry poll of {name} failed: {exc}')
+                        await asyncio.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+        async def run(self, duration = None):
+                """ Poll every device until cancelled or for duration seconds
+                Returns
+                -------
+                history : TelemetryHistory
+                """
+                names = list(self.devices)
+                if not names:
+                        return self.history
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                tasks = [asyncio.ensure_future(self._pollLoop(name, semaphore, self.devices[name]['interval'] * k / len(names)))
+                         for k, name in enumerate(names)]
+                try:
+                        await asyncio.wait(tasks, timeout = duration)
+                finally:
+                        # wait_for swallows a cancellation that races with the
+                        # read it waits on, cancel until every loop stopped
+                        pending = tasks
+                        while pending:
+                                for task in pending:
+                                        task.cancel()
+                                _, pending = await asyncio.wait(pending, timeout = 0.1)
+                        await asyncio.gather(*tasks, return_exceptions = True)
+                return self.history
+
+        def health(self, name):
+                """ Health indicators of a device over the buffered window
+                Returns
+                -------
+                health : dictionary with poll status, 'rx_error_ratio',
+                        'missed_beacon_ratio', 'uwb_resets' and 'min_rssi',
+                        None where not available
+                """
+                history = self.history
+                health = dict(self.status[name])
+                rx_errors = history.delta(name, 'statistics.rx_errors')
+                rx_ok = history.delta(name, 'statistics.rx_ok')
+                health['rx_error_ratio'] = ratio(rx_errors, rx_ok)
+                missed = history.delta(name, 'mac_stats.missed_beacons')
+                received = history.delta(name, 'mac_stats.beacons_received')
+                health['missed_beacon_ratio'] = ratio(missed, received)
+                health['uwb_resets'] = history.delta(name, 'statistics.uwb_resets')
+                anchor_list = history.latest(name, 'anchor_list')
+                health['min_rssi'] = flattenTelemetry('anchor_list', anchor_list[1])['anchor_list.min_rssi'] if anchor_list else None
+                return health
+
+        def degraded(self, max_rx_error_ratio = 0.05, max_missed_beacon_ratio = 0.1, min_rssi = -90, max_failures = 3):
+                """ Devices whose health is out of bounds
+                Returns
+                -------
+                degraded : dictionary of {name: list of reasons}
+                """
+                degraded = {}
+                for name in self.devices:
+                        health = self.health(name)
+                        reasons = []
+                        if health['consecutive_failures'] >= max_failures:
+                                reasons.append(f'{health["consecutive_failures"]} failed polls')
+                        if health['rx_error_ratio'] is not None and health['rx_error_ratio'] > max_rx_error_ratio:
+                                reasons.append(f'rx error ratio {health["rx_error_ratio"]:.3f}')
+                        if health['missed_beacon_ratio'] is not None and health['missed_beacon_ratio'] > max_missed_beacon_ratio:
+                                reasons.append(f'missed beacon ratio {health["missed_beacon_ratio"]:.3f}')
+                        if health['uwb_resets']:
+                                reasons.append(f'{health["uwb_resets"]} UWB resets')
+                        if health['min_rssi'] is not None and health['min_rssi'] < min_rssi:
+                                reasons.append(f'min rssi {health["min_rssi"]} dBm')
+                        if reasons:
+                                degraded[name] = reasons
+                return degraded
+
+def ratio(errors, successes):
+        """ errors / (errors + successes), None if unknown or no traffic """
+        if errors is None or successes is None or errors + successes == 0:
+                return None
+        return errors / (errors + successes)
+
+def printHealthReport(poller):
+        print(f'{"module":<10}{"polls":<8}{"failures":<10}{"rx errors":<12}{"missed bcn":<12}{"resets":<8}{"min rssi":<10}')
+        def formatValue(value, spec):
+                return 'n/a' if value is None or (isinstance(value, float) and math.isnan(value)) else format(value, spec)
+        for name in poller.devices:
+                health = poller.health(name)
+                print(f'{name:<10}{health["n_polls"]:<8}{health["n_failures"]:<10}{formatValue(health["rx_error_ratio"], ".3f"):<12}'
+                      f'{formatValue(health["missed_beacon_ratio"], ".3f"):<12}{formatValue(health["uwb_resets"], "d"):<8}'
+                      f'{formatValue(health["min_rssi"], ".0f"):<10}')
+        for name, reasons in poller.degraded().items():
+                print(f'{name} degraded: {", ".join(reasons)}')
+        print('')
+
+def main():
+        import argparse
+        from dwm1001_apiBle import BleConnectionHandler
+        parser = argparse.ArgumentParser(description = 'Poll DWM1001 telemetry through BLE')
+        parser.add_argument('modules', nargs = '*', help = 'anchor module ids with DW1234 format')
+        parser.add_argument('--tags', nargs = '+', default = [], help = 'tag module ids with DW1234 format')
+        parser.add_argument('--interval', type = float, default = 10.0, help = 'seconds between polls of each module')
+        parser.add_argument('--duration', type = float, default = None, help = 'seconds polling, until interrupted if not set')
+        parser.add_argument('--history', type = int, default = 360, help = 'values kept per module and characteristic')
+        parser.add_argument('--max-concurrency', type = int, default = 4, help = 'modules polled at once')
+        parser.add_argument('--output', default = None, help = 'export time series to this file (.csv or .json)')
+        parser.add_argument('--adapters', default = None,
+                            help = 'comma separated HCI adapters to spread connections over, e.g. hci0,hci1')
+        parser.add_argument('--scan-timeout', type = float, default = 5.0, help = 'maximum scanning time in seconds')
+        args = parser.parse_args()
+
+        with BleConnectionHandler(max_connections = max(4, args.max_concurrency),
+                                  adapters = args.adapters.split(',') if args.adapters else None) as ble_handler:
+                devices = ble_handler.findDevices(args.modules + args.tags, timeout = args.scan_timeout)
+                poller = TelemetryPoller(ble_handler.async_handler, interval = args.interval, max_concurrency = args.max_concurrency,
+                                         history = TelemetryHistory(args.history))
+                for module in args.modules + args.tags:
+                        if module not in devices:
+                                print(f'Module {module} not found')
+                        else:
+                                poller.addDevice(module, devices[module], TAG_CHARACTERISTICS if module in args.tags else None)
+                print(f'Polling {len(poller.devices)} modules every {args.interval} s ...')
+                try:
+                        ble_handler.loop.run_until_complete(poller.run(args.duration))
+                except KeyboardInterrupt:
+                        print('Polling interrupted')
+        printHealthReport(poller)
+        if args.output is not None:
+                poller.history.export(args.output)
+                print(f'Telemetry written to {args.output}')
+
+if __name__ == "__main__":
+        main()
@@ -0,0 +1,57 @@
+"""
+@file: conftest.py
+@description: pytest fixtures shared by the tests. Modules in scripts/ are
+              imported by name, as the scripts themselves do, and BLE tests
+              run against the simulated fleet of dwm1001_fakeBle
+@author: Esau Ortiz
+@date: october 2026
+"""
+import asyncio
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from dwm1001_apiBle import AsyncBleConnectionHandler, RetryPolicy
+from dwm1001_bleDiscovery import DeviceCache, GattCache
+from dwm1001_fakeBle import FakeFleet, FakeBleTransport
+
+@pytest.fixture
+def loop():
+        """ Fresh default event loop, closed after the test """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        yield loop
+        loop.close()
+        asyncio.set_event_loop(None)
+
+@pytest.fixture
+def fleet():
+        return FakeFleet.grid(n_anchors = 4, n_tags = 1, seed = 1)
+
+@pytest.fixture
+def make_handler(loop):
+        """ Factory of AsyncBleConnectionHandler over a fake transport with
+        in-memory caches and fast retries, closed after the test
+        """
+        handlers = []
+        def makeHandler(fleet, gatt_cache = None, retry_policy = None, max_connections = 4, idle_timeout = 30.0, **transport_kwargs):
+                transport_kwargs.setdefault('connect_latency', 0.001)
+                transport_kwargs.setdefault('read_latency', 0.001)
+                transport_kwargs.setdefault('write_latency', 0.001)
+                transport_kwargs.setdefault('seed', 1)
+                if retry_policy is None:
+                        retry_policy = RetryPolicy(max_attempts = 5, base_delay = 0.001, max_delay = 0.01)
+                handler = AsyncBleConnectionHandler(max_connections, idle_timeout, device_cache = DeviceCache(None),
+                                                    retry_policy = retry_policy, collect_stats = True,
+                                                    transport = FakeBleTransport(fleet, **transport_kwargs),
+                                                    gatt_cache = gatt_cache if gatt_cache is not None else GattCache(None))
+                handlers.append(handler)
+                return handler
+        yield makeHandler
+        for handler in handlers:
+                loop.run_until_complete(handler.close())
+
+def addressOf(fleet, name):
+        return fleet.byName(name).address
@@ -0,0 +1,121 @@
+"""
+@file: test_bleCodec.py
+@description: round trips of the BLE API codec and rejection of invalid frames
+@author: Esau Ortiz
+@date: october 2026
+"""
+import pytest
+import dwm1001_bleCodec as codec
+from dwm1001_apiBle import OperationModeMsg, NetworkIdMsg, LocationDataModeMsg, LocationDataMsg
+from dwm1001_fakeBle import TAG_OPERATION_MODE
+
+ANCHOR_OPERATION_MODE = dict(TAG_OPERATION_MODE, node_type = 1, initiator_enable = 1, LED_indication_enabled = 1)
+
+def distancesFrame(ranges, position = None):
+        mode = codec.LOCATION_DATA_DISTANCES if position is None else codec.LOCATION_DATA_POSITION_DISTANCES
+        frame = bytes([mode]) + (codec.encodePosition(position, 90) if position is not None else b'')
+        frame += bytes([len(ranges)])
+        for anchor_id, distance in ranges:
+                frame += codec.ANCHOR_DISTANCE_STRUCT.pack(anchor_id, int(distance * 1000), 100)
+        return frame
+
+@pytest.mark.parametrize('operation_mode', [TAG_OPERATION_MODE, ANCHOR_OPERATION_MODE])
+def test_operation_mode_round_trip(operation_mode):
+        assert codec.decodeOperationMode(codec.encodeOperationMode(operation_mode)) == operation_mode
+
+@pytest.mark.parametrize('network_id, expected', [(0x1234, 0x1234), ('0x1234', 0x1234), ('0xFFFF', 0xFFFF), (0, 0)])
+def test_network_id_round_trip(network_id, expected):
+        assert codec.decodeNetworkId(codec.encodeNetworkId(network_id)) == expected
+
+@pytest.mark.parametrize('mode', [codec.LOCATION_DATA_POSITION, codec.LOCATION_DATA_DISTANCES, codec.LOCATION_DATA_POSITION_DISTANCES])
+def test_location_data_mode_round_trip(mode):
+        assert codec.decodeLocationDataMode(codec.encodeLocationDataMode(mode)) == mode
+
+def test_msg_classes_decode_their_encoding():
+        for msg, data in [(OperationModeMsg(TAG_OPERATION_MODE), TAG_OPERATION_MODE), (NetworkIdMsg('0x1234'), 0x1234),
+                          (LocationDataModeMsg(1), 1)]:
+                # encodeBle replaces msg.data with the encoded payload
+                msg.encodeBle()
+                assert msg.is_data_ble_encoded
+                assert msg.decodeBle(msg.data) == data
+
+def test_position_frame():
+        frame = bytes([codec.LOCATION_DATA_POSITION]) + codec.encodePosition((1.5, -2.25, 3.0), 80)
+        location_data = codec.decodeLocationData(frame)
+        assert location_data.mode == codec.LOCATION_DATA_POSITION
+        assert location_data.position == codec.Position(1.5, -2.25, 3.0, 80)
+        assert location_data.distances == ()
+
+def test_distances_frame():
+        location_data = LocationDataMsg().decodeBle(distancesFrame([(0xC3B2, 4.2), (0x0001, 0.5)]))
+        assert location_data.position is None
+        assert location_data.ranges() == {'C3B2': 4.2, '0001': 0.5}
+
+def test_position_distances_frame():
+        location_data = codec.decodeLocationData(distancesFrame([(0x1000, 7.0)], position = (1.0, 2.0, 3.0)))
+        assert location_data.position == codec.Position(1.0, 2.0, 3.0, 90)
+        assert location_data.ranges() == {'1000': 7.0}
+
+def test_bulk_decode_matches_frame_decode():
+        frames = [distancesFrame([(0x1000, 1.0), (0x1001, 2.0)]), distancesFrame([(0x1002, 3.0)]), distancesFrame([])]
+        anchor_ids, distances, qualities = codec.decodeLocationDataFrames(frames)
+        for row, frame in enumerate(frames):
+                ranges = codec.decodeLocationData(frame).ranges()
+                decoded = {format(anchor_id, '04X'): distance for anchor_id, distance in zip(anchor_ids[row], distances[row])
+                           if anchor_id != 0}
+                assert decoded == pytest.approx(ranges)
+
+def test_firmware_messages_round_trip():
+        assert codec.decodeFirmwareOffer(codec.encodeFirmwareOffer(0x2A, 0x01030100, 0xDEADBEEF, 1024)) == (0x2A, 0x01030100, 0xDEADBEEF, 1024)
+        assert codec.decodeFirmwareChunk(codec.encodeFirmwareChunk(64, b'\x01\x02')) == (64, b'\x01\x02')
+        poll = codec.encodeFirmwarePoll(codec.FW_POLL_BUFFER_REQUEST, 128, 256)
+        assert codec.decodeFirmwarePoll(poll) == codec.FirmwarePoll(codec.FW_POLL_BUFFER_REQUEST, 128, 256)
+
+def test_telemetry_decoders():
+        statistics = codec.STATISTICS_STRUCT.pack(*range(1, 10))
+        assert codec.decodeStatistics(statistics) == codec.NodeStatistics(*range(1, 10))
+        anchor_list = bytes([1]) + codec.ANCHOR_LIST_ENTRY_STRUCT.pack(0x1000, 1000, 2000, 3000, -70, 0x23)
+        entry, = codec.decodeAnchorList(anchor_list)
+        assert (entry.anchor_id, entry.rssi, entry.seat, entry.neighbor_network) == (0x1000, -70, 3, True)
+
+SHORT_FRAMES = [
+        (codec.decodeNetworkId, b'\x34'),
+        (codec.decodeOperationMode, b'\x80'),
+        (codec.decodeLocationDataMode, b''),
+        (codec.decodeFirmwareOffer, b'\x00\x01'),
+        (codec.decodeFirmwareChunk, b'\x01'),
+        (codec.decodeFirmwarePoll, b''),
+        (codec.decodeDeviceInfo, b'\x00' * 10),
+        (codec.decodeStatistics, b'\x00' * 35),
+        (codec.decodeMacStats, b''),
+        (codec.decodeClusterInfo, b'\x00'),
+        (codec.decodeAnchorList, b''),
+        (codec.decodeProxyPositions, b''),
+]
+
+@pytest.mark.parametrize('decode, frame', SHORT_FRAMES)
+@pytest.mark.parametrize('as_bytearray', [False, True])
+def test_short_frames_raise_value_error(decode, frame, as_bytearray):
+        with pytest.raises(ValueError):
+                decode(bytearray(frame) if as_bytearray else frame)
+
+@pytest.mark.parametrize('frame', [
+        b'',
+        b'\x07',                                                # unknown mode
+        bytes([codec.LOCATION_DATA_POSITION]) + b'\x00' * 5,    # truncated position
+        bytes([codec.LOCATION_DATA_DISTANCES]),                 # missing anchor count
+        bytes([codec.LOCATION_DATA_DISTANCES, 2]) + b'\x00' * 7, # fewer anchors than announced
+        bytes([codec.LOCATION_DATA_POSITION_DISTANCES]) + b'\x00' * 13,
+])
+def test_invalid_location_data_raises_value_error(frame):
+        with pytest.raises(ValueError):
+                codec.decodeLocationData(frame)
+
+def test_anchor_list_with_wrong_count_raises_value_error():
+        entry = codec.ANCHOR_LIST_ENTRY_STRUCT.pack(0x1000, 0, 0, 0, -70, 1)
+        with pytest.raises(ValueError):
+                codec.decodeAnchorList(bytes([2]) + entry)
+
+def test_bulk_decode_rejects_invalid_frames():
+        with pytest.raises(ValueError):
+                codec.decodeLocationDataFrames([distancesFrame([(0x1000, 1.0)]), b'\x01\x01\x00'])
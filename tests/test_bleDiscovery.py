@@ -0,0 +1,50 @@
+"""
+@file: test_bleDiscovery.py
+@description: device cache lookups and recovery from stale cached addresses
+@author: Esau Ortiz
+@date: october 2026
+"""
+import pytest
+from conftest import addressOf
+from dwm1001_apiBle import BleOperationError, DWM1001_BLE_API_COMMANDS
+from dwm1001_bleDiscovery import DeviceCache
+
+STALE_ADDRESS = '00:00:00:00:FF:FF'
+
+def test_cache_lookup_and_expiry():
+        cache = DeviceCache(None, ttl = 60.0)
+        cache.update({'DW1000': '00:00:00:00:00:00'})
+        assert cache.lookup(['DW1000', 'DW1001']) == ({'DW1000': '00:00:00:00:00:00'}, {'DW1001'})
+        cache.load()['DW1000']['seen'] -= 120.0
+        assert cache.get('DW1000') is None
+        cache.invalidate('DW1000')
+        assert cache.load() == {}
+
+def test_cached_addresses_skip_the_scan(loop, fleet, make_handler):
+        handler = make_handler(fleet, advertising_interval = 10.0)
+        handler.device_cache.update({'DW1000': addressOf(fleet, 'DW1000')})
+        devices = loop.run_until_complete(handler.findDevices(['DW1000'], timeout = 10.0))
+        assert devices == {'DW1000': addressOf(fleet, 'DW1000')}
+        assert 'scan' not in handler.stats()['phases']
+
+def test_stale_cached_address_is_scanned_again(loop, fleet, make_handler):
+        handler = make_handler(fleet, advertising_interval = 0.01)
+        handler.device_cache.update({'DW1000': STALE_ADDRESS})
+        devices = loop.run_until_complete(handler.findDevices(['DW1000'], timeout = 1.0))
+        assert devices == {'DW1000': STALE_ADDRESS}
+        data = loop.run_until_complete(handler.readFromDevice(STALE_ADDRESS, DWM1001_BLE_API_COMMANDS.LABEL))
+        assert bytes(data) == b'DW1000'
+        assert handler.device_cache.get('DW1000') == addressOf(fleet, 'DW1000')
+        assert handler.stats()['counters']['stale_addresses'] == 1
+        # later operations go straight to the new address
+        loop.run_until_complete(handler.readFromDevice(STALE_ADDRESS, DWM1001_BLE_API_COMMANDS.NETWORK_ID))
+        assert handler.stats()['counters'].get('read_retries', 0) == 1
+
+def test_missing_cached_device_is_skipped_at_once(loop, fleet, make_handler):
+        handler = make_handler(fleet, advertising_interval = 0.01)
+        handler.device_cache.update({'DW1FFF': STALE_ADDRESS})
+        loop.run_until_complete(handler.findDevices(['DW1FFF'], timeout = 0.05))
+        with pytest.raises(BleOperationError, match = 'stale'):
+                loop.run_until_complete(handler.readFromDevice(STALE_ADDRESS, DWM1001_BLE_API_COMMANDS.NETWORK_ID))
+        assert handler.stats()['counters'].get('read_retries', 0) == 0
+        assert handler.device_cache.get('DW1FFF') is None
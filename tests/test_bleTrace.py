@@ -0,0 +1,114 @@
+"""
+@file: test_bleTrace.py
+@description: trace file format, and sessions recorded against the simulated
+              fleet replayed through ReplayTransport
+@author: Esau Ortiz
+@date: october 2026
+"""
+import asyncio
+import pytest
+from dwm1001_apiBle import AsyncBleConnectionHandler, RetryPolicy, DWM1001_BLE_API_COMMANDS, LocationDataMsg, NetworkIdMsg
+from dwm1001_bleDiscovery import DeviceCache, GattCache
+from dwm1001_bleTrace import (RecordingClient, ReplayError, ReplayTransport, TraceRecorder, readTrace, summarizeTrace,
+                              TRACE_CONNECT, TRACE_FAILED, TRACE_NOTIFY, TRACE_OK, TRACE_READ, TRACE_SCAN, TRACE_SUBSCRIBE)
+from dwm1001_fakeBle import FakeBleTransport
+
+def makeHandler(transport, record = None):
+        return AsyncBleConnectionHandler(device_cache = DeviceCache(None), gatt_cache = GattCache(None), collect_stats = True,
+                                         retry_policy = RetryPolicy(max_attempts = 10, base_delay = 0.001, max_delay = 0.002),
+                                         transport = transport, record = record)
+
+async def session(handler, names):
+        """ Scan, read, write and stream, returns everything the handler returned """
+        devices = await handler.findDevices(names, timeout = 0.5)
+        results = [sorted(devices.items())]
+        for name in sorted(devices):
+                results.append(await handler.readBatch(devices[name], [NetworkIdMsg(), LocationDataMsg()]))
+                results.append(await handler.writeToDevice(devices[name], DWM1001_BLE_API_COMMANDS.NETWORK_ID, b'\x34\x12', True))
+        tag = devices['DW8000']
+        results.append([data async for _, data in handler.stream(tag, LocationDataMsg(), n_samples = 5, decode_msg = False)])
+        await handler.close()
+        return results
+
+def test_trace_file_round_trip(tmp_path):
+        path = str(tmp_path / 'trace.bin')
+        with TraceRecorder(path, flush_every = 2) as recorder:
+                recorder.record(TRACE_SCAN, '00:00:00:00:00:01', 'DW1000', -70)
+                recorder.record(TRACE_READ, '00:00:00:00:00:01', DWM1001_BLE_API_COMMANDS.NETWORK_ID, payload = b'\x34\x12',
+                                timestamp = 1.5, duration = 0.25)
+                recorder.recordFailure(TRACE_CONNECT, '00:00:00:00:00:02', '', OSError('refused'), 2.0)
+        _, records = readTrace(path)
+        assert [(record.type, record.address, record.uuid, record.status) for record in records] == \
+                [(TRACE_SCAN, '00:00:00:00:00:01', 'DW1000', -70),
+                 (TRACE_READ, '00:00:00:00:00:01', DWM1001_BLE_API_COMMANDS.NETWORK_ID, TRACE_OK),
+                 (TRACE_CONNECT, '00:00:00:00:00:02', '', TRACE_FAILED)]
+        assert (records[1].timestamp, records[1].duration, records[1].payload) == (1.5, 0.25, b'\x34\x12')
+        assert records[2].payload == repr(OSError('refused')).encode()
+        # a truncated last record is ignored
+        with open(path, 'rb+') as stream:
+                stream.truncate(stream.seek(0, 2) - 1)
+        assert len(readTrace(path)[1]) == 2
+
+def test_non_trace_files_are_rejected(tmp_path):
+        path = tmp_path / 'trace.bin'
+        path.write_bytes(b'not a trace at all')
+        with pytest.raises(ValueError):
+                readTrace(str(path))
+
+def test_recorded_session_replays_identically(loop, fleet, tmp_path):
+        path = str(tmp_path / 'trace.bin')
+        fleet.update_rate = 100.0
+        names = ['DW1000', 'DW1001', 'DW8000']
+        transport = FakeBleTransport(fleet, connect_latency = 0.001, read_latency = 0.001, write_latency = 0.001,
+                                     advertising_interval = 0.01, failure_rate = 0.1, seed = 3)
+        recorded = loop.run_until_complete(session(makeHandler(transport, record = path), names))
+        summary = summarizeTrace(path)
+        assert summary['failures'] > 0 and summary['devices'] == len(fleet.devices)
+        replay = ReplayTransport(path)
+        assert loop.run_until_complete(session(makeHandler(replay), names)) == recorded
+        assert replay.mismatches == []
+
+def test_replay_reports_diverging_writes(loop, fleet, tmp_path):
+        path = str(tmp_path / 'trace.bin')
+        address = fleet.byName('DW1000').address
+        handler = makeHandler(FakeBleTransport(fleet, connect_latency = 0.0, read_latency = 0.0, write_latency = 0.0), record = path)
+        loop.run_until_complete(handler.writeToDevice(address, DWM1001_BLE_API_COMMANDS.NETWORK_ID, b'\x34\x12', True))
+        loop.run_until_complete(handler.close())
+        replay = ReplayTransport(path)
+        handler = makeHandler(replay)
+        loop.run_until_complete(handler.writeToDevice(address, DWM1001_BLE_API_COMMANDS.NETWORK_ID, b'\x21\x43', True))
+        loop.run_until_complete(handler.close())
+        assert replay.mismatches == [(address, DWM1001_BLE_API_COMMANDS.NETWORK_ID, b'\x34\x12', b'\x21\x43')]
+
+def test_operations_missing_from_the_trace_fail(loop, tmp_path):
+        path = str(tmp_path / 'trace.bin')
+        with TraceRecorder(path) as recorder:
+                recorder.record(TRACE_CONNECT, '00:00:00:00:00:01')
+        client = ReplayTransport(path).createClient('00:00:00:00:00:01')
+        loop.run_until_complete(client.connect())
+        with pytest.raises(ReplayError):
+                loop.run_until_complete(client.read_gatt_char(DWM1001_BLE_API_COMMANDS.NETWORK_ID))
+
+class EagerClient(object):
+        """ Client delivering a notification before start_notify returns """
+        services = None
+
+        async def start_notify(self, char_specifier, callback, **kwargs):
+                callback(0, bytearray(b'early'))
+                await asyncio.sleep(0.01)
+
+def test_notifications_delivered_while_subscribing_are_kept(loop, tmp_path):
+        path = str(tmp_path / 'trace.bin')
+        address, uuid = '00:00:00:01:00:00', DWM1001_BLE_API_COMMANDS.LOCATION_DATA
+        received = []
+        with TraceRecorder(path) as recorder:
+                client = RecordingClient(EagerClient(), address, recorder)
+                loop.run_until_complete(client.start_notify(uuid, lambda sender, data: received.append(bytes(data))))
+                recorder.record(TRACE_NOTIFY, address, uuid, TRACE_OK, b'late')
+        assert received == [b'early']
+        _, records = readTrace(path)
+        assert [record.type for record in records] == [TRACE_SUBSCRIBE, TRACE_NOTIFY, TRACE_NOTIFY]
+        assert records[1].timestamp <= records[0].timestamp + records[0].duration
+        frames = ReplayTransport(path).nextNotifications(address, uuid)
+        assert [payload for _, payload in frames] == [b'early', b'late']
+        assert all(offset >= 0.0 for offset, _ in frames)
@@ -0,0 +1,60 @@
+"""
+@file: test_calibration.py
+@description: CalibrationScheduler against the simulated fleet, in particular
+              that calibrated anchors are always restored
+@author: Esau Ortiz
+@date: october 2026
+"""
+import pytest
+import dwm1001_bleCodec as codec
+from conftest import addressOf
+from dwm1001_apiBle import DWM1001_BLE_API_COMMANDS, RetryPolicy
+from dwm1001_calibration import CalibrationNetwork, CalibrationScheduler
+from dwm1001_fakeBle import FakeBleError, TAG_OPERATION_MODE
+
+ANCHORS = ['DW1000', 'DW1001', 'DW1002', 'DW1003']
+
+@pytest.fixture
+def calibration_fleet(fleet):
+        """ Fleet whose first anchor is the initiator, anchors report positions """
+        fleet.update_rate = 200.0
+        fleet.byName('DW1000').operation_mode['initiator_enable'] = 1
+        for name in ANCHORS:
+                fleet.byName(name).location_data_mode = codec.LOCATION_DATA_POSITION
+        return fleet
+
+def makeScheduler(fleet, handler):
+        network = CalibrationNetwork(0x1234, ANCHORS, {name: list(fleet.byName(name).true_position) for name in ANCHORS})
+        return CalibrationScheduler(handler, [network], dict(TAG_OPERATION_MODE), n_samples = 5, sample_time_budget = 0.5)
+
+def anchorStates(fleet):
+        return {name: (dict(fleet.byName(name).operation_mode), fleet.byName(name).location_data_mode, fleet.byName(name).network_id)
+                for name in ANCHORS}
+
+def test_calibration_restores_every_anchor(loop, calibration_fleet, make_handler):
+        fleet = calibration_fleet
+        before = anchorStates(fleet)
+        scheduler = makeScheduler(fleet, make_handler(fleet))
+        failed = loop.run_until_complete(scheduler.run({name: addressOf(fleet, name) for name in ANCHORS}, ['DW1000']))
+        assert failed == []
+        assert anchorStates(fleet) == before
+        assert any(target == 'DW1000' for target, _ in scheduler.range_sums)
+
+def test_failed_switch_to_tag_is_undone(loop, calibration_fleet, make_handler, monkeypatch):
+        fleet = calibration_fleet
+        before = anchorStates(fleet)
+        target = fleet.byName('DW1000')
+        write = target.write
+        def writeFailingAsTag(UUID, data):
+                # the operation mode is applied but the location data mode never is while the target is a tag
+                if UUID == DWM1001_BLE_API_COMMANDS.LOCATION_DATA_MODE and not target.isAnchor():
+                        raise FakeBleError('Location data mode write failed')
+                write(UUID, data)
+        monkeypatch.setattr(target, 'write', writeFailingAsTag)
+        handler = make_handler(fleet, retry_policy = RetryPolicy(max_attempts = 2, base_delay = 0.001, max_delay = 0.001))
+        scheduler = makeScheduler(fleet, handler)
+        failed = loop.run_until_complete(scheduler.run({name: addressOf(fleet, name) for name in ANCHORS}, ['DW1000']))
+        assert failed == ['DW1000']
+        # the target is an anchor again and its substitute no longer initiator
+        assert anchorStates(fleet) == before
+        assert sum(fleet.byName(name).operation_mode['initiator_enable'] for name in ANCHORS) == 1
@@ -0,0 +1,127 @@
+"""
+@file: test_configPlan.py
+@description: plan compilation, the plan cache and plan execution against the
+              simulated fleet
+@author: Esau Ortiz
+@date: october 2026
+"""
+import os
+import pytest
+import yaml
+from conftest import addressOf
+import dwm1001_bleCodec as codec
+from dwm1001_apiBle import DWM1001_BLE_API_COMMANDS, RetryPolicy
+from dwm1001_configPlan import ConfigPlan, compilePlan, executePlan, loadPlan, paramsPaths
+
+NODES_CFG = {'network_id': '0x1234', 'n_anchors': 3, 'initiator_id': 'DW1000', 'tag0_id': 'DW8000',
+             'anchor0_id': 'DW1000', 'anchor0_coordinates': [0.0, 0.0, 2.0],
+             'anchor1_id': 'DW1001', 'anchor1_coordinates': [5.0, 0.0, 2.0],
+             'anchor2_id': 'DW1002', 'anchor2_coordinates': [0.0, 5.0, 2.0]}
+ANCHOR_OPERATION_MODE = {'node_type': 1, 'UWB': 2, 'firmware': 0, 'accelerometer_enable': 0, 'LED_indication_enabled': 1,
+                         'firmware_update_enable': 0, 'initiator_enable': 0, 'low_power_mode_enable': 0, 'location_engine_enable': 0}
+TAG_OPERATION_MODE = dict(ANCHOR_OPERATION_MODE, node_type = 0, location_engine_enable = 1)
+
+@pytest.fixture
+def params_dir(tmp_path):
+        os.makedirs(tmp_path / 'nodes_cfg')
+        for path, config in zip(paramsPaths(str(tmp_path)), [NODES_CFG, ANCHOR_OPERATION_MODE, TAG_OPERATION_MODE]):
+                with open(path, 'w') as stream:
+                        yaml.safe_dump(config, stream)
+        return str(tmp_path)
+
+def compileDefault():
+        return compilePlan(NODES_CFG, ANCHOR_OPERATION_MODE, TAG_OPERATION_MODE, 'hash')
+
+def addressesOf(fleet, plan):
+        return {device: addressOf(fleet, device) for device in plan.devices()}
+
+def test_compile_plan():
+        plan = compileDefault()
+        assert plan.roles == (('DW1000', 'initiator'), ('DW1001', 'anchor'), ('DW1002', 'anchor'), ('DW8000', 'tag'))
+        assert len(plan.operations) == 3 * 3 + 1
+        by_device = plan.byDevice()
+        assert [operation.uuid for operation in by_device['DW8000']] == [DWM1001_BLE_API_COMMANDS.OPERATION_MODE]
+        initiator_mode = codec.decodeOperationMode(by_device['DW1000'][1].payload)
+        anchor_mode = codec.decodeOperationMode(by_device['DW1001'][1].payload)
+        assert (initiator_mode['initiator_enable'], anchor_mode['initiator_enable']) == (1, 0)
+        # network id and the anchor operation mode are encoded once
+        assert by_device['DW1001'][0].payload is by_device['DW1002'][0].payload
+        assert by_device['DW1001'][1].payload is by_device['DW1002'][1].payload
+        assert plan.distinctPayloads() == 1 + 2 + 3 + 1
+
+def test_plan_json_round_trip():
+        plan = compileDefault()
+        loaded = ConfigPlan.fromJson(plan.toJson())
+        assert (loaded.operations, loaded.roles, loaded.config_hash) == (plan.operations, plan.roles, plan.config_hash)
+        assert loaded.distinctPayloads() == plan.distinctPayloads()
+
+def test_plan_of_another_format_version_is_rejected():
+        data = compileDefault().toJson()
+        data['version'] += 1
+        with pytest.raises(ValueError):
+                ConfigPlan.fromJson(data)
+
+def test_plan_cache(params_dir, tmp_path):
+        paths = paramsPaths(params_dir)
+        cache_dir = str(tmp_path / 'plans')
+        plan, cached = loadPlan(paths, cache_dir)
+        assert not cached
+        cached_plan, cached = loadPlan(paths, cache_dir)
+        assert cached and cached_plan.operations == plan.operations
+        # changed configurations are compiled again
+        with open(paths[0], 'w') as stream:
+                yaml.safe_dump(dict(NODES_CFG, network_id = '0x4321'), stream)
+        changed_plan, cached = loadPlan(paths, cache_dir)
+        assert not cached and changed_plan.config_hash != plan.config_hash
+        # a corrupted cache entry is compiled again too
+        with open(os.path.join(cache_dir, plan.config_hash + '.json'), 'w') as stream:
+                stream.write('{')
+        with open(paths[0], 'w') as stream:
+                yaml.safe_dump(NODES_CFG, stream)
+        recompiled, cached = loadPlan(paths, cache_dir)
+        assert not cached and recompiled.operations == plan.operations
+
+def test_execute_plan(loop, fleet, make_handler):
+        plan = compileDefault()
+        handler = make_handler(fleet)
+        results = loop.run_until_complete(executePlan(handler, plan, addressesOf(fleet, plan)))
+        assert all(result['success'] for result in results)
+        assert [result['writes'] for result in results] == [3, 3, 3, 1]
+        anchor = fleet.byName('DW1001')
+        assert anchor.network_id == 0x1234
+        assert (anchor.position.x, anchor.position.y, anchor.position.z) == pytest.approx((5.0, 0.0, 2.0))
+        assert fleet.byName('DW1000').operation_mode['initiator_enable'] == 1
+        assert fleet.byName('DW8000').operation_mode['location_engine_enable'] == 1
+
+def test_execute_plan_diff_skips_up_to_date_settings(loop, fleet, make_handler):
+        plan = compileDefault()
+        handler = make_handler(fleet)
+        loop.run_until_complete(executePlan(handler, plan, addressesOf(fleet, plan)))
+        n_writes = {device.name: device.n_writes for device in fleet.devices.values()}
+        results = loop.run_until_complete(executePlan(handler, plan, addressesOf(fleet, plan), diff = True))
+        assert [result['writes'] for result in results] == [0, 0, 0, 0]
+        assert n_writes == {device.name: device.n_writes for device in fleet.devices.values()}
+
+def test_execute_plan_skips_devices_not_found(loop, fleet, make_handler):
+        plan = compileDefault()
+        addresses = addressesOf(fleet, plan)
+        del addresses['DW1002']
+        results = loop.run_until_complete(executePlan(make_handler(fleet), plan, addresses))
+        assert [result['device'] for result in results] == ['DW1000', 'DW1001', 'DW8000']
+
+def test_failed_device_reports_its_retries(loop, fleet, make_handler):
+        plan = compileDefault()
+        handler = make_handler(fleet, retry_policy = RetryPolicy(max_attempts = 3, base_delay = 0.001, max_delay = 0.001),
+                               failure_rate = 1.0)
+        results = loop.run_until_complete(executePlan(handler, plan, {'DW1000': addressOf(fleet, 'DW1000')}))
+        assert [(result['success'], result['retries']) for result in results] == [(False, 2)]
+
+def test_unexpected_error_only_fails_its_device(loop, fleet, make_handler, monkeypatch):
+        plan = compileDefault()
+        device = fleet.byName('DW1001')
+        def refuseWrites(UUID, data):
+                raise PermissionError('Write not permitted')
+        monkeypatch.setattr(device, 'write', refuseWrites)
+        results = loop.run_until_complete(executePlan(make_handler(fleet), plan, addressesOf(fleet, plan)))
+        assert [(result['device'], result['success']) for result in results] == \
+                [('DW1000', True), ('DW1001', False), ('DW1002', True), ('DW8000', True)]
@@ -0,0 +1,143 @@
+"""
+@file: test_connectionPool.py
+@description: BleConnectionPool reuse, limits, eviction and recovery of dropped
+              links against the simulated fleet
+@author: Esau Ortiz
+@date: october 2026
+"""
+import asyncio
+import pytest
+from conftest import addressOf
+from dwm1001_apiBle import BleConnectionPool, DWM1001_BLE_API_COMMANDS, DeviceInfoMsg, LocationDataModeMsg, LocationDataMsg, NetworkIdMsg, OperationModeMsg
+from dwm1001_bleStats import BleStats
+from dwm1001_fakeBle import FakeBleError, FakeBleTransport
+
+ANCHORS = ['DW1000', 'DW1001', 'DW1002', 'DW1003']
+
+def makePool(fleet, max_connections = 2, idle_timeout = 30.0, **transport_kwargs):
+        transport_kwargs.setdefault('connect_latency', 0.001)
+        transport_kwargs.setdefault('read_latency', 0.001)
+        transport = FakeBleTransport(fleet, seed = 1, **transport_kwargs)
+        return BleConnectionPool(max_connections, idle_timeout, stats = BleStats(enabled = True), transport = transport)
+
+async def readNetworkId(pool, address):
+        async with pool.lease(address) as client:
+                return await client.read_gatt_char(DWM1001_BLE_API_COMMANDS.NETWORK_ID)
+
+def test_connection_is_reused(loop, fleet):
+        pool = makePool(fleet)
+        address = addressOf(fleet, 'DW1000')
+        for _ in range(5):
+                loop.run_until_complete(readNetworkId(pool, address))
+        assert fleet.byName('DW1000').n_connections == 1
+        assert pool.stats.snapshot()['counters']['connection_reuses'] == 4
+        loop.run_until_complete(pool.close())
+
+def test_least_recently_used_connection_is_evicted(loop, fleet):
+        pool = makePool(fleet, max_connections = 2)
+        addresses = [addressOf(fleet, name) for name in ANCHORS[:3]]
+        for address in addresses[:2] + addresses[:1] + addresses[2:]:
+                loop.run_until_complete(readNetworkId(pool, address))
+        # DW1000 was used after DW1001, so DW1001 is evicted
+        assert list(pool.connections) == [addresses[0], addresses[2]]
+        assert len(pool.transport.connected) == 2
+        assert pool.stats.snapshot()['counters']['evictions'] == 1
+        loop.run_until_complete(pool.close())
+
+def test_max_connections_is_never_exceeded(loop, fleet):
+        pool = makePool(fleet, max_connections = 2, read_latency = 0.01)
+        peak = []
+        async def readAndTrack(address):
+                async with pool.lease(address) as client:
+                        peak.append(len(pool.transport.connected))
+                        await client.read_gatt_char(DWM1001_BLE_API_COMMANDS.NETWORK_ID)
+        async def readAll():
+                await asyncio.gather(*[readAndTrack(addressOf(fleet, name)) for name in ANCHORS * 3])
+        loop.run_until_complete(readAll())
+        assert max(peak) <= 2
+        assert len(pool.connections) <= 2
+        loop.run_until_complete(pool.close())
+
+def test_failed_operation_discards_the_link(loop, fleet):
+        pool = makePool(fleet)
+        address = addressOf(fleet, 'DW1000')
+        async def failInsideLease():
+                async with pool.lease(address):
+                        raise FakeBleError('Link dropped')
+        loop.run_until_complete(readNetworkId(pool, address))
+        with pytest.raises(FakeBleError):
+                loop.run_until_complete(failInsideLease())
+        assert address not in pool.connections
+        assert not pool.transport.connected
+        loop.run_until_complete(readNetworkId(pool, address))
+        assert fleet.byName('DW1000').n_connections == 2
+        loop.run_until_complete(pool.close())
+
+def test_failed_connect_releases_the_slot(loop, fleet):
+        pool = makePool(fleet, max_connections = 1, failure_rate = 1.0)
+        with pytest.raises(FakeBleError):
+                loop.run_until_complete(readNetworkId(pool, addressOf(fleet, 'DW1000')))
+        assert not pool.connections
+        pool.transport.failure_rate = 0.0
+        loop.run_until_complete(readNetworkId(pool, addressOf(fleet, 'DW1001')))
+        loop.run_until_complete(pool.close())
+
+def test_dropped_link_is_reconnected(loop, fleet):
+        pool = makePool(fleet)
+        address = addressOf(fleet, 'DW1000')
+        loop.run_until_complete(readNetworkId(pool, address))
+        for client in list(pool.transport.connected):
+                client._dropLink()
+        loop.run_until_complete(readNetworkId(pool, address))
+        assert fleet.byName('DW1000').n_connections == 2
+        loop.run_until_complete(pool.close())
+
+def test_idle_connections_are_pruned(loop, fleet):
+        pool = makePool(fleet, idle_timeout = 0.01)
+        loop.run_until_complete(readNetworkId(pool, addressOf(fleet, 'DW1000')))
+        loop.run_until_complete(asyncio.sleep(0.02))
+        loop.run_until_complete(pool.pruneIdle())
+        assert not pool.connections
+        assert not pool.transport.connected
+
+def test_close_disconnects_everything(loop, fleet):
+        pool = makePool(fleet, max_connections = 4)
+        for name in ANCHORS:
+                loop.run_until_complete(readNetworkId(pool, addressOf(fleet, name)))
+        assert len(pool.transport.connected) == 4
+        loop.run_until_complete(pool.close())
+        assert not pool.connections
+        assert not pool.transport.connected
+
+def test_handler_reads_concurrently_within_the_limit(loop, fleet, make_handler):
+        handler = make_handler(fleet, max_connections = 2)
+        async def readAll():
+                return await asyncio.gather(*[handler.readFromDevice(addressOf(fleet, name), DWM1001_BLE_API_COMMANDS.NETWORK_ID)
+                                              for name in ANCHORS])
+        assert all(len(data) == 2 for data in loop.run_until_complete(readAll()))
+        assert len(handler.pool.connections) <= 2
+
+def test_handler_batch_survives_dropped_links(loop, fleet, make_handler):
+        msgs = [NetworkIdMsg(), OperationModeMsg(), LocationDataModeMsg(), DeviceInfoMsg()] * 3
+        address = addressOf(fleet, 'DW1000')
+        expected = loop.run_until_complete(make_handler(fleet).readBatch(address, msgs))
+        data = loop.run_until_complete(make_handler(fleet, failure_rate = 0.2).readBatch(address, msgs))
+        assert data == expected
+
+def test_stream_counts_frames_dropped_by_a_slow_consumer(loop, fleet, make_handler):
+        fleet.update_rate = 500.0
+        handler = make_handler(fleet)
+        address = addressOf(fleet, 'DW8000')
+        async def consume(queue_size):
+                frames = []
+                async for _, data in handler.stream(address, LocationDataMsg(), n_samples = 5, queue_size = queue_size):
+                        frames.append(data)
+                        await asyncio.sleep(0.02)
+                return frames
+        assert len(loop.run_until_complete(consume(2))) == 5
+        assert handler.droppedFrames(address) > 0
+        assert handler.stats()['counters']['dropped_notifications'] == handler.droppedFrames()
+        # an unbounded queue keeps every frame
+        n_dropped = handler.droppedFrames(address)
+        loop.run_until_complete(consume(None))
+        assert handler.droppedFrames(address) == n_dropped
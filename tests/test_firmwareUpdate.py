@@ -0,0 +1,86 @@
+"""
+@file: test_firmwareUpdate.py
+@description: firmware uploads to the simulated fleet, resumed from the offset
+              the module reached after a chunk write fails
+@author: Esau Ortiz
+@date: october 2026
+"""
+import random
+import pytest
+import dwm1001_bleCodec as codec
+from conftest import addressOf
+from dwm1001_apiBle import DWM1001_BLE_API_COMMANDS
+from dwm1001_fakeBle import FakeBleClient, FakeBleError
+from dwm1001_firmwareUpdate import FirmwareImage, FirmwareUpdateError, FirmwareUpdater
+
+NEW_FW_VERSION = 0x01040000
+
+def makeImage(size = 3000, hw_version = 0x2A):
+        return FirmwareImage(random.Random(1).getrandbits(8 * size).to_bytes(size, 'little'), hw_version, NEW_FW_VERSION)
+
+class ChunkLog(object):
+        def __init__(self):
+                self.offsets = [] # offsets of the firmware chunks written, in order
+                self.fail_at = set() # offsets whose chunk drops the link instead, once
+
+@pytest.fixture
+def chunks(monkeypatch):
+        """ ChunkLog of the firmware chunks successfully written to the fleet """
+        log = ChunkLog()
+        write = FakeBleClient.write_gatt_char
+        async def loggingWrite(self, char_specifier, data, response = False):
+                if self._uuid(char_specifier) == DWM1001_BLE_API_COMMANDS.FW_UPDATE_PUSH and data[0] == codec.FW_PUSH_CHUNK:
+                        offset, _ = codec.decodeFirmwareChunk(data)
+                        if offset in log.fail_at:
+                                log.fail_at.discard(offset)
+                                self._dropLink()
+                                raise FakeBleError(f'Link to {self.address} dropped')
+                        result = await write(self, char_specifier, data, response)
+                        log.offsets.append(offset)
+                        return result
+                return await write(self, char_specifier, data, response)
+        monkeypatch.setattr(FakeBleClient, 'write_gatt_char', loggingWrite)
+        return log
+
+def test_image_is_uploaded(loop, fleet, make_handler, chunks):
+        device = fleet.byName('DW1000')
+        image = makeImage()
+        updater = FirmwareUpdater(make_handler(fleet), image, window = 4)
+        progress = loop.run_until_complete(updater.update(device.address, 'DW1000'))
+        assert progress.state == 'done' and progress.resumes == 0
+        assert progress.acknowledged == progress.sent == len(image)
+        assert chunks.offsets == list(range(0, len(image), codec.FW_CHUNK_SIZE))
+        assert device.fw_version == NEW_FW_VERSION
+
+def test_failed_chunk_resumes_from_the_acknowledged_offset(loop, fleet, make_handler, chunks):
+        device = fleet.byName('DW1000')
+        image = makeImage()
+        # in the third buffer, after the module acknowledged two and received a few chunks of it
+        failed_offset = 2 * device.fw_buffer_size + 4 * codec.FW_CHUNK_SIZE
+        chunks.fail_at.add(failed_offset)
+        handler = make_handler(fleet)
+        updater = FirmwareUpdater(handler, image, window = 4)
+        progress = loop.run_until_complete(updater.update(device.address, 'DW1000'))
+        assert progress.state == 'done' and progress.resumes == 1
+        assert device.fw_version == NEW_FW_VERSION
+        assert handler.stats()['counters']['fw_resumes'] == 1
+        # the upload resumes at the failed chunk, nothing the module received is sent again
+        assert chunks.offsets == list(range(0, len(image), codec.FW_CHUNK_SIZE))
+        assert progress.sent <= len(image) + 4 * codec.FW_CHUNK_SIZE
+
+def test_rejected_image_is_not_resumed(loop, fleet, make_handler):
+        device = fleet.byName('DW1000')
+        updater = FirmwareUpdater(make_handler(fleet), makeImage(hw_version = 0x2B), window = 4)
+        with pytest.raises(FirmwareUpdateError):
+                loop.run_until_complete(updater.update(device.address, 'DW1000'))
+        progress = updater.progress[device.address]
+        assert progress.state == 'failed' and progress.resumes == 0
+        assert device.fw_version != NEW_FW_VERSION
+
+def test_fleet_update_survives_link_failures(loop, fleet, make_handler):
+        names = ['DW1000', 'DW1001', 'DW1002']
+        handler = make_handler(fleet, failure_rate = 0.02)
+        updater = FirmwareUpdater(handler, makeImage(), window = 4, poll_timeout = 0.5)
+        progress = loop.run_until_complete(updater.updateFleet({name: addressOf(fleet, name) for name in names}, max_concurrency = 2))
+        assert all(progress[name].state == 'done' for name in names)
+        assert all(fleet.byName(name).fw_version == NEW_FW_VERSION for name in names)
@@ -0,0 +1,135 @@
+"""
+@file: test_gattCache.py
+@description: handle tables persisted by GattCache, reused on later connections
+              and dropped when found stale
+@author: Esau Ortiz
+@date: october 2026
+"""
+import pytest
+from conftest import addressOf
+from dwm1001_apiBle import DWM1001_BLE_API_COMMANDS
+from dwm1001_bleDiscovery import GattCache
+from dwm1001_bleTransport import HandleClient
+from dwm1001_fakeBle import FakeBleClient, FakeBleError, FakeBleTransport
+
+def readNetworkId(loop, handler, address):
+        return loop.run_until_complete(handler.readFromDevice(address, DWM1001_BLE_API_COMMANDS.NETWORK_ID))
+
+def counters(handler):
+        return handler.stats()['counters']
+
+@pytest.fixture
+def undiscovered(monkeypatch):
+        """ Fake clients that do not expose services, as backends that skip
+        service discovery on cached connections
+        """
+        connect = FakeBleClient.connect
+        async def connectWithoutServices(self, *args, **kwargs):
+                result = await connect(self, *args, **kwargs)
+                self.services = None
+                return result
+        monkeypatch.setattr(FakeBleClient, 'connect', connectWithoutServices)
+
+def test_handles_are_persisted_and_reused(loop, fleet, make_handler, tmp_path):
+        path = str(tmp_path / 'gatt.json')
+        address = addressOf(fleet, 'DW1000')
+        first = make_handler(fleet, gatt_cache = GattCache(path))
+        readNetworkId(loop, first, address)
+        assert counters(first)['gatt_resolutions'] == 1
+        entry = GattCache(path).get(address)
+        assert entry['handles'] == fleet.byName('DW1000').handles()
+        assert entry['fw_version'] == fleet.byName('DW1000').fw_version
+        # a new process trusts the persisted table without reading DEVICE_INFO
+        second = make_handler(fleet, gatt_cache = GattCache(path))
+        assert readNetworkId(loop, second, address) == readNetworkId(loop, first, address)
+        assert counters(second)['gatt_cache_hits'] == 1
+        assert 'gatt_resolutions' not in counters(second)
+
+def test_moved_handles_are_resolved_again(loop, fleet, make_handler):
+        gatt_cache = GattCache(None)
+        address = addressOf(fleet, 'DW1000')
+        readNetworkId(loop, make_handler(fleet, gatt_cache = gatt_cache), address)
+        device = fleet.byName('DW1000')
+        device.fw_version += 0x10000
+        handler = make_handler(fleet, gatt_cache = gatt_cache)
+        readNetworkId(loop, handler, address)
+        assert counters(handler)['gatt_resolutions'] == 1
+        assert gatt_cache.get(address)['handles'] == device.handles()
+        assert gatt_cache.get(address)['fw_version'] == device.fw_version
+
+def test_stale_table_falls_back_to_uuids(loop, fleet, make_handler, undiscovered):
+        gatt_cache = GattCache(None)
+        address = addressOf(fleet, 'DW1000')
+        gatt_cache.update(address, 0, {uuid: 0xF000 + handle for uuid, handle in fleet.byName('DW1000').handles().items()})
+        handler = make_handler(fleet, gatt_cache = gatt_cache)
+        assert len(readNetworkId(loop, handler, address)) == 2
+        assert counters(handler)['gatt_stale'] == 1
+        assert gatt_cache.get(address) is None
+        assert 'read_retries' not in counters(handler)
+
+def test_unreadable_device_info_does_not_fail_connect(loop, fleet, make_handler, monkeypatch):
+        gatt_cache = GattCache(None)
+        device = fleet.byName('DW1000')
+        read = device.read
+        def readWithoutDeviceInfo(UUID):
+                if UUID == DWM1001_BLE_API_COMMANDS.DEVICE_INFO:
+                        raise FakeBleError('DEVICE_INFO read failed')
+                return read(UUID)
+        monkeypatch.setattr(device, 'read', readWithoutDeviceInfo)
+        handler = make_handler(fleet, gatt_cache = gatt_cache)
+        assert len(readNetworkId(loop, handler, device.address)) == 2
+        assert gatt_cache.get(device.address) is None
+        assert 'read_retries' not in counters(handler)
+
+def test_handle_client_falls_back_on_a_live_link(loop, fleet):
+        address = addressOf(fleet, 'DW1000')
+        client = FakeBleTransport(fleet, connect_latency = 0.0, read_latency = 0.0).createClient(address)
+        loop.run_until_complete(client.connect())
+        stale = []
+        handle_client = HandleClient(client, {DWM1001_BLE_API_COMMANDS.NETWORK_ID: 0xFFFF}, lambda: stale.append(True))
+        assert loop.run_until_complete(handle_client.read_gatt_char(DWM1001_BLE_API_COMMANDS.NETWORK_ID)) \
+                == fleet.byName('DW1000').read(DWM1001_BLE_API_COMMANDS.NETWORK_ID)
+        assert stale == [True] and handle_client.handles == {}
+        # failures on a dropped link are not taken for a stale table
+        handle_client = HandleClient(client, {DWM1001_BLE_API_COMMANDS.NETWORK_ID: 0xFFFF}, lambda: stale.append(True))
+        loop.run_until_complete(client.disconnect())
+        with pytest.raises(FakeBleError):
+                loop.run_until_complete(handle_client.read_gatt_char(DWM1001_BLE_API_COMMANDS.NETWORK_ID))
+        assert stale == [True]
+
+def test_handle_client_does_not_resend_failed_writes(loop, fleet, monkeypatch):
+        address = addressOf(fleet, 'DW1000')
+        device = fleet.byName('DW1000')
+        client = FakeBleTransport(fleet, connect_latency = 0.0, write_latency = 0.0).createClient(address)
+        loop.run_until_complete(client.connect())
+        network_id = device.read(DWM1001_BLE_API_COMMANDS.NETWORK_ID)
+        # a handle missing from the discovered services fails before anything is written
+        stale = []
+        handle_client = HandleClient(client, {DWM1001_BLE_API_COMMANDS.NETWORK_ID: 0xFFFF}, lambda: stale.append(True))
+        loop.run_until_complete(handle_client.write_gatt_char(DWM1001_BLE_API_COMMANDS.NETWORK_ID, network_id, True))
+        assert stale == [True] and device.n_writes == 1
+        # a write failing by a known handle may have been applied, it is not sent again
+        writes = []
+        def failingWrite(UUID, data):
+                writes.append(UUID)
+                raise FakeBleError('write failed')
+        monkeypatch.setattr(device, 'write', failingWrite)
+        handle_client = HandleClient(client, device.handles(), lambda: stale.append(True))
+        with pytest.raises(FakeBleError):
+                loop.run_until_complete(handle_client.write_gatt_char(DWM1001_BLE_API_COMMANDS.NETWORK_ID, network_id, True))
+        assert writes == [DWM1001_BLE_API_COMMANDS.NETWORK_ID]
+        assert stale == [True, True] and handle_client.handles == {}
+
+@pytest.mark.parametrize('backend, expected', [('bluez', [0.5, 0.5]), ('winrt', [0.5, 0.0])])
+def test_only_winrt_skips_discovery_of_cached_devices(loop, fleet, backend, expected):
+        transport = FakeBleTransport(fleet, connect_latency = 0.0, discovery_latency = 0.5, backend = backend)
+        latencies = []
+        async def recordLatency(latency):
+                latencies.append(latency)
+        transport.wait = recordLatency
+        address = addressOf(fleet, 'DW1000')
+        for _ in range(2):
+                client = transport.createClient(address)
+                loop.run_until_complete(client.connect(use_cached = True))
+                loop.run_until_complete(client.disconnect())
+        assert latencies == expected
@@ -0,0 +1,111 @@
+"""
+@file: test_rangeStats.py
+@description: per-anchor range statistics and the adaptive sampler
+@author: Esau Ortiz
+@date: october 2026
+"""
+import math
+import random
+import statistics
+import pytest
+from dwm1001_rangeStats import AdaptiveSampler, RangeStatistics
+
+def noisyFrame(rng, ranges, noise = 0.02):
+        return {anchor_id: distance + rng.gauss(0.0, noise) for anchor_id, distance in ranges.items()}
+
+def test_welford_matches_batch_statistics():
+        rng = random.Random(1)
+        samples = [4.0 + rng.gauss(0.0, 0.05) for _ in range(100)]
+        stats = RangeStatistics(outlier_threshold = math.inf)
+        assert all(stats.update(sample) for sample in samples)
+        assert stats.n == len(samples)
+        assert stats.mean == pytest.approx(statistics.mean(samples))
+        assert stats.variance() == pytest.approx(statistics.variance(samples))
+        assert stats.confidenceHalfWidth() == pytest.approx(1.96 * statistics.stdev(samples) / math.sqrt(len(samples)))
+
+def test_too_few_samples_have_no_confidence_interval():
+        stats = RangeStatistics()
+        assert math.isnan(stats.median()) and stats.confidenceHalfWidth() == math.inf
+        stats.update(4.0)
+        assert math.isnan(stats.std()) and stats.confidenceHalfWidth() == math.inf
+
+def test_outliers_are_rejected():
+        rng = random.Random(1)
+        stats = RangeStatistics()
+        for _ in range(20):
+                stats.update(4.0 + rng.gauss(0.0, 0.02))
+        n, n_rejected = stats.n, stats.n_rejected
+        assert not stats.update(12.0)
+        assert (stats.n, stats.n_rejected) == (n, n_rejected + 1)
+        assert stats.mean == pytest.approx(4.0, abs = 0.02)
+
+def test_quantised_ranges_are_not_rejected():
+        stats = RangeStatistics()
+        for _ in range(10):
+                stats.update(4.0)
+        # a zero MAD still accepts a sample one millimetre away
+        assert stats.update(4.001)
+
+def test_confidence_interval_shrinks_until_convergence():
+        rng = random.Random(1)
+        sampler = AdaptiveSampler(confidence_interval = 0.01, max_samples = 1000, min_samples = 5)
+        ranges = {'DW1000': 3.0, 'DW1001': 4.0}
+        half_widths = []
+        while not sampler.done():
+                sampler.update(noisyFrame(rng, ranges))
+                half_widths.append(sampler.anchors['DW1000'].confidenceHalfWidth())
+        assert sampler.converged() and sampler.n_frames < 1000
+        assert half_widths[-1] <= 0.01 < half_widths[9]
+        for anchor_id, (mean, std, n, n_rejected) in sampler.summary().items():
+                assert mean == pytest.approx(ranges[anchor_id], abs = 0.01)
+                assert n + n_rejected == sampler.n_frames
+
+def test_noisy_ranges_stop_at_max_samples():
+        rng = random.Random(1)
+        sampler = AdaptiveSampler(confidence_interval = 0.001, max_samples = 50, min_samples = 5)
+        while not sampler.done():
+                sampler.update(noisyFrame(rng, {'DW1000': 3.0}, noise = 0.5))
+        assert sampler.n_frames == 50 and sampler.remaining() == 0
+        assert not sampler.converged()
+
+def test_without_confidence_interval_max_samples_are_collected():
+        sampler = AdaptiveSampler(confidence_interval = None, max_samples = 10)
+        n_frames = 0
+        while not sampler.done():
+                sampler.update({'DW1000': 3.0})
+                n_frames += 1
+        assert n_frames == 10
+
+def test_no_early_stop_before_min_samples():
+        sampler = AdaptiveSampler(confidence_interval = 1.0, max_samples = 100, min_samples = 5)
+        for _ in range(4):
+                sampler.update({'DW1000': 3.0, 'DW1001': 4.0})
+                assert not sampler.done()
+        sampler.update({'DW1000': 3.0, 'DW1001': 4.0})
+        assert sampler.done()
+
+def test_sporadic_anchor_does_not_block_early_stopping():
+        rng = random.Random(1)
+        sampler = AdaptiveSampler(confidence_interval = 0.05, max_samples = 200, min_samples = 5)
+        ranges = {'DW1000': 3.0, 'DW1001': 4.0, 'DW1002': 5.0}
+        # an edge anchor shows up in a single early frame only
+        sampler.update(noisyFrame(rng, dict(ranges, DW1003 = 25.0)))
+        while not sampler.done():
+                sampler.update(noisyFrame(rng, ranges))
+        assert sampler.n_frames < 20
+        assert sampler.anchors['DW1003'].n == 1
+        assert 'DW1003' not in sampler.visible()
+
+def test_recently_seen_anchor_must_converge():
+        rng = random.Random(1)
+        sampler = AdaptiveSampler(confidence_interval = 0.05, max_samples = 200, min_samples = 5)
+        ranges = {'DW1000': 3.0, 'DW1001': 4.0}
+        for _ in range(10):
+                sampler.update(noisyFrame(rng, ranges))
+        assert sampler.done()
+        # an anchor that just appeared is waited for until it converges too
+        sampler.update(noisyFrame(rng, dict(ranges, DW1002 = 5.0)))
+        assert not sampler.done()
+        while not sampler.done():
+                sampler.update(noisyFrame(rng, dict(ranges, DW1002 = 5.0)))
+        assert sampler.anchors['DW1002'].confidenceHalfWidth() <= 0.05
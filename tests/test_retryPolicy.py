@@ -0,0 +1,103 @@
+"""
+@file: test_retryPolicy.py
+@description: RetryPolicy classification, attempt budget and deadline, alone
+              and through the handler against a failing fake transport
+@author: Esau Ortiz
+@date: october 2026
+"""
+import asyncio
+import pytest
+from conftest import addressOf
+from dwm1001_apiBle import BleOperationError, RetryPolicy, DWM1001_BLE_API_COMMANDS, DEFAULT_TRANSIENT_EXCEPTIONS
+from dwm1001_fakeBle import FakeBleError
+
+def failingOperation(failures, result = 'ok'):
+        """ Coroutine function raising each exception of failures once, then returning result """
+        failures = list(failures)
+        calls = []
+        async def operation():
+                calls.append(len(calls))
+                if failures:
+                        raise failures.pop(0)
+                return result
+        return operation, calls
+
+def fastPolicy(**kwargs):
+        kwargs.setdefault('base_delay', 0.001)
+        kwargs.setdefault('max_delay', 0.002)
+        return RetryPolicy(**kwargs)
+
+@pytest.mark.parametrize('exc', [ConnectionResetError('reset'), asyncio.TimeoutError(), TimeoutError(), EOFError()])
+def test_transient_errors_are_retried(loop, exc):
+        operation, calls = failingOperation([exc, exc])
+        result, n_retries = loop.run_until_complete(fastPolicy().run(operation))
+        assert (result, n_retries, len(calls)) == ('ok', 2, 3)
+
+@pytest.mark.parametrize('exc', [PermissionError('denied'), FileNotFoundError('no adapter'), ValueError('bad frame'), KeyError('x')])
+def test_other_errors_are_raised_at_once(loop, exc):
+        operation, calls = failingOperation([exc])
+        with pytest.raises(type(exc)):
+                loop.run_until_complete(fastPolicy().run(operation))
+        assert len(calls) == 1
+
+def test_default_does_not_cover_every_oserror():
+        assert not issubclass(OSError, DEFAULT_TRANSIENT_EXCEPTIONS)
+        assert issubclass(BrokenPipeError, DEFAULT_TRANSIENT_EXCEPTIONS)
+
+def test_added_transient_exceptions_are_retried(loop):
+        policy = fastPolicy()
+        policy.addTransientExceptions((FakeBleError,))
+        policy.addTransientExceptions((FakeBleError,))
+        assert policy.transient_exceptions.count(FakeBleError) == 1
+        operation, calls = failingOperation([FakeBleError('link dropped')])
+        assert loop.run_until_complete(policy.run(operation)) == ('ok', 1)
+
+def test_attempts_are_exhausted(loop):
+        operation, calls = failingOperation([ConnectionError()] * 10)
+        with pytest.raises(BleOperationError) as error:
+                loop.run_until_complete(fastPolicy(max_attempts = 3).run(operation, 'Read'))
+        assert error.value.n_attempts == 3
+        assert len(calls) == 3
+        assert isinstance(error.value.__cause__, ConnectionError)
+
+def test_deadline_stops_retries(loop):
+        operation, calls = failingOperation([ConnectionError()] * 100)
+        policy = RetryPolicy(max_attempts = 100, base_delay = 0.05, max_delay = 0.05, jitter = False, deadline = 0.12)
+        with pytest.raises(BleOperationError, match = 'timed out'):
+                loop.run_until_complete(policy.run(operation))
+        assert 2 <= len(calls) <= 3
+
+def test_delay_grows_exponentially_up_to_max_delay():
+        policy = RetryPolicy(base_delay = 0.1, max_delay = 1.0, multiplier = 2.0, jitter = False)
+        assert [policy.delay(n) for n in range(1, 6)] == pytest.approx([0.1, 0.2, 0.4, 0.8, 1.0])
+        policy.jitter = True
+        assert all(0.0 <= policy.delay(3) <= 0.4 for _ in range(100))
+
+def test_progress_resets_the_attempt_budget(loop):
+        state = fastPolicy(max_attempts = 2).start('Batch')
+        async def failTwiceWithProgress():
+                await state.failed(ConnectionError())
+                state.reset()
+                await state.failed(ConnectionError())
+        loop.run_until_complete(failTwiceWithProgress())
+        assert state.n_retries == 2
+
+def test_on_retry_is_called_per_retry(loop):
+        retried = []
+        operation, _ = failingOperation([ConnectionError(), ConnectionError()])
+        loop.run_until_complete(fastPolicy().run(operation, on_retry = retried.append))
+        assert len(retried) == 2
+
+def test_handler_retries_transport_failures(loop, fleet, make_handler):
+        handler = make_handler(fleet, retry_policy = fastPolicy(max_attempts = 20), failure_rate = 0.2)
+        address = addressOf(fleet, 'DW1000')
+        for _ in range(10):
+                data = loop.run_until_complete(handler.readFromDevice(address, DWM1001_BLE_API_COMMANDS.NETWORK_ID))
+                assert len(data) == 2
+        counters = handler.stats()['counters']
+        assert sum(value for key, value in counters.items() if key.endswith('_retries')) > 0
+
+def test_handler_gives_up_on_a_dead_link(loop, fleet, make_handler):
+        handler = make_handler(fleet, retry_policy = fastPolicy(max_attempts = 3), failure_rate = 1.0)
+        with pytest.raises(BleOperationError):
+                loop.run_until_complete(handler.readFromDevice(addressOf(fleet, 'DW1000'), DWM1001_BLE_API_COMMANDS.NETWORK_ID))
@@ -0,0 +1,83 @@
+"""
+@file: test_sampleStore.py
+@description: samples written to a SampleStore read back with readSamples and
+              iterSamples, appends to existing stores and recovery of records
+              cut short by a crash
+@author: Esau Ortiz
+@date: october 2026
+"""
+import os
+import numpy as np
+import pytest
+from dwm1001_sampleStore import (SampleStore, HEADER_STRUCT, RECORD_STRUCT, iterSamples, readSamples,
+                                 intToModuleId, moduleIdToInt)
+
+SAMPLES = [(1.5, 'DW1000', '0x1234', 'DW1001', 2.5),
+           (2.5, 'DW1000', '0x1234', 'DW1002', 3.25),
+           (3.5, 'DW1A2B', 0x5678, 0x2020, 0.75)]
+
+def writeSamples(path, samples, **kwargs):
+        with SampleStore(path, **kwargs) as store:
+                for sample in samples:
+                        store.append(*sample)
+        return store
+
+def test_module_ids_round_trip():
+        assert moduleIdToInt('DW1A2B') == 0x1A2B
+        assert moduleIdToInt(0x1A2B) == 0x1A2B
+        assert intToModuleId(0x1A2B) == 'DW1A2B'
+
+def test_samples_round_trip(tmp_path):
+        path = str(tmp_path / 'samples.bin')
+        store = writeSamples(path, SAMPLES, flush_every = 2)
+        assert store.n_records == len(SAMPLES)
+        samples = readSamples(path)
+        assert samples['timestamp'].tolist() == [1.5, 2.5, 3.5]
+        assert samples['target'].tolist() == [0x1000, 0x1000, 0x1A2B]
+        assert samples['network'].tolist() == [0x1234, 0x1234, 0x5678]
+        assert samples['anchor'].tolist() == [0x1001, 0x1002, 0x2020]
+        assert samples['distance'].tolist() == [2.5, 3.25, 0.75]
+        assert list(iterSamples(path, chunk_size = 2)) == \
+                [(1.5, 'DW1000', 0x1234, 'DW1001', 2.5), (2.5, 'DW1000', 0x1234, 'DW1002', 3.25), (3.5, 'DW1A2B', 0x5678, 'DW2020', 0.75)]
+
+def test_existing_stores_are_appended_to(tmp_path):
+        path = str(tmp_path / 'samples.bin')
+        writeSamples(path, SAMPLES[:2])
+        writeSamples(path, SAMPLES[2:])
+        assert len(readSamples(path)) == len(SAMPLES)
+
+def test_empty_store(tmp_path):
+        path = str(tmp_path / 'samples.bin')
+        writeSamples(path, [])
+        assert len(readSamples(path)) == 0
+        assert list(iterSamples(path)) == []
+
+@pytest.mark.parametrize('flush_interval, n_flushed', [(3600.0, 0), (0.0, 1)])
+def test_buffered_records_are_flushed_on_time(tmp_path, flush_interval, n_flushed):
+        path = str(tmp_path / 'samples.bin')
+        with SampleStore(path, flush_every = 100, flush_interval = flush_interval) as store:
+                store.append(*SAMPLES[0])
+                expected = HEADER_STRUCT.size + n_flushed * RECORD_STRUCT.size if n_flushed else 0
+                assert os.path.getsize(path) == expected
+        assert len(readSamples(path)) == 1
+
+def test_truncated_record_is_dropped(tmp_path):
+        path = str(tmp_path / 'samples.bin')
+        writeSamples(path, SAMPLES)
+        # a crash while writing the last record
+        with open(path, 'rb+') as stream:
+                stream.truncate(HEADER_STRUCT.size + 2 * RECORD_STRUCT.size + RECORD_STRUCT.size // 2)
+        assert len(readSamples(path)) == 2
+        assert len(list(iterSamples(path))) == 2
+        # appending drops the partial record instead of misaligning the following ones
+        writeSamples(path, SAMPLES[2:])
+        samples = readSamples(path)
+        assert samples['timestamp'].tolist() == [1.5, 2.5, 3.5]
+        assert np.allclose(samples['distance'], [2.5, 3.25, 0.75])
+
+@pytest.mark.parametrize('content', [b'', b'DWMSMPL1', b'not a sample store file'])
+def test_non_store_files_are_rejected(tmp_path, content):
+        path = tmp_path / 'samples.bin'
+        path.write_bytes(content)
+        with pytest.raises(ValueError):
+                readSamples(str(path))
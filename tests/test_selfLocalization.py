@@ -0,0 +1,81 @@
+"""
+@file: test_selfLocalization.py
+@description: anchor self localization on synthetic range matrices
+@author: Esau Ortiz
+@date: october 2026
+"""
+import numpy as np
+import pytest
+from dwm1001_selfLocalization import localize, localizedPath, measuredPairs, referenceCoordinates, updateNodesCfg
+
+ANCHORS = np.array([[0.0, 0.0, 2.0], [8.0, 0.0, 2.2], [8.0, 6.0, 1.9], [0.0, 6.0, 2.4], [4.0, 3.0, 0.5], [2.0, 5.0, 1.2]])
+
+def rangeMatrix(positions, noise = 0.0, seed = 0):
+        ranges = np.linalg.norm(positions[:, None] - positions[None, :], axis = 2)
+        noise = np.random.RandomState(seed).normal(0.0, noise, ranges.shape)
+        ranges = ranges + np.triu(noise, 1) + np.triu(noise, 1).T
+        np.fill_diagonal(ranges, 0.0)
+        return ranges
+
+def pairwise(positions):
+        return np.linalg.norm(positions[:, None] - positions[None, :], axis = 2)
+
+def test_noisy_ranges_are_localized_in_the_reference_frame():
+        positions, residuals = localize(rangeMatrix(ANCHORS, noise = 0.02), reference = ANCHORS)
+        assert np.abs(positions - ANCHORS).max() < 0.15
+        assert len(residuals) == len(ANCHORS) * (len(ANCHORS) - 1) // 2
+        assert np.abs(residuals).max() < 0.1
+
+def test_missing_ranges_are_tolerated():
+        ranges = rangeMatrix(ANCHORS)
+        for i, j in [(0, 2), (1, 3)]:
+                ranges[i, j] = ranges[j, i] = np.nan
+        positions, residuals = localize(ranges, reference = ANCHORS)
+        assert len(residuals) == 15 - 2
+        assert np.abs(positions - ANCHORS).max() < 0.01
+
+def test_outliers_are_downweighted():
+        anchors = np.vstack([ANCHORS, [[6.0, 2.0, 2.8], [3.0, 1.0, 2.6]]])
+        ranges = rangeMatrix(anchors, noise = 0.01)
+        ranges[0, 4] = ranges[4, 0] = ranges[0, 4] + 1.5
+        i, j, _, _ = measuredPairs(ranges)
+        robust, residuals = localize(ranges, reference = anchors)
+        least_squares, _ = localize(ranges, reference = anchors, loss = 'linear')
+        worst = np.argmax(np.abs(residuals))
+        assert (i[worst], j[worst]) == (0, 4)
+        assert np.abs(robust - anchors).max() < np.abs(least_squares - anchors).max()
+
+def test_disconnected_anchors_are_rejected():
+        ranges = np.full((4, 4), np.nan)
+        ranges[0, 1] = ranges[1, 0] = 5.0
+        ranges[2, 3] = ranges[3, 2] = 5.0
+        with pytest.raises(ValueError):
+                localize(ranges)
+
+def test_without_reference_the_canonical_frame_is_used():
+        positions, _ = localize(rangeMatrix(ANCHORS))
+        assert np.allclose(positions[0], 0.0, atol = 1e-3)
+        assert np.allclose(positions[1, 1:], 0.0, atol = 1e-3)
+        assert abs(positions[2, 2]) < 1e-3
+        assert np.allclose(pairwise(positions), pairwise(ANCHORS), atol = 1e-3)
+
+def test_dim_2_keeps_the_reference_heights():
+        reference = ANCHORS.copy()
+        positions, _ = localize(rangeMatrix(ANCHORS), reference = reference, dim = 2)
+        assert np.array_equal(positions[:, 2], ANCHORS[:, 2])
+        assert np.abs(positions[:, :2] - ANCHORS[:, :2]).max() < 0.01
+
+def test_nodes_cfg_round_trip():
+        nodes_cfg = {'n_networks': 2,
+                     'network0': {'n_anchors': 1, 'anchor0_id': 'DW1000', 'anchor0_coordinates': [0.0, 0.0, 2.0]},
+                     'network1': {'n_anchors': 2, 'anchor0_id': 'DW1001', 'anchor1_id': 'DW1002',
+                                  'anchor1_coordinates': [1.0, 2.0, 3.0]}}
+        anchor_ids = ['DW1000', 'DW1001', 'DW1002']
+        reference = referenceCoordinates(nodes_cfg, anchor_ids)
+        assert np.array_equal(reference[[0, 2]], [[0.0, 0.0, 2.0], [1.0, 2.0, 3.0]])
+        assert np.all(np.isnan(reference[1]))
+        assert updateNodesCfg(nodes_cfg, anchor_ids, [[0.0, 0.0, 2.0], [4.00049, 0.0, 2.0], [1.0, 2.0, 3.0]]) == 3
+        assert nodes_cfg['network1']['anchor0_coordinates'] == [4.0, 0.0, 2.0]
+
+def test_localized_path_keeps_the_original_file():
+        assert localizedPath('/params/nodes_cfg/default.yaml') == '/params/nodes_cfg/default.localized.yaml'
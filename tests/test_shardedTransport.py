@@ -0,0 +1,93 @@
+"""
+@file: test_shardedTransport.py
+@description: connections spread by ShardedTransport over simulated adapters,
+              capped at the capacity of the adapters, and failover to another
+              adapter after a failed connection
+@author: Esau Ortiz
+@date: october 2026
+"""
+import asyncio
+import pytest
+from conftest import addressOf
+from dwm1001_apiBle import AsyncBleConnectionHandler, RetryPolicy, DWM1001_BLE_API_COMMANDS
+from dwm1001_bleDiscovery import DeviceCache, GattCache
+from dwm1001_bleTransport import ShardedTransport
+from dwm1001_fakeBle import FakeBleClient, FakeBleTransport
+
+def makeTransports(fleet, n_adapters = 2, max_connections = None, **kwargs):
+        kwargs.setdefault('connect_latency', 0.01)
+        kwargs.setdefault('read_latency', 0.001)
+        kwargs.setdefault('write_latency', 0.001)
+        return [FakeBleTransport(fleet, adapter = f'hci{i}', max_connections = max_connections, seed = i, **kwargs)
+                for i in range(n_adapters)]
+
+def makeHandler(transport, max_connections = 10):
+        return AsyncBleConnectionHandler(max_connections, device_cache = DeviceCache(None), gatt_cache = GattCache(None),
+                                         retry_policy = RetryPolicy(max_attempts = 5, base_delay = 0.001, max_delay = 0.01),
+                                         collect_stats = True, transport = transport)
+
+@pytest.fixture
+def peak_connections(monkeypatch):
+        """ {adapter: most simultaneous connections} of the fake transports """
+        peaks = {}
+        connect = FakeBleClient.connect
+        async def trackingConnect(self, *args, **kwargs):
+                result = await connect(self, *args, **kwargs)
+                adapter = self.transport.adapter
+                peaks[adapter] = max(peaks.get(adapter, 0), len(self.transport.connected))
+                return result
+        monkeypatch.setattr(FakeBleClient, 'connect', trackingConnect)
+        return peaks
+
+@pytest.mark.parametrize('adapter_connections, per_adapter_limit, expected', [
+        ([3, 5], None, 8),
+        ([3, 5], 4, 7),
+        ([None, 5], 4, 8),
+        ([None, 5], None, None)])
+def test_capacity_sums_adapter_limits(fleet, adapter_connections, per_adapter_limit, expected):
+        transports = [FakeBleTransport(fleet, adapter = f'hci{i}', max_connections = max_connections)
+                      for i, max_connections in enumerate(adapter_connections)]
+        assert ShardedTransport(transports, per_adapter_limit).capacity() == expected
+
+def test_handler_connections_are_capped_at_capacity(loop, fleet, peak_connections):
+        transport = ShardedTransport(makeTransports(fleet, max_connections = 2))
+        handler = makeHandler(transport, max_connections = 10)
+        assert handler.pool.max_connections == 4
+        addresses = [device.address for device in fleet.devices.values()]
+        results = loop.run_until_complete(asyncio.gather(*[handler.readFromDevice(address, DWM1001_BLE_API_COMMANDS.NETWORK_ID)
+                                                             for address in addresses]))
+        loop.run_until_complete(handler.close())
+        assert results == [fleet.devices[address].read(DWM1001_BLE_API_COMMANDS.NETWORK_ID) for address in addresses]
+        # no adapter was asked for more connections than its controller accepts
+        assert peak_connections == {'hci0': 2, 'hci1': 2}
+        assert sum(device.n_connections for device in fleet.devices.values()) == len(addresses)
+
+def test_connections_go_to_the_least_loaded_adapter(loop, fleet):
+        transport = ShardedTransport(makeTransports(fleet), max_connections_per_adapter = 2)
+        clients = [transport.createClient(device.address) for device in fleet.devices.values()]
+        loop.run_until_complete(asyncio.gather(*[client.connect() for client in clients[:4]]))
+        assert transport.load() == {'hci0': 2, 'hci1': 2}
+        # adapters at the per adapter limit are still used once every adapter is
+        loop.run_until_complete(clients[4].connect())
+        assert sorted(transport.load().values()) == [2, 3]
+        loop.run_until_complete(clients[0].disconnect())
+        assert sum(transport.load().values()) == 4
+
+def test_ties_go_to_the_adapter_with_the_best_rssi(loop, fleet):
+        near, far = makeTransports(fleet)
+        near.rssi, far.rssi = -50, -80
+        transport = ShardedTransport([far, near])
+        loop.run_until_complete(transport.discover(timeout = 0.01))
+        assert transport.assign(addressOf(fleet, 'DW1000')).transport is near
+
+def test_failed_connection_fails_over_to_another_adapter(loop, fleet):
+        broken, working = makeTransports(fleet)
+        broken.failure_rate = 1.0
+        transport = ShardedTransport([broken, working])
+        handler = makeHandler(transport)
+        address = addressOf(fleet, 'DW1000')
+        assert loop.run_until_complete(handler.readFromDevice(address, DWM1001_BLE_API_COMMANDS.NETWORK_ID)) \
+                == fleet.byName('DW1000').read(DWM1001_BLE_API_COMMANDS.NETWORK_ID)
+        assert transport.load() == {'hci0': 0, 'hci1': 1}
+        assert transport.shards[0].recentlyFailed(address, transport.failure_timeout)
+        loop.run_until_complete(handler.close())
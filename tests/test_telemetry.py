@@ -0,0 +1,72 @@
+"""
+@file: test_telemetry.py
+@description: telemetry history buffers and the poller against the simulated
+              fleet
+@author: Esau Ortiz
+@date: october 2026
+"""
+import json
+import pytest
+from conftest import addressOf
+from dwm1001_telemetry import TelemetryHistory, TelemetryPoller, TAG_CHARACTERISTICS
+
+ANCHORS = ['DW1000', 'DW1001', 'DW1002', 'DW1003']
+
+def makePoller(fleet, handler, interval = 0.02, **kwargs):
+        poller = TelemetryPoller(handler, {name: addressOf(fleet, name) for name in ANCHORS}, interval = interval, **kwargs)
+        poller.addDevice('DW8000', addressOf(fleet, 'DW8000'), TAG_CHARACTERISTICS)
+        return poller
+
+def test_history_is_bounded():
+        history = TelemetryHistory(max_samples = 3)
+        for timestamp in range(5):
+                history.add('DW1000', 'proxy_positions', timestamp, [None] * timestamp)
+        assert history.series('DW1000', 'proxy_positions.n_positions') == [(2, 2), (3, 3), (4, 4)]
+        assert history.delta('DW1000', 'proxy_positions.n_positions') == 2
+        history.add('DW1000', 'proxy_positions', 5, [])
+        # decreasing counters were reset, e.g. by a reboot
+        assert history.delta('DW1000', 'proxy_positions.n_positions') is None
+
+def test_unknown_characteristics_are_rejected(fleet, make_handler):
+        poller = TelemetryPoller(make_handler(fleet))
+        with pytest.raises(ValueError):
+                poller.addDevice('DW1000', addressOf(fleet, 'DW1000'), ['statistics', 'temperature'])
+
+def test_poller_without_devices_returns_at_once(loop, fleet, make_handler):
+        history = loop.run_until_complete(TelemetryPoller(make_handler(fleet)).run(duration = 10.0))
+        assert history.devices() == []
+
+def test_poller_fills_the_history(loop, fleet, make_handler, tmp_path):
+        samples = []
+        poller = makePoller(fleet, make_handler(fleet), on_sample = lambda name, timestamp, values: samples.append(name))
+        history = loop.run_until_complete(poller.run(duration = 0.2))
+        assert sorted(history.devices()) == sorted(ANCHORS + ['DW8000'])
+        for name in ANCHORS:
+                status = poller.status[name]
+                assert status['n_polls'] >= 2 and status['n_failures'] == 0
+                # static characteristics are read on the first poll only
+                assert len(history.samples[name]['device_info']) == 1
+                assert len(history.samples[name]['statistics']) == status['n_polls']
+        assert set(history.samples['DW8000']) == set(TAG_CHARACTERISTICS)
+        assert len(samples) == sum(status['n_polls'] for status in poller.status.values())
+        history.export(str(tmp_path / 'telemetry.json'))
+        with open(tmp_path / 'telemetry.json') as stream:
+                assert set(json.load(stream)) == set(history.devices())
+
+def test_degraded_devices_are_reported(loop, fleet, make_handler):
+        fleet.byName('DW1002').degradation = 1.0
+        poller = makePoller(fleet, make_handler(fleet))
+        loop.run_until_complete(poller.run(duration = 0.2))
+        degraded = poller.degraded()
+        assert 'DW1002' in degraded
+        assert not set(degraded) & {'DW1000', 'DW1001', 'DW1003'}
+
+def test_failed_polls_are_counted(loop, fleet, make_handler):
+        handler = make_handler(fleet)
+        poller = makePoller(fleet, handler)
+        del fleet.devices[addressOf(fleet, 'DW1003')]
+        loop.run_until_complete(poller.run(duration = 0.2))
+        status = poller.status['DW1003']
+        assert status['n_polls'] == 0 and status['n_failures'] >= 1
+        assert status['last_error'] is not None
+        assert poller.degraded(max_failures = 1)['DW1003'][0].endswith('failed polls')